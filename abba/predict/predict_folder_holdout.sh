@@ -1,4 +1,6 @@
 export DATA_ROOT_PATH=/media/alaska2/all_qfs/
+# Run from abba/, abba imports the shared jpeg_tools package from the repository root
+export PYTHONPATH=$(pwd)/..:$PYTHONPATH
 export folders='Cover/ JUNIWARD/ JMiPOD/ UERD/'
 export splits='val test'
 
@@ -48,10 +48,7 @@ class TrainRetriever(Dataset):
         kind, image_name, label = self.kinds[index], self.image_names[index], self.labels[index]
         
         if  self.decoder == 'NR':
-            tmp = jio.read(f'{DATA_ROOT_PATH}/{kind}/{image_name}')
-            image = decompress_structure(tmp)
-            image = ycbcr2rgb(image).astype(np.float32)
-            image /= 255.0
+            image = decompress_rgb(f'{DATA_ROOT_PATH}/{kind}/{image_name}')
         else:
             image = cv2.imread(f'{DATA_ROOT_PATH}/{kind}/{image_name}', cv2.IMREAD_COLOR)
             image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB).astype(np.float32)
@@ -84,10 +81,7 @@ class TestRetriever(Dataset):
     def __getitem__(self, index: int):
         image_name = self.image_names[index]
         if  self.decoder == 'NR':
-            tmp = jio.read(f'{self.folder}/{image_name}')
-            image = decompress_structure(tmp).astype(np.float32)
-            image = ycbcr2rgb(image)
-            image /= 255.0
+            image = decompress_rgb(f'{self.folder}/{image_name}')
         else:
             image = cv2.imread(f'{self.folder}/{image_name}', cv2.IMREAD_COLOR)
             image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB).astype(np.float32)
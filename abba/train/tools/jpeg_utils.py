@@ -5,6 +5,7 @@ import os
 from scipy import fftpack
 from numpy.lib.stride_tricks import as_strided
 from collections import defaultdict 
+from jpeg_tools import NonRoundedDecoder, block_idct2_fast, get_qf_index, qf_dicts_from_index, read_dct_from_jpegio
 
 quantization_dict = dict()
 quantization_dict[95] = np.array([[ 2,  1,  1,  2,  2,  4,  5,  6],
@@ -57,36 +58,24 @@ def segmented_stride(M, fun, blk_size=(8,8), overlap=(0,0)):
 
 def decompress_structure(S):
     # Decompress DCT coefficients C using quantization table Q
-    H = S.coef_arrays[0].shape[0]
-    W = S.coef_arrays[0].shape[1]
-    n = len(S.coef_arrays)
-    assert H % 8 == 0, 'Wrong image size'
-    assert W % 8 == 0, 'Wrong image size'
-    I = np.zeros((H,W,n),dtype=np.float64) # Returns Y, Cb and Cr
-    for i in range(n):
-        Q = S.quant_tables[S.comp_info[i].quant_tbl_no]
-        # this multiplication is done on integers
-        fun = lambda x : np.multiply(x,Q)
-        C = np.float64(segmented_stride(S.coef_arrays[i], fun)) 
-        fun = lambda x: fftpack.idct(fftpack.idct(x, norm='ortho',axis=2), norm='ortho',axis=3) + 128
-        I[:,:,i] = segmented_stride(C, fun)
-    return I
+    # Returns Y, Cb and Cr planes as HxWx3 float32 array
+    C, Q = read_dct_from_jpegio(S)
+    assert C.shape[1] % 8 == 0, 'Wrong image size'
+    assert C.shape[2] % 8 == 0, 'Wrong image size'
+    I = block_idct2_fast(C, Q) + 128
+    return np.ascontiguousarray(I.transpose(1, 2, 0))
 
+NR_RGB_DECODER = NonRoundedDecoder('rgb')
 
+def decompress_rgb(path):
+    # Non-rounded RGB image in [0, 1] range (float32), see jpeg_tools.decoder
+    return NR_RGB_DECODER(path)
 
-def get_qf_dicts(folder, names):
-    names_qf = dict()
-    for name in tqdm(names, bar_format='{l_bar}{bar:20}{r_bar}{bar:-20b}'):
-        tmp = jio.read(os.path.join(folder, name))
-        Q = tmp.quant_tables[0]
-        for qf in [75,90,95]:
-            if (Q == quantization_dict[qf]).all():
-                q = qf
-        names_qf[name] = q
-        
-    qf_names = defaultdict(list)
-    for key, value in sorted(names_qf.items()):
-        qf_names[value].append(key)
-        
-    return (names_qf, qf_names)
-        
\ No newline at end of file
+
+def get_qf_dicts(folder, names, index_fname=None):
+    # Quality factors are read from DQT segments of JPEG headers in parallel, without decoding the images.
+    # The header index is cached next to the folder (e.g. Test_qf_index.pkl), only new files are read again
+    if index_fname is None:
+        index_fname = os.path.normpath(folder) + '_qf_index.pkl'
+    index = get_qf_index([os.path.join(folder, name) for name in names], index_fname)
+    return qf_dicts_from_index(index)
@@ -1,4 +1,6 @@
 export DATA_ROOT_PATH=/media/alaska2/all_qfs/
+# Run from abba/, abba imports the shared jpeg_tools package from the repository root
+export PYTHONPATH=$(pwd)/..:$PYTHONPATH
 
 # Training ImageNet pretrained models
 # All these scripts fit in a Titan RTX GPU, please adjust the batch size/learning rate (at your own risk)
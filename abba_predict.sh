@@ -1,5 +1,7 @@
 export DATA_ROOT_PATH=/media/alaska2/all_qfs/
 day=0729
+# abba imports the shared jpeg_tools package from the repository root
+export PYTHONPATH=$(pwd):$PYTHONPATH
 cd abba/
 python3 download_weights.py 
 python3 predict/predict_folder_outofbounds.py
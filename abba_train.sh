@@ -1,4 +1,6 @@
 export DATA_ROOT_PATH=/media/alaska2/all_qfs/
+# abba imports the shared jpeg_tools package from the repository root
+export PYTHONPATH=$(pwd):$PYTHONPATH
 cd abba/
 
 python3 download_splits.py
@@ -5,6 +5,8 @@
 export DATA_ROOT_PATH=/media/alaska2/all_qfs/
 export folders='Cover/ JUNIWARD/ JMiPOD/ UERD/'
 export splits='val test'
+# abba imports the shared jpeg_tools package from the repository root
+export PYTHONPATH=$(pwd):$PYTHONPATH
 cd abba/
 
 for split in $splits
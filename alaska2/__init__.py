@@ -1,6 +1,10 @@
 from .models import *
 from .augmentations import *
 from .dataset import *
+from .sampler import *
+from .mining import *
+from .resume import *
+from .feature_cache import *
 from .loss import *
 from .visualization import *
 from .optim import *
@@ -8,3 +12,7 @@ from .scheduler import *
 from .metric import *
 from .tsa import *
 from .predict import *
+from .cascade import *
+from .export import *
+from .batch_augmentations import *
+from .device_loader import *
@@ -1,9 +1,12 @@
-from typing import Tuple
+from collections import defaultdict
+from functools import lru_cache
+from typing import Dict, Tuple
 
 import albumentations as A
 import cv2
 import random
 import numpy as np
+import torch
 from albumentations.core.composition import BaseCompose
 
 from .dataset import (
@@ -27,10 +30,16 @@ __all__ = [
     "get_obliterate_augs",
     "DctTranspose",
     "DctRandomRotate90",
+    "DctRandomD4",
+    "d4_transform_planes",
     "dct_transpose",
     "dct_transpose_fast",
     "dct_rot90",
     "dct_rot90_fast",
+    "torch_dct_fliplr",
+    "torch_dct_flipud",
+    "torch_dct_rot90",
+    "torch_dct_transpose",
     "RandomCrop8",
 ]
 
@@ -179,6 +188,60 @@ def dct_transpose_fast(dct_image: np.ndarray) -> np.ndarray:
     return np.ascontiguousarray(dct_image)
 
 
+def _torch_dct_blocks(x: torch.Tensor) -> torch.Tensor:
+    # [B, C, H, W] -> [B, C, H//8, 8, W//8, 8]
+    b, c, h, w = x.size()
+    return x.view(b, c, h // 8, 8, w // 8, 8)
+
+
+def _torch_alternating_sign(x: torch.Tensor) -> torch.Tensor:
+    # Sign of basis functions of odd frequencies changes when 8x8 block is mirrored: [1, -1, 1, -1, ...]
+    return torch.tensor([1, -1, 1, -1, 1, -1, 1, -1], dtype=x.dtype, device=x.device)
+
+
+def torch_dct_fliplr(x: torch.Tensor) -> torch.Tensor:
+    """
+    Horizontal flip of DCT coefficients tensor [B, C, H, W] (equivalent to AF.torch_fliplr in pixel domain)
+    """
+    blocks = _torch_dct_blocks(x).flip(4) * _torch_alternating_sign(x).view(1, 1, 1, 1, 1, 8)
+    return blocks.reshape(x.size())
+
+
+def torch_dct_flipud(x: torch.Tensor) -> torch.Tensor:
+    """
+    Vertical flip of DCT coefficients tensor [B, C, H, W] (equivalent to AF.torch_flipud in pixel domain)
+    """
+    blocks = _torch_dct_blocks(x).flip(2) * _torch_alternating_sign(x).view(1, 1, 1, 8, 1, 1)
+    return blocks.reshape(x.size())
+
+
+def torch_dct_transpose(x: torch.Tensor) -> torch.Tensor:
+    """
+    Transpose of DCT coefficients tensor [B, C, H, W] (equivalent to AF.torch_transpose in pixel domain)
+    """
+    b, c, h, w = x.size()
+    return _torch_dct_blocks(x).permute(0, 1, 4, 5, 2, 3).reshape(b, c, w, h)
+
+
+def torch_dct_rot90(x: torch.Tensor, k: int = 1) -> torch.Tensor:
+    """
+    Counter-clockwise rotation of DCT coefficients tensor [B, C, H, W] by k*90 degrees
+    (equivalent to torch.rot90(x, k, dims=(2, 3)) in pixel domain). Same as dct_rot90_fast for batch on device.
+    """
+    k = k % 4
+    if k == 0:
+        return x
+
+    b, c, h, w = x.size()
+    blocks = torch.rot90(_torch_dct_blocks(x), k, dims=(2, 4))
+    sign = torch.from_numpy(get_rot90_block(k, np.float32)).to(device=x.device, dtype=x.dtype)
+    blocks = blocks * sign.view(1, 1, 1, 8, 1, 8)
+    if k == 1 or k == 3:
+        blocks = blocks.permute(0, 1, 2, 5, 4, 3)
+        return blocks.reshape(b, c, w, h)
+    return blocks.reshape(b, c, h, w)
+
+
 class DctRandomRotate90(A.RandomRotate90):
     """Randomly rotate the input by 90 degrees zero or more times.
 
@@ -239,6 +302,123 @@ class DctTranspose(A.Transpose):
         }
 
 
+@lru_cache(maxsize=64)
+def _d4_gather_index(rows: int, cols: int, factor: int, transpose: bool, dct: bool):
+    """
+    Flat source index and sign of each output pixel for rot90(factor) followed by optional transpose.
+    Computed by applying the reference transforms to an image of (signed) pixel indexes.
+    :return: Tuple of (index, sign or None, output rows, output cols)
+    """
+    if dct:
+        image = np.arange(1, rows * cols + 1, dtype=np.float64).reshape((rows, cols, 1))
+        image = dct_rot90_fast(image, factor)
+        if transpose:
+            image = dct_transpose_fast(image)
+        image = image[..., 0]
+        index = np.abs(image).astype(np.int64) - 1
+        sign = np.sign(image).reshape(-1, 1)
+    else:
+        index = np.rot90(np.arange(rows * cols).reshape((rows, cols)), factor)
+        if transpose:
+            index = index.T
+        sign = None
+
+    out_rows, out_cols = index.shape
+    index = np.ascontiguousarray(index).reshape(-1)
+    index.flags.writeable = False
+    if sign is not None:
+        sign.flags.writeable = False
+    return index, sign, out_rows, out_cols
+
+
+def d4_transform_planes(
+    planes: Dict[str, np.ndarray], dct_keys, factor: int, transpose: bool
+) -> Dict[str, np.ndarray]:
+    """
+    Apply rot90(factor) followed by optional transpose to all spatially aligned planes at once.
+    Planes of the same size & dtype are stacked along channels and transformed with a single gather
+    (and sign multiply for DCT planes). Results are returned as views of the stacked output.
+    :param planes: Dictionary of [H, W] or [H, W, C] arrays
+    :param dct_keys: Keys of planes with 8x8 block DCT coefficients, which are transformed in DCT domain
+    :return: Dictionary of transformed planes
+    """
+    if factor == 0 and not transpose:
+        return dict(planes)
+
+    groups = defaultdict(list)
+    for key, value in planes.items():
+        groups[(key in dct_keys, value.dtype, value.shape[0], value.shape[1])].append(key)
+
+    result = {}
+    for (dct, dtype, rows, cols), keys in groups.items():
+        index, sign, out_rows, out_cols = _d4_gather_index(rows, cols, factor, transpose, dct)
+
+        flat = [planes[key].reshape((rows * cols, -1)) for key in keys]
+        stacked = flat[0] if len(flat) == 1 else np.concatenate(flat, axis=1)
+        transformed = np.take(stacked, index, axis=0)
+        if sign is not None:
+            transformed *= sign.astype(dtype, copy=False)
+        transformed = transformed.reshape((out_rows, out_cols, -1))
+
+        start = 0
+        for key, value in zip(keys, flat):
+            channels = value.shape[1]
+            if planes[key].ndim == 2:
+                result[key] = transformed[..., start]
+            else:
+                result[key] = transformed[..., start : start + channels]
+            start += channels
+
+    return result
+
+
+class DctRandomD4(A.DualTransform):
+    """
+    Random D4 transform (equivalent to DctRandomRotate90(p=1) followed by DctTranspose(p=0.5)) that is applied
+    to all image, mask and DCT targets at once with d4_transform_planes.
+
+    Targets:
+        image, mask, input_dct
+    """
+
+    def __init__(self, always_apply=False, p=1.0):
+        super().__init__(always_apply, p)
+
+    @property
+    def targets(self):
+        return {"image": self.apply, "mask": self.apply_to_mask, "input_dct": self.apply_dct}
+
+    def get_params(self):
+        return {"factor": random.randint(0, 3), "transpose": random.random() < 0.5}
+
+    def apply(self, img, factor=0, transpose=False, **params):
+        return d4_transform_planes({"image": img}, [], factor, transpose)["image"]
+
+    def apply_dct(self, img, factor=0, transpose=False, **params):
+        return d4_transform_planes({"input_dct": img}, ["input_dct"], factor, transpose)["input_dct"]
+
+    def apply_with_params(self, params, force_apply=False, **kwargs):
+        if params is None:
+            return kwargs
+
+        additional_targets = getattr(self, "_additional_targets", {})
+        planes = {}
+        dct_keys = []
+        for key, value in kwargs.items():
+            target = additional_targets.get(key, key)
+            if isinstance(value, np.ndarray) and target in self.targets:
+                planes[key] = value
+                if target == "input_dct":
+                    dct_keys.append(key)
+
+        result = dict(kwargs)
+        result.update(d4_transform_planes(planes, dct_keys, params["factor"], params["transpose"]))
+        return result
+
+    def get_transform_init_args_names(self):
+        return ()
+
+
 class RandomCrop8(A.RandomCrop):
     def apply(self, img, h_start=0, w_start=0, **params):
         height, width = img.shape[:2]
@@ -328,8 +508,7 @@ def get_augmentations(augmentations_level: str, image_size: Tuple[int, int] = (5
             [
                 maybe_crop,
                 # D4
-                DctRandomRotate90(p=1.0),
-                DctTranspose(p=0.5),
+                DctRandomD4(),
             ],
             additional_targets=additional_targets,
         )
@@ -338,8 +517,7 @@ def get_augmentations(augmentations_level: str, image_size: Tuple[int, int] = (5
         return A.ReplayCompose(
             [
                 maybe_crop,
-                DctRandomRotate90(p=1.0),
-                DctTranspose(p=0.5),
+                DctRandomD4(),
                 A.CoarseDropout(max_holes=1, min_height=32, max_height=256, min_width=32, max_width=256, p=0.2),
             ],
             additional_targets=additional_targets,
@@ -349,8 +527,7 @@ def get_augmentations(augmentations_level: str, image_size: Tuple[int, int] = (5
         return A.ReplayCompose(
             [
                 maybe_crop,
-                DctRandomRotate90(p=1.0),
-                DctTranspose(p=0.5),
+                DctRandomD4(),
                 NonClippedRandomBrightness(),
                 A.CoarseDropout(max_holes=1, min_height=32, max_height=256, min_width=32, max_width=256, p=0.2),
             ],
@@ -0,0 +1,167 @@
+from typing import Dict, List, Optional
+
+import torch
+from catalyst.dl import Callback, CallbackOrder, RunnerState
+
+from .dataset import INPUT_FEATURES_DCT_KEY, INPUT_TRUE_MODIFICATION_MASK
+from .predict import D4TTA
+
+__all__ = [
+    "BatchAugmentation",
+    "BatchAugmentationCallback",
+    "get_batch_augmentation_callbacks",
+    "get_batch_augmentations",
+]
+
+
+class BatchAugmentation:
+    """
+    On-device counterpart of get_augmentations() that is applied to the collated batch [B, C, H, W].
+    Each sample gets its own random D4 transform (uniform over the 8 elements of the group, same as
+    DctRandomRotate90(p=1) + DctTranspose(p=0.5)) and optionally a single coarse dropout hole.
+    Samples sharing the same D4 element are transformed with one tensor op.
+
+    Like the albumentations pipeline, keys in dct_keys are transformed in DCT domain, the modification mask
+    follows the pixel-domain transform but is not affected by dropout, and all other keys are treated as images.
+    """
+
+    def __init__(
+        self,
+        keys: List[str],
+        d4=True,
+        dropout_p=0.0,
+        dropout_min_size=32,
+        dropout_max_size=256,
+        dct_keys=(INPUT_FEATURES_DCT_KEY,),
+        mask_key=INPUT_TRUE_MODIFICATION_MASK,
+    ):
+        """
+        :param keys: Input keys to augment (spatially aligned tensors [B, C, H, W])
+        :param dropout_p: Per-sample probability of coarse dropout
+        :param mask_key: Key of the modification mask. It is always augmented if present in the batch,
+            so that target of the mask loss stays aligned with the inputs.
+        """
+        self.keys = list(keys)
+        if mask_key is not None and mask_key not in self.keys:
+            self.keys.append(mask_key)
+        self.d4 = d4
+        self.dropout_p = dropout_p
+        self.dropout_min_size = dropout_min_size
+        self.dropout_max_size = dropout_max_size
+        self.dct_keys = dct_keys
+        self.mask_key = mask_key
+
+    def __repr__(self):
+        return f"BatchAugmentation(keys={self.keys}, d4={self.d4}, dropout_p={self.dropout_p})"
+
+    @torch.no_grad()
+    def __call__(self, batch: Dict) -> Dict:
+        keys = [key for key in self.keys if key in batch]
+        if not keys:
+            return batch
+
+        batch = dict(batch)
+        reference = batch[keys[0]]
+        batch_size, device = reference.size(0), reference.device
+
+        if self.d4:
+            views = torch.randint(len(D4TTA.views), (batch_size,), device=device)
+            for key in keys:
+                batch[key] = self.apply_d4(batch[key], views, key in self.dct_keys)
+
+        if self.dropout_p > 0:
+            holes = self.get_dropout_holes(batch_size, reference.size(2), reference.size(3), device)
+            for key in keys:
+                if key in self.dct_keys or key == self.mask_key:
+                    continue
+                batch[key] = batch[key].masked_fill(holes, 0)
+
+        return batch
+
+    @staticmethod
+    def apply_d4(x: torch.Tensor, views: torch.Tensor, dct: bool) -> torch.Tensor:
+        """
+        :param x: Tensor [B, C, H, W] (or [B, H, W]) with square spatial dimensions
+        :param views: Index of D4 element (in order of D4TTA.views) for each sample [B]
+        :param dct: Whether to transform x in DCT domain
+        """
+        if x.size(-1) != x.size(-2):
+            raise ValueError(f"D4 augmentation requires square inputs, got {tuple(x.size())}")
+
+        view_fns = D4TTA.dct_views if dct else D4TTA.views
+        has_channels = x.dim() == 4
+        if not has_channels:
+            x = x.unsqueeze(1)
+
+        result = x.clone()
+        for view_index in range(1, len(view_fns)):
+            (indexes,) = torch.nonzero(views == view_index, as_tuple=True)
+            if len(indexes):
+                result[indexes] = view_fns[view_index](x[indexes])
+
+        return result if has_channels else result.squeeze(1)
+
+    def get_dropout_holes(self, batch_size: int, rows: int, cols: int, device) -> torch.Tensor:
+        """
+        :return: Boolean mask [B, 1, H, W] of a single random rectangle for samples selected with dropout_p
+        """
+        max_size = torch.tensor([min(self.dropout_max_size, rows), min(self.dropout_max_size, cols)], device=device)
+        min_size = torch.tensor([min(self.dropout_min_size, rows), min(self.dropout_min_size, cols)], device=device)
+        size = min_size + (torch.rand((batch_size, 2), device=device) * (max_size - min_size + 1)).long()
+        size = torch.min(size, max_size)
+        start = (
+            torch.rand((batch_size, 2), device=device) * (torch.tensor([rows, cols], device=device) - size + 1)
+        ).long()
+
+        y = torch.arange(rows, device=device).view(1, rows, 1)
+        x = torch.arange(cols, device=device).view(1, 1, cols)
+        holes = (
+            (y >= start[:, 0].view(-1, 1, 1))
+            & (y < (start[:, 0] + size[:, 0]).view(-1, 1, 1))
+            & (x >= start[:, 1].view(-1, 1, 1))
+            & (x < (start[:, 1] + size[:, 1]).view(-1, 1, 1))
+        )
+        holes &= (torch.rand(batch_size, device=device) < self.dropout_p).view(-1, 1, 1)
+        return holes.unsqueeze(1)
+
+
+def get_batch_augmentations(augmentations_level: str, keys: List[str]) -> Optional[BatchAugmentation]:
+    """
+    Batch augmentation that is equivalent to get_augmentations(augmentations_level) for 512x512 inputs.
+    NonClippedRandomBrightness of "hard" level is a no-op in the per-sample pipeline and is omitted here as well.
+    :return: BatchAugmentation or None for levels without spatial augmentations
+    """
+    augmentations_level = augmentations_level.lower()
+    if augmentations_level == "none":
+        return None
+    if augmentations_level == "light":
+        return BatchAugmentation(keys, d4=True)
+    if augmentations_level in {"medium", "hard"}:
+        return BatchAugmentation(keys, d4=True, dropout_p=0.2)
+
+    raise KeyError(f"Augmentations level {augmentations_level} is not supported on GPU")
+
+
+class BatchAugmentationCallback(Callback):
+    """
+    Applies BatchAugmentation to the batch on device before forward pass (train loaders only).
+    Runner calls forward with the same dict object as state.input, so the batch is updated in place.
+    """
+
+    def __init__(self, augmentation: BatchAugmentation, on_train_only=True):
+        super().__init__(CallbackOrder.Internal)
+        self.augmentation = augmentation
+        self.on_train_only = on_train_only
+        self.is_needed = True
+
+    def on_loader_start(self, state: RunnerState):
+        self.is_needed = not self.on_train_only or state.loader_name.startswith("train")
+
+    def on_batch_start(self, state: RunnerState):
+        if self.is_needed:
+            state.input.update(self.augmentation(state.input))
+
+
+def get_batch_augmentation_callbacks(augmentations_level: str, keys: List[str]) -> List[Callback]:
+    augmentation = get_batch_augmentations(augmentations_level, keys)
+    return [BatchAugmentationCallback(augmentation)] if augmentation is not None else []
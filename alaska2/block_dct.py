@@ -0,0 +1,84 @@
+from typing import Optional
+
+import numpy as np
+import torch
+
+from jpeg_tools.block_dct import (
+    DCTMTX,
+    _dctmtx,
+    block_dct2,
+    block_idct2,
+    block_idct2_fast,
+    block_idct2_ortho,
+    blockify,
+    get_dctmtx,
+    unblockify,
+)
+
+__all__ = [
+    "DCTMTX",
+    "get_dctmtx",
+    "blockify",
+    "unblockify",
+    "block_idct2",
+    "block_idct2_ortho",
+    "block_idct2_fast",
+    "block_dct2",
+    "torch_block_idct2",
+    "torch_block_dct2",
+]
+
+
+def _torch_blockify(x: torch.Tensor) -> torch.Tensor:
+    # [B, C, H, W] -> [B, C, H//8, W//8, 8, 8]
+    b, c, h, w = x.size()
+    return x.view(b, c, h // 8, 8, w // 8, 8).permute(0, 1, 2, 4, 3, 5)
+
+
+def _torch_unblockify(x: torch.Tensor) -> torch.Tensor:
+    # [B, C, H//8, W//8, 8, 8] -> [B, C, H, W]
+    b, c, hb, wb = x.size()[:4]
+    return x.permute(0, 1, 2, 4, 3, 5).reshape(b, c, hb * 8, wb * 8)
+
+
+def torch_block_idct2(dct: torch.Tensor, qm: Optional[torch.Tensor] = None) -> torch.Tensor:
+    """
+    Batched inverse 2D DCT of 8x8 blocks on device.
+    Results are equal to numpy implementation up to floating-point rounding.
+
+    :param dct: Tensor of DCT coefficients of shape [B,C,H,W]
+    :param qm: Optional quantization matrices of shape [8,8], [C,8,8] or [B,C,8,8]
+    :return: Decoded tensor of shape [B,C,H,W] of the same floating-point type as input (float32 for integer input)
+    """
+    if not dct.is_floating_point():
+        dct = dct.float()
+
+    blocks = _torch_blockify(dct)
+    if qm is not None:
+        qm = qm.to(device=dct.device, dtype=dct.dtype)
+        if qm.dim() == 3:
+            qm = qm.unsqueeze(0)
+        if qm.dim() == 4:
+            qm = qm[:, :, None, None, :, :]
+        blocks = blocks * qm
+
+    T = torch.from_numpy(_dctmtx(np.float64 if dct.dtype == torch.float64 else np.float32)).to(dct.device, dct.dtype)
+    blocks = T.t() @ blocks @ T
+    return _torch_unblockify(blocks)
+
+
+def torch_block_dct2(image: torch.Tensor) -> torch.Tensor:
+    """
+    Batched forward 2D DCT of 8x8 blocks on device.
+
+    :param image: Tensor of shape [B,C,H,W]
+    :return: DCT coefficients of shape [B,C,H,W] (each 8x8 block holds coefficients of the corresponding pixel block)
+    """
+    if not image.is_floating_point():
+        image = image.float()
+
+    T = torch.from_numpy(_dctmtx(np.float64 if image.dtype == torch.float64 else np.float32)).to(
+        image.device, image.dtype
+    )
+    blocks = T @ _torch_blockify(image) @ T.t()
+    return _torch_unblockify(blocks)
@@ -0,0 +1,180 @@
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+import torch
+from torch import nn
+
+from .dataset import OUTPUT_PRED_MODIFICATION_FLAG
+from .metric import batch_wauc
+
+__all__ = [
+    "OUTPUT_CASCADE_DEPTH",
+    "CascadeEnsembler",
+    "calibrate_cascade_bands",
+    "cascade_cost",
+    "cascade_from_checkpoints",
+    "simulate_cascade",
+]
+
+# Number of models that were evaluated for each sample
+OUTPUT_CASCADE_DEPTH = "cascade_depth"
+
+Band = Optional[Tuple[float, float]]
+
+
+class CascadeEnsembler(nn.Module):
+    """
+    Early-exit ensemble. Models are evaluated in given order (cheapest first) and their outputs are averaged
+    (Same as Ensembler). After each stage, samples whose running average probability of modification flag is
+    outside of the stage band [low, high] are considered confident and are not passed to the following models.
+    Thus, output of each sample is the average of the first K models, where K is in the OUTPUT_CASCADE_DEPTH output.
+    Models must return probabilities (See ApplySigmoidTo).
+    """
+
+    def __init__(self, models: List[nn.Module], bands: Sequence[Band], inputs: List[str], outputs: List[str]):
+        """
+        :param bands: Uncertainty band for each stage except the last one (None - no early exit after this stage)
+        :param inputs: Input keys that are passed to models (Must have batch dimension)
+        :param outputs: Output keys to average. Must include OUTPUT_PRED_MODIFICATION_FLAG
+        """
+        super().__init__()
+        if len(bands) != len(models) - 1:
+            raise ValueError(f"Expected {len(models) - 1} bands, got {len(bands)}")
+        if OUTPUT_PRED_MODIFICATION_FLAG not in outputs:
+            raise ValueError(f"Outputs must include {OUTPUT_PRED_MODIFICATION_FLAG}")
+
+        self.models = nn.ModuleList(models)
+        self.bands = list(bands)
+        self.inputs = inputs
+        self.outputs = outputs
+
+    def forward(self, **kwargs):
+        batch_size = kwargs[self.inputs[0]].size(0)
+        device = kwargs[self.inputs[0]].device
+
+        active = torch.arange(batch_size, device=device)
+        depth = torch.zeros(batch_size, dtype=torch.long, device=device)
+        sums: Dict[str, torch.Tensor] = {}
+
+        for stage, model in enumerate(self.models):
+            output = model(**dict((key, kwargs[key][active]) for key in self.inputs))
+            for key in self.outputs:
+                if key not in sums:
+                    sums[key] = output[key].new_zeros((batch_size,) + output[key].size()[1:])
+                sums[key][active] += output[key]
+            depth[active] += 1
+
+            band = self.bands[stage] if stage < len(self.bands) else None
+            if band is not None:
+                running = sums[OUTPUT_PRED_MODIFICATION_FLAG][active].view(len(active), -1)[:, 0] / depth[active]
+                active = active[(running >= band[0]) & (running <= band[1])]
+            if len(active) == 0:
+                break
+
+        result = {}
+        for key, value in sums.items():
+            result[key] = value / depth.view((batch_size,) + (1,) * (value.dim() - 1)).to(value.dtype)
+        result[OUTPUT_CASCADE_DEPTH] = depth
+        return result
+
+
+def simulate_cascade(probas: List[np.ndarray], bands: Sequence[Band]) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Apply cascade to precomputed predictions (Same logic as CascadeEnsembler)
+    :param probas: Probabilities of modification flag of each model [N], in cascade order
+    :return: Tuple of cascade probabilities [N] and number of evaluated models of each sample [N]
+    """
+    sums = np.zeros(len(probas[0]), dtype=np.float64)
+    depth = np.zeros(len(probas[0]), dtype=int)
+    active = np.ones(len(probas[0]), dtype=bool)
+
+    for stage, p in enumerate(probas):
+        sums[active] += p[active]
+        depth[active] += 1
+
+        band = bands[stage] if stage < len(bands) else None
+        if band is not None:
+            running = sums / np.maximum(depth, 1)
+            active &= (running >= band[0]) & (running <= band[1])
+
+    return sums / depth, depth
+
+
+def cascade_cost(depth: np.ndarray, costs: Sequence[float]) -> float:
+    """
+    :return: Average cost of the cascade relative to cost of the full ensemble
+    """
+    cumulative = np.cumsum(np.concatenate([[0], costs]))
+    return float(np.mean(cumulative[depth]) / cumulative[-1])
+
+
+def calibrate_cascade_bands(
+    probas: List[np.ndarray],
+    y_true: np.ndarray,
+    costs: Optional[Sequence[float]] = None,
+    max_wauc_drop: float = 0.001,
+    quantiles: Sequence[float] = (0, 0.05, 0.1, 0.15, 0.2, 0.25, 0.3, 0.35, 0.4, 0.45, 0.5),
+) -> List[Band]:
+    """
+    Greedily pick band of each stage on held-out predictions. Candidate bounds are quantiles of running
+    probability of samples that reach the stage; chosen band minimizes cost of the cascade, while keeping
+    wAUC of the cascade within max_wauc_drop of the full ensemble.
+    :param probas: Probabilities of modification flag of each model [N], in cascade order
+    :param y_true: Binary targets [N]
+    :param costs: Relative cost of each model (Default - equal)
+    :return: Bands for CascadeEnsembler
+    """
+    costs = costs if costs is not None else [1.0] * len(probas)
+    full_wauc = batch_wauc(y_true, np.mean(probas, axis=0))[0]
+
+    bands: List[Band] = [None] * (len(probas) - 1)
+    for stage in range(len(bands)):
+        _, depth = simulate_cascade(probas[: stage + 1], bands[:stage])
+        reached = depth == stage + 1
+        running = np.mean(probas[: stage + 1], axis=0)[reached]
+        if not len(running):
+            break
+
+        candidates = [
+            (np.quantile(running, low), np.quantile(running, 1 - high)) for low in quantiles for high in quantiles
+        ]
+        predictions, depths = zip(*[simulate_cascade(probas, bands[:stage] + [band]) for band in candidates])
+        scores = batch_wauc(np.tile(y_true, (len(candidates), 1)), np.stack(predictions))
+        candidate_costs = [cascade_cost(d, costs) for d in depths]
+
+        # No-exit band (quantiles 0 & 1) is always feasible, since earlier bands already satisfy the constraint
+        feasible = [i for i in range(len(candidates)) if scores[i] >= full_wauc - max_wauc_drop] or [0]
+        best = min(feasible, key=lambda i: (candidate_costs[i], -scores[i]))
+        bands[stage] = tuple(float(x) for x in candidates[best])
+
+    return bands
+
+
+def cascade_from_checkpoints(
+    checkpoints: List[str], bands: Sequence[Band], outputs: List[str], tta=None, temperature=1, strict=True
+) -> Tuple[CascadeEnsembler, List[Dict], List[str]]:
+    """
+    Build CascadeEnsembler from checkpoints (In cascade order). Each model gets sigmoid/softmax activation
+    and TTA, so that cascade of all stages is equivalent to ensemble_from_checkpoints(activation="after_model").
+    :return: Tuple of model, loaded checkpoints and required features
+    """
+    from .models import ensemble_from_checkpoints
+
+    models, loaded_checkpoints, required_features = [], [], []
+    for checkpoint_fname in checkpoints:
+        model, loaded, features = ensemble_from_checkpoints(
+            [checkpoint_fname],
+            strict=strict,
+            outputs=outputs,
+            activation="after_model",
+            tta=tta,
+            temperature=temperature,
+        )
+        models.append(model)
+        loaded_checkpoints.extend(loaded)
+        for feature in features:
+            if feature not in required_features:
+                required_features.append(feature)
+
+    model = CascadeEnsembler(models, bands=bands, inputs=required_features, outputs=outputs)
+    return model.eval(), loaded_checkpoints, required_features
@@ -26,6 +26,7 @@ from alaska2 import get_criterions, get_optimizer, get_scheduler, draw_predictio
 from alaska2.dataset import get_datasets
 from alaska2.models.timm import TimmRgbModel
 from alaska2.models.ycrcb import YCrCbModel
+from alaska2.resume import ResumableSampler, ResumeCallback
 
 
 class StageConfig:
@@ -75,6 +76,9 @@ class StageConfig:
         # This parameter controls whether to restore model state for best checkpoint from this stage
         self.restore_best = False
 
+        # Save resume checkpoint every N train batches (0 - only at the end of each epoch)
+        self.resume_every = 500
+
 
 class ExperimenetConfig:
     def __init__(self):
@@ -97,7 +101,10 @@ def make_experiment_name(exp_config: ExperimenetConfig):
     return checkpoint_prefix
 
 
-def run_whole_training(experiment_name: str, exp_config: ExperimenetConfig, runs_dir="runs"):
+def run_whole_training(experiment_name: str, exp_config: ExperimenetConfig, runs_dir="runs", resume=False):
+    """
+    :param resume: If True, continue interrupted training in existing experiment directory
+    """
     model = get_model(exp_config.model_name, dropout=exp_config.dropout).cuda()
 
     if exp_config.transfer_from_checkpoint:
@@ -116,18 +123,22 @@ def run_whole_training(experiment_name: str, exp_config: ExperimenetConfig, runs
         report_checkpoint(checkpoint)
 
     experiment_dir = os.path.join(runs_dir, experiment_name)
-    os.makedirs(experiment_dir, exist_ok=False)
+    os.makedirs(experiment_dir, exist_ok=resume)
 
     config_fname = os.path.join(experiment_dir, f"config.json")
     with open(config_fname, "w") as f:
         f.write(json.dumps(jsonpickle.encode(exp_config), indent=2))
 
     for stage in exp_config.stages:
-        run_stage_training(model, stage, exp_config, experiment_dir=experiment_dir)
+        run_stage_training(model, stage, exp_config, experiment_dir=experiment_dir, resume=resume)
 
 
 def run_stage_training(
-    model: Union[TimmRgbModel, YCrCbModel], config: StageConfig, exp_config: ExperimenetConfig, experiment_dir: str
+    model: Union[TimmRgbModel, YCrCbModel],
+    config: StageConfig,
+    exp_config: ExperimenetConfig,
+    experiment_dir: str,
+    resume: bool = False,
 ):
     # Preparing model
     freeze_model(model, freeze_bn=config.freeze_bn)
@@ -171,6 +182,17 @@ def run_stage_training(
     if config.show:
         callbacks += [ShowPolarBatchesCallback(draw_predictions, metric="loss", minimize=True)]
 
+    train_sampler = ResumableSampler(train_sampler, len(train_ds))
+    callbacks += [
+        ResumeCallback(
+            os.path.join(experiment_dir, config.stage_name, "checkpoints", "resume.pth"),
+            sampler=train_sampler,
+            resume=resume,
+            save_every=config.resume_every,
+            fp16=config.fp16,
+        )
+    ]
+
     loaders = collections.OrderedDict()
     loaders["train"] = DataLoader(
         train_ds,
@@ -178,7 +200,7 @@ def run_stage_training(
         num_workers=exp_config.num_workers,
         pin_memory=True,
         drop_last=True,
-        shuffle=train_sampler is None,
+        shuffle=False,
         sampler=train_sampler,
     )
 
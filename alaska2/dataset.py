@@ -1,8 +1,11 @@
+import hashlib
+import itertools
 import json
 import math
 import os
 import random
-from typing import Tuple, Optional, Union, List
+import tempfile
+from typing import Dict, Tuple, Optional, Union, List
 
 import albumentations as A
 import cv2
@@ -11,8 +14,15 @@ import pandas as pd
 import torch
 from pytorch_toolbelt.utils import fs
 from pytorch_toolbelt.utils.torch_utils import tensor_from_rgb_image
-from scipy import fftpack
 from torch.utils.data import Dataset, ConcatDataset
+from torch.utils.data.dataloader import default_collate
+
+from .block_dct import DCTMTX, get_dctmtx, block_dct2, block_idct2, block_idct2_ortho
+from .dct_store import dct_store_key, get_dct_store
+from .embedding_masks import get_embedding_masks
+from .feature_cache import FeatureCache
+from .jpeg_decoder import decode_non_rounded, read_dct_from_npz
+from .sampler import BalancedQFSampler
 
 INPUT_IMAGE_KEY = "image"
 INPUT_FEATURES_ELA_KEY = "input_ela"
@@ -22,6 +32,7 @@ INPUT_FEATURES_BLUR_KEY = "input_blur"
 INPUT_FEATURES_DECODING_RESIDUAL_KEY = "input_residual"
 INPUT_IMAGE_ID_KEY = "image_id"
 INPUT_IMAGE_QF_KEY = "image_qf"
+INPUT_INDEX_KEY = "index"
 INPUT_FOLD_KEY = "fold"
 
 HOLDOUT_FOLD = -1
@@ -87,6 +98,7 @@ __all__ = [
     "INPUT_IMAGE_ID_KEY",
     "INPUT_IMAGE_KEY",
     "INPUT_IMAGE_QF_KEY",
+    "INPUT_INDEX_KEY",
     "INPUT_TRUE_MODIFICATION_FLAG",
     "INPUT_TRUE_MODIFICATION_MASK",
     "INPUT_TRUE_MODIFICATION_TYPE",
@@ -100,6 +112,7 @@ __all__ = [
     "OUTPUT_PRED_MODIFICATION_MASK",
     "OUTPUT_PRED_MODIFICATION_TYPE",
     "OUTPUT_PRED_PAYLOAD_BITS",
+    "MultiStegoPairedDataset",
     "PairedImageDataset",
     "TrainingValidationDataset",
     "bitmix",
@@ -112,12 +125,16 @@ __all__ = [
     "get_datasets",
     "get_datasets_paired",
     "get_holdout",
+    "get_manifest",
     "get_istego100k_test_other",
     "get_istego100k_test_same",
     "get_istego100k_train",
     "get_negatives_ds",
     "get_test_dataset",
     "idct8",
+    "load_dct",
+    "paired_collate",
+    "read_image_with_features",
 ]
 
 
@@ -128,31 +145,6 @@ def compute_dct_fast(jpeg_file):
     return dct_y, dct_cb, dct_cr
 
 
-def get_dctmtx():
-    [Col, Row] = np.meshgrid(range(8), range(8))
-    T = 0.5 * np.cos(np.pi * (2 * Col + 1) * Row / (2 * 8))
-    T[0, :] = T[0, :] / np.sqrt(2)
-
-    return T.astype(np.float32)
-
-
-# DCTMTX = np.array(
-#     [
-#         [0.3536, 0.3536, 0.3536, 0.3536, 0.3536, 0.3536, 0.3536, 0.3536],
-#         [0.4904, 0.4157, 0.2778, 0.0975, -0.0975, -0.2778, -0.4157, -0.4904],
-#         [0.4619, 0.1913, -0.1913, -0.4619, -0.4619, -0.1913, 0.1913, 0.4619],
-#         [0.4157, -0.0975, -0.4904, -0.2778, 0.2778, 0.4904, 0.0975, -0.4157],
-#         [0.3536, -0.3536, -0.3536, 0.3536, 0.3536, -0.3536, -0.3536, 0.3536],
-#         [0.2778, -0.4904, 0.0975, 0.4157, -0.4157, -0.0975, 0.4904, -0.2778],
-#         [0.1913, -0.4619, 0.4619, -0.1913, -0.1913, 0.4619, -0.4619, 0.1913],
-#         [0.0975, -0.2778, 0.4157, -0.4904, 0.4904, -0.4157, 0.2778, -0.0975],
-#     ],
-#     dtype=np.float32,
-# )
-
-DCTMTX = get_dctmtx()
-
-
 def compute_dct_slow(jpeg_file):
     image = cv2.imread(jpeg_file)
     ycrcb = cv2.cvtColor(image, cv2.COLOR_BGR2YCR_CB)
@@ -193,77 +185,44 @@ def dct2spatial(image):
 def dct8(image):
     assert image.shape[0] % 8 == 0
     assert image.shape[1] % 8 == 0
-    dct_shape = (image.shape[0] // 8, image.shape[1] // 8, 64)
-    dct_image = np.zeros(dct_shape, dtype=np.float32)
 
     one_over_255 = np.float32(1.0 / 255.0)
     image = image * one_over_255
-    for i in range(0, image.shape[0], 8):
-        for j in range(0, image.shape[1], 8):
-            # dct = cv2.dct(image[i : i + 8, j : j + 8])
-            dct = DCTMTX @ image[i : i + 8, j : j + 8] @ DCTMTX.T
-            dct_image[i // 8, j // 8, :] = dct.flatten()
-
-    return dct_image
+    return block_dct2(image).astype(np.float32, copy=False)
 
 
 def idct8(dct):
     assert dct.shape[2] == 64
-    dct_image = np.zeros((dct.shape[0] * 8, dct.shape[1] * 8), dtype=np.float32)
-
-    for i in range(0, dct.shape[0]):
-        for j in range(0, dct.shape[1]):
-            img = DCTMTX.T @ dct[i, j].reshape((8, 8)) @ DCTMTX
-            dct_image[i * 8 : (i + 1) * 8, j * 8 : (j + 1) * 8] = img
-
-    return dct_image
+    return block_idct2(dct2spatial(dct))
 
 
 def idct8v2(dct, qm=None):
-    decoded_image = np.zeros((dct.shape[0], dct.shape[1], 1), dtype=np.float32)
-
-    def idct2(a):
-        import scipy
-
-        return scipy.fftpack.idct(scipy.fftpack.idct(a, axis=0, norm="ortho"), axis=1, norm="ortho")
-
     if qm is None:
-        for i in range(0, dct.shape[0] // 8):
-            for j in range(0, dct.shape[1] // 8):
-                img = idct2(dct[i * 8 : (i + 1) * 8, j * 8 : (j + 1) * 8])
-                # img = DCTMTX.T @ (dct[i * 8 : (i + 1) * 8, j * 8 : (j + 1) * 8]) @ DCTMTX
-                decoded_image[i * 8 : (i + 1) * 8, j * 8 : (j + 1) * 8, 0] = img
+        decoded_image = block_idct2_ortho(dct)
     else:
-        for i in range(0, dct.shape[0] // 8):
-            for j in range(0, dct.shape[1] // 8):
-                img = DCTMTX.T @ (qm * dct[i * 8 : (i + 1) * 8, j * 8 : (j + 1) * 8]) @ DCTMTX
-                decoded_image[i * 8 : (i + 1) * 8, j * 8 : (j + 1) * 8, 0] = img
-
-    return decoded_image
+        decoded_image = block_idct2(dct, qm)
 
+    return np.expand_dims(decoded_image, -1)
 
-def decode_bgr_from_dct(dct_file):
-    dct = np.load(dct_file)
-    dct_y = dct["dct_y"]
-    dct_cr = dct["dct_cr"]
-    dct_cb = dct["dct_cb"]
-
-    y = idct8v2(dct_y)
-    cr = idct8v2(dct_cr)
-    cb = idct8v2(dct_cb)
 
-    y += 127.5
-    y /= 255.0
+def load_dct(fname: str) -> np.ndarray:
+    """
+    Load dequantized DCT coefficients of the image from the DCT store of the dataset (if present) or from .npz file.
+    :param fname: Image or .npz filename
+    :return: Array [3, H, W] in (Y, Cb, Cr) order. May be a read-only view of memory-mapped store.
+    """
+    store = get_dct_store(os.path.dirname(os.path.dirname(os.path.abspath(fname))))
+    if store is not None:
+        key = dct_store_key(fname)
+        if key in store:
+            return store[key]
 
-    cr += 127.5
-    cr /= 255.0
+    dct, _ = read_dct_from_npz(fs.change_extension(fname, ".npz"))
+    return dct
 
-    cb += 127.5
-    cb /= 255.0
 
-    img_ycrcb = np.dstack([y, cr, cb])
-    bgr_from_dct = cv2.cvtColor(img_ycrcb, cv2.COLOR_YCrCb2BGR)
-    return bgr_from_dct
+def decode_bgr_from_dct(dct_file):
+    return decode_non_rounded(load_dct(dct_file), convention="bgr")
 
 
 def compute_decoding_residual(image: np.ndarray, dct_fname: str) -> np.ndarray:
@@ -271,23 +230,32 @@ def compute_decoding_residual(image: np.ndarray, dct_fname: str) -> np.ndarray:
     return bgr_from_dct * 255 - image.astype(np.float32)
 
 
-def compute_ela(image, quality_steps=[75]):
+def jpeg_recompress(image: np.ndarray, quality: int) -> np.ndarray:
+    retval, buf = cv2.imencode(".jpg", image, [cv2.IMWRITE_JPEG_QUALITY, quality])
+    return cv2.imdecode(buf, cv2.IMREAD_COLOR)
+
+
+def compute_ela(image, quality_steps=[75], recompressed=None):
+    """
+    :param recompressed: Optional dict of already recompressed images (quality -> image)
+    """
     diff = np.zeros((image.shape[0], image.shape[1], 3 * len(quality_steps)), dtype=np.float32)
 
     for i, q in enumerate(quality_steps):
-        retval, buf = cv2.imencode(".jpg", image, [cv2.IMWRITE_JPEG_QUALITY, q])
-        image_lq = cv2.imdecode(buf, cv2.IMREAD_COLOR)
+        image_lq = recompressed[q] if recompressed is not None else jpeg_recompress(image, q)
         np.subtract(image_lq, image, out=diff[..., i * 3 : i * 3 + 3], dtype=np.float32)
 
     return diff
 
 
-def compute_ela_rich(image, quality_steps=[75, 90, 95]):
+def compute_ela_rich(image, quality_steps=[75, 90, 95], recompressed=None):
+    """
+    :param recompressed: Optional dict of already recompressed images (quality -> image)
+    """
     diff = np.zeros((image.shape[0], image.shape[1], len(quality_steps) * 3), dtype=np.float32)
 
     for i, q in enumerate(quality_steps):
-        retval, buf = cv2.imencode(".jpg", image, [cv2.IMWRITE_JPEG_QUALITY, q])
-        image_lq = cv2.imdecode(buf, cv2.IMREAD_COLOR)
+        image_lq = recompressed[q] if recompressed is not None else jpeg_recompress(image, q)
         diff[..., i * 3 : i * 3 + 3] = np.abs(np.subtract(image_lq, image, dtype=np.float32))
 
     return diff
@@ -311,54 +279,152 @@ def compute_blur_features(image):
     return diff
 
 
-def compute_features(image: np.ndarray, image_fname: str, features):
-    sample = {}
-
-    if INPUT_FEATURES_ELA_KEY in features:
-        sample[INPUT_FEATURES_ELA_KEY] = compute_ela(image)
-
-    if INPUT_TRUE_MODIFICATION_MASK in features:
-        if "Cover" in image_fname:
-            mask = np.zeros((512, 512, 1), dtype=np.float32)
-        else:
-            mask_fname = fs.change_extension(image_fname, ".png")
-            mask = cv2.imread(mask_fname, cv2.IMREAD_GRAYSCALE)
-            mask = (mask > 0).astype(np.float32)
-            mask = np.expand_dims(mask, -1)
-
-        sample[INPUT_TRUE_MODIFICATION_MASK] = mask
+def read_modification_mask(image_fname: str) -> np.ndarray:
+    """
+    Target of the modification mask loss. If embedding masks were computed by make_masks.py, the mask marks
+    whole changed 8x8 blocks (See EmbeddingMasks.get_pixel_mask). Otherwise it is read from per-image .png file,
+    which is a pixel-level mask for files made by the former make_masks.py.
+    :return: Float mask [H, W, 1]
+    """
+    if "Cover" in image_fname:
+        return np.zeros((512, 512, 1), dtype=np.float32)
+
+    masks = get_embedding_masks(os.path.dirname(os.path.dirname(os.path.abspath(image_fname))))
+    key = dct_store_key(image_fname)
+    if masks is not None and key in masks:
+        return np.expand_dims(masks.get_pixel_mask(key).astype(np.float32), -1)
+
+    mask_fname = fs.change_extension(image_fname, ".png")
+    mask = cv2.imread(mask_fname, cv2.IMREAD_GRAYSCALE)
+    mask = (mask > 0).astype(np.float32)
+    return np.expand_dims(mask, -1)
+
+
+def _dct_planes(dct):
+    dct_y, dct_cb, dct_cr = dct
+    return {
+        INPUT_FEATURES_DCT_Y_KEY: np.array(dct_y),
+        INPUT_FEATURES_DCT_CB_KEY: np.array(dct_cb),
+        INPUT_FEATURES_DCT_CR_KEY: np.array(dct_cr),
+    }
+
+
+def _decoded_planes(dct):
+    dct_y, dct_cb, dct_cr = dct
+    # This normalization roughly puts values into zero mean and unit variance
+    return {
+        INPUT_FEATURES_CHANNEL_Y_KEY: idct8v2(dct_y),
+        INPUT_FEATURES_CHANNEL_CB_KEY: idct8v2(dct_cb),
+        INPUT_FEATURES_CHANNEL_CR_KEY: idct8v2(dct_cr),
+    }
+
+
+# Intermediate values shared between features: name -> (dependencies, function).
+# "image" (BGR pixels) and "image_fname" are inputs of the graph.
+FEATURE_INTERMEDIATES = {
+    "dct": (["image_fname"], load_dct),
+    "decoded_bgr": (["dct"], lambda dct: decode_non_rounded(dct, convention="bgr")),
+    "jpeg_75": (["image"], lambda image: jpeg_recompress(image, 75)),
+    "jpeg_90": (["image"], lambda image: jpeg_recompress(image, 90)),
+    "jpeg_95": (["image"], lambda image: jpeg_recompress(image, 95)),
+}
 
-    if INPUT_FEATURES_ELA_RICH_KEY in features:
-        sample[INPUT_FEATURES_ELA_RICH_KEY] = compute_ela_rich(image, quality_steps=[75, 90, 95])
+# Features: input key -> (dependencies, function returning dict of outputs). Features are computed in this order.
+FEATURE_GRAPH = {
+    INPUT_FEATURES_ELA_KEY: (
+        ["image", "jpeg_75"],
+        lambda image, jpeg_75: {INPUT_FEATURES_ELA_KEY: compute_ela(image, [75], {75: jpeg_75})},
+    ),
+    INPUT_TRUE_MODIFICATION_MASK: (
+        ["image_fname"],
+        lambda image_fname: {INPUT_TRUE_MODIFICATION_MASK: read_modification_mask(image_fname)},
+    ),
+    INPUT_FEATURES_ELA_RICH_KEY: (
+        ["image", "jpeg_75", "jpeg_90", "jpeg_95"],
+        lambda image, jpeg_75, jpeg_90, jpeg_95: {
+            INPUT_FEATURES_ELA_RICH_KEY: compute_ela_rich(image, [75, 90, 95], {75: jpeg_75, 90: jpeg_90, 95: jpeg_95})
+        },
+    ),
+    INPUT_FEATURES_BLUR_KEY: (["image"], lambda image: {INPUT_FEATURES_BLUR_KEY: compute_blur_features(image)}),
+    INPUT_FEATURES_JPEG_FLOAT: (["decoded_bgr"], lambda decoded_bgr: {INPUT_FEATURES_JPEG_FLOAT: 255 * decoded_bgr}),
+    INPUT_FEATURES_DECODING_RESIDUAL_KEY: (
+        ["image", "decoded_bgr"],
+        lambda image, decoded_bgr: {
+            INPUT_FEATURES_DECODING_RESIDUAL_KEY: decoded_bgr * 255 - image.astype(np.float32)
+        },
+    ),
+    INPUT_FEATURES_DCT_KEY: (["dct"], lambda dct: {INPUT_FEATURES_DCT_KEY: np.dstack(dct)}),
+    INPUT_FEATURES_DCT_Y_KEY: (["dct"], _dct_planes),
+    INPUT_FEATURES_CHANNEL_Y_KEY: (["dct"], _decoded_planes),
+}
 
-    if INPUT_FEATURES_BLUR_KEY in features:
-        sample[INPUT_FEATURES_BLUR_KEY] = compute_blur_features(image)
 
-    if INPUT_FEATURES_JPEG_FLOAT in features:
-        dct_file = fs.change_extension(image_fname, ".npz")
-        sample[INPUT_FEATURES_JPEG_FLOAT] = 255 * decode_bgr_from_dct(dct_file)
+# Deterministic features that can be stored in FeatureCache: input key -> (parameters, storage type).
+# ELA and blur features are differences of uint8 images, so int16 storage is lossless.
+CACHEABLE_FEATURES = {
+    INPUT_FEATURES_ELA_KEY: ("q=75", np.int16),
+    INPUT_FEATURES_ELA_RICH_KEY: ("q=75,90,95", np.int16),
+    INPUT_FEATURES_BLUR_KEY: ("pyr=2,4,8", np.int16),
+    INPUT_FEATURES_DECODING_RESIDUAL_KEY: ("bgr", np.float16),
+}
 
-    if INPUT_FEATURES_DECODING_RESIDUAL_KEY in features:
-        dct_file = fs.change_extension(image_fname, ".npz")
-        sample[INPUT_FEATURES_DECODING_RESIDUAL_KEY] = compute_decoding_residual(image, dct_file)
 
-    if INPUT_FEATURES_DCT_KEY in features:
-        dct_file = np.load(fs.change_extension(image_fname, ".npz"))
-        dct_y, dct_cb, dct_cr = (dct_file["dct_y"], dct_file["dct_cb"], dct_file["dct_cr"])
-        sample[INPUT_FEATURES_DCT_KEY] = np.dstack([dct_y, dct_cb, dct_cr])
+def compute_features(image: np.ndarray, image_fname: str, features, feature_cache: Optional[FeatureCache] = None):
+    """
+    Compute requested input features of the sample.
+    Intermediate values (DCT coefficients, decoded image, recompressed JPEGs) are computed at most once
+    and released as soon as the last feature that depends on them has been computed.
 
-    if INPUT_FEATURES_DCT_Y_KEY in features:
-        dct_file = np.load(fs.change_extension(image_fname, ".npz"))
-        sample[INPUT_FEATURES_DCT_Y_KEY] = dct_file["dct_y"]
-        sample[INPUT_FEATURES_DCT_CB_KEY] = dct_file["dct_cb"]
-        sample[INPUT_FEATURES_DCT_CR_KEY] = dct_file["dct_cr"]
+    :param feature_cache: Optional cache of deterministic features (See CACHEABLE_FEATURES)
+    """
+    requested = [key for key in FEATURE_GRAPH.keys() if key in features]
 
-    if INPUT_FEATURES_CHANNEL_Y_KEY in features:
-        dct_file = np.load(fs.change_extension(image_fname, ".npz"))
-        # This normalization roughly puts values into zero mean and unit variance
-        sample[INPUT_FEATURES_CHANNEL_Y_KEY] = idct8v2(dct_file["dct_y"])
-        sample[INPUT_FEATURES_CHANNEL_CB_KEY] = idct8v2(dct_file["dct_cb"])
-        sample[INPUT_FEATURES_CHANNEL_CR_KEY] = idct8v2(dct_file["dct_cr"])
+    sample = {}
+    if feature_cache is not None:
+        for key in requested:
+            if key in CACHEABLE_FEATURES:
+                value = feature_cache.get(image_fname, key, CACHEABLE_FEATURES[key][0])
+                if value is not None:
+                    sample[key] = value
+        requested = [key for key in requested if key not in sample]
+
+    # Count consumers of each intermediate value
+    consumers = {}
+
+    def visit(name):
+        consumers[name] = consumers.get(name, 0) + 1
+        if consumers[name] == 1 and name in FEATURE_INTERMEDIATES:
+            for dependency in FEATURE_INTERMEDIATES[name][0]:
+                visit(dependency)
+
+    for key in requested:
+        for dependency in FEATURE_GRAPH[key][0]:
+            visit(dependency)
+
+    values = {"image": image, "image_fname": image_fname}
+
+    def release(name):
+        consumers[name] -= 1
+        if consumers[name] == 0 and name in FEATURE_INTERMEDIATES:
+            del values[name]
+
+    def evaluate(name):
+        if name not in values:
+            dependencies, fn = FEATURE_INTERMEDIATES[name]
+            values[name] = fn(*[evaluate(x) for x in dependencies])
+            for dependency in dependencies:
+                release(dependency)
+        return values[name]
+
+    for key in requested:
+        dependencies, fn = FEATURE_GRAPH[key]
+        sample.update(fn(*[evaluate(x) for x in dependencies]))
+        for dependency in dependencies:
+            release(dependency)
+
+        if feature_cache is not None and key in CACHEABLE_FEATURES:
+            params, dtype = CACHEABLE_FEATURES[key]
+            feature_cache.put(image_fname, key, sample[key], params, dtype)
 
     return sample
 
@@ -381,9 +447,11 @@ class TrainingValidationDataset(Dataset):
         features: List[str],
         obliterate: A.Compose = None,
         obliterate_p=0.0,
+        feature_cache: Optional[FeatureCache] = None,
     ):
         """
         :param obliterate - Augmentation that destroys embedding.
+        :param feature_cache - Optional persistent cache of ELA / blur / residual features.
         """
         if targets is not None:
             if len(images) != len(targets):
@@ -398,6 +466,7 @@ class TrainingValidationDataset(Dataset):
 
         self.obliterate = obliterate
         self.obliterate_p = obliterate_p
+        self.feature_cache = feature_cache
 
     def __len__(self):
         return len(self.images)
@@ -418,11 +487,15 @@ class TrainingValidationDataset(Dataset):
         qf = self.quality[index]
         data = {}
         data["image"] = image
-        data.update(compute_features(image, image_fname, self.features))
+        data.update(compute_features(image, image_fname, self.features, self.feature_cache))
 
         data = self.transform(**data)
 
-        sample = {INPUT_IMAGE_ID_KEY: os.path.basename(self.images[index]), INPUT_IMAGE_QF_KEY: int(qf)}
+        sample = {
+            INPUT_IMAGE_ID_KEY: os.path.basename(self.images[index]),
+            INPUT_IMAGE_QF_KEY: int(qf),
+            INPUT_INDEX_KEY: index,
+        }
 
         if self.bits is not None:
             # OK
@@ -474,8 +547,10 @@ class PairedImageDataset(Dataset):
         transform: A.ReplayCompose,
         features,
         bitmix=False,
+        feature_cache: Optional[FeatureCache] = None,
     ):
         self.images = images
+        self.feature_cache = feature_cache
         self.features = features
         self.target = target
         self.method_name = ["Cover", "JMiPOD", "JUNIWARD", "UERD"]
@@ -496,17 +571,12 @@ class PairedImageDataset(Dataset):
         method_name = self.method_name[self.target]
         stego_image_fname = cover_image_fname.replace("Cover", method_name)
 
-        cover_image = cv2.imread(cover_image_fname)
-        stego_image = cv2.imread(stego_image_fname)
+        cover_data = read_image_with_features(cover_image_fname, self.features, self.feature_cache)
+        stego_data = read_image_with_features(stego_image_fname, self.features, self.feature_cache)
+        cover_image = cover_data["image"]
+        stego_image = stego_data["image"]
 
-        cover_data = {}
-        cover_data["image"] = cover_image
-        cover_data.update(compute_features(cover_image, cover_image_fname, self.features))
         cover_data = self.transform(**cover_data)
-
-        stego_data = {}
-        stego_data["image"] = stego_image
-        stego_data.update(compute_features(stego_image, stego_image_fname, self.features))
         stego_data = self.transform.replay(cover_data["replay"], **stego_data)
 
         if self.bitmix:
@@ -564,6 +634,232 @@ class PairedImageDataset(Dataset):
         return sample
 
 
+def read_image_with_features(image_fname: str, features, feature_cache: Optional[FeatureCache] = None) -> Dict:
+    """
+    Read image and compute it's features
+    """
+    image = cv2.imread(image_fname)
+    if image is None:
+        raise FileNotFoundError(image_fname)
+
+    data = {"image": image}
+    data.update(compute_features(image, image_fname, features, feature_cache))
+    return data
+
+
+class MultiStegoPairedDataset(Dataset):
+    """
+    Dataset of covers, which yields cover together with all it's stego images (JMiPOD, JUNIWARD, UERD by default).
+    Cover is read and it's features are computed once, and the same (replayed) transform is applied to all images.
+    Each sample contains tensors of shape [1 + len(targets), ...] (Cover first). Use paired_collate to flatten them.
+    """
+
+    def __init__(
+        self,
+        images: Union[np.ndarray, List],
+        quality: List,
+        transform: A.ReplayCompose,
+        features,
+        targets=(1, 2, 3),
+        feature_cache: Optional[FeatureCache] = None,
+    ):
+        """
+        :param targets: Indexes of stego methods (See INDEX_TO_METHOD)
+        """
+        if not all(0 < target < 4 for target in targets):
+            raise ValueError(f"Unsupported stego targets {targets}")
+
+        self.images = images
+        self.quality = quality
+        self.transform = transform
+        self.features = features
+        self.targets = list(targets)
+        self.feature_cache = feature_cache
+
+    def __len__(self):
+        return len(self.images)
+
+    def __repr__(self):
+        return f"MultiStegoPairedDataset(images={len(self.images)}, targets={self.targets})"
+
+    def __getitem__(self, index):
+        cover_image_fname = self.images[index]
+        image_fnames = [cover_image_fname] + [
+            cover_image_fname.replace("Cover", INDEX_TO_METHOD[target]) for target in self.targets
+        ]
+
+        cover_data = read_image_with_features(cover_image_fname, self.features, self.feature_cache)
+        cover_data = self.transform(**cover_data)
+
+        transformed = [cover_data]
+        for stego_image_fname in image_fnames[1:]:
+            stego_data = read_image_with_features(stego_image_fname, self.features, self.feature_cache)
+            transformed.append(self.transform.replay(cover_data["replay"], **stego_data))
+
+        num_images = len(image_fnames)
+        quality_factor = int(self.quality[index])
+        sample = {
+            INPUT_IMAGE_ID_KEY: [fs.id_from_fname(x) for x in image_fnames],
+            INPUT_TRUE_MODIFICATION_TYPE: torch.tensor([0] + self.targets).long(),
+            INPUT_TRUE_MODIFICATION_FLAG: torch.tensor([0] + [1] * len(self.targets)).float(),
+            INPUT_IMAGE_QF_KEY: torch.tensor([quality_factor] * num_images),
+        }
+
+        for key in cover_data.keys():
+            if key in self.features:
+                sample[key] = torch.stack([tensor_from_rgb_image(data[key]) for data in transformed])
+
+        return sample
+
+
+def paired_collate(input):
+    """
+    Collate samples of PairedImageDataset / MultiStegoPairedDataset (Tensors of [K, ...] per sample) into batch
+    of K * B images. Images are grouped by position in the sample: all covers first, then stego images of each method.
+    """
+    input = default_collate(input)
+
+    # List of K tuples of B image ids
+    input[INPUT_IMAGE_ID_KEY] = list(itertools.chain(*input[INPUT_IMAGE_ID_KEY]))
+
+    for key, value in input.items():
+        if torch.is_tensor(value) and value.dim() >= 2:
+            input[key] = value.transpose(0, 1).reshape((-1,) + value.size()[2:])
+
+    input[INPUT_TRUE_MODIFICATION_FLAG] = input[INPUT_TRUE_MODIFICATION_FLAG].unsqueeze(-1)
+    return input
+
+
+# Version of manifest layout. Bump it to invalidate cached manifests after changing build_manifest
+MANIFEST_VERSION = 2
+
+# Sources of the number of changed bits per stego image: filename -> (image column, [(bits column, scale), ...])
+# The first bits column present in the CSV is used. analyze_embeddings.csv files written before
+# the pd -> changed_blocks rename have only the pd column (64 * number of changed blocks of 512x512 image)
+CHANGED_BITS_SOURCES = {
+    "analyze_embeddings.csv": ("image", [("changed_blocks", 1.0 / (64 * 64)), ("pd", 1.0 / (512 * 512))]),
+    "changed_bits.csv": ("file", [("nbits", 1)]),
+}
+
+
+def build_manifest(folds_csv: str, unchanged_csv: str, changed_bits_csv: Optional[str] = None) -> pd.DataFrame:
+    """
+    Build table of all images of the training set: every cover and its stego images, except stego images that
+    do not have any alterations of DCT coefficients (there are 250 of them).
+    Rows are ordered by method (Cover, JMiPOD, JUNIWARD, UERD) and then by order of images in folds csv.
+
+    :return: Dataframe with columns image_id, fold, quality, method, target, bits, cover_index and
+        has_unchanged_stego (true for covers which have at least one stego image without changes)
+    """
+    folds = pd.read_csv(folds_csv)
+    unchanged = pd.read_csv(unchanged_csv)
+
+    covers = pd.DataFrame.from_dict(
+        {
+            INPUT_IMAGE_ID_KEY: folds[INPUT_IMAGE_ID_KEY].values,
+            INPUT_FOLD_KEY: folds[INPUT_FOLD_KEY].values,
+            "quality": folds["quality"].values,
+            "method": "Cover",
+            "target": 0,
+            "cover_index": np.arange(len(folds)),
+        }
+    )
+    covers["has_unchanged_stego"] = covers[INPUT_IMAGE_ID_KEY].isin(unchanged["file"])
+
+    cover_ids = covers[INPUT_IMAGE_ID_KEY].map(fs.id_from_fname)
+    unchanged_ids = unchanged["file"].map(fs.id_from_fname)
+
+    parts = [covers]
+    for method_index, method_name in enumerate(["JMiPOD", "JUNIWARD", "UERD"]):
+        stego = covers[~cover_ids.isin(unchanged_ids[unchanged["method"] == method_name])].copy()
+        stego["method"] = method_name
+        stego["target"] = method_index + 1
+        parts.append(stego)
+
+    manifest = pd.concat(parts, ignore_index=True)
+
+    if changed_bits_csv is not None:
+        image_column, bits_columns = CHANGED_BITS_SOURCES[os.path.basename(changed_bits_csv)]
+        changed_bits = pd.read_csv(changed_bits_csv)
+        bits_column, scale = next((x for x in bits_columns if x[0] in changed_bits.columns), bits_columns[0])
+        changed_bits = pd.DataFrame.from_dict(
+            {
+                INPUT_IMAGE_ID_KEY: changed_bits[image_column].values,
+                "target": changed_bits["method"].map(METHOD_TO_INDEX).values,
+                "bits": changed_bits[bits_column].values * scale,
+            }
+        ).drop_duplicates(subset=[INPUT_IMAGE_ID_KEY, "target"], keep="last")
+
+        manifest = manifest.merge(changed_bits, how="left", on=[INPUT_IMAGE_ID_KEY, "target"], sort=False)
+        manifest.loc[manifest["target"] == 0, "bits"] = 0
+    else:
+        manifest["bits"] = np.nan
+
+    return manifest
+
+
+def _hash_file(fname: str) -> str:
+    with open(fname, "rb") as f:
+        return hashlib.md5(f.read()).hexdigest()
+
+
+def get_manifest(changed_bits_csv: Optional[str] = None) -> pd.DataFrame:
+    """
+    Cached version of build_manifest for CSV files of the repository.
+    Manifest is stored in temporary directory under a key derived from the content of input files,
+    so each train/predict process (and each DDP rank) builds it at most once.
+
+    :param changed_bits_csv: Name of the CSV with number of changed bits (See CHANGED_BITS_SOURCES) or None
+    """
+    root = os.path.dirname(os.path.dirname(__file__))
+    inputs = [os.path.join(root, "folds_v2.csv"), os.path.join(root, "df_unchanged.csv")]
+    if changed_bits_csv is not None:
+        inputs.append(os.path.join(root, changed_bits_csv))
+
+    key = hashlib.md5(
+        "|".join([str(MANIFEST_VERSION)] + [os.path.basename(x) + ":" + _hash_file(x) for x in inputs]).encode()
+    ).hexdigest()
+    cache_fname = os.path.join(tempfile.gettempdir(), f"alaska2_manifest_{key}.pkl")
+
+    if os.path.isfile(cache_fname):
+        try:
+            return pd.read_pickle(cache_fname)
+        except Exception as e:
+            print("Cannot read cached manifest", cache_fname, e)
+
+    manifest = build_manifest(*inputs)
+
+    tmp_fname = f"{cache_fname}.{os.getpid()}.tmp"
+    manifest.to_pickle(tmp_fname)
+    os.replace(tmp_fname, cache_fname)
+    return manifest
+
+
+def _every_nth_cover(manifest: pd.DataFrame, n: int) -> pd.DataFrame:
+    # Take each n-th cover image together with its stego images
+    cover_index = manifest.loc[manifest["target"] == 0, "cover_index"].values[::n]
+    return manifest[manifest["cover_index"].isin(cover_index)]
+
+
+def _manifest_to_lists(manifest: pd.DataFrame, data_dir: str, need_bits=True):
+    images = [
+        os.path.join(data_dir, method, image_id)
+        for method, image_id in zip(manifest["method"].values, manifest[INPUT_IMAGE_ID_KEY].values)
+    ]
+    targets = manifest["target"].tolist()
+    quality = manifest["quality"].tolist()
+
+    if not need_bits:
+        return images, targets, quality, None
+
+    missing = manifest["bits"].isna().values
+    if missing.any():
+        index = np.flatnonzero(missing)[0]
+        raise KeyError(f"Number of changed bits is unknown for {images[index]}")
+
+    return images, targets, quality, manifest["bits"].tolist()
+
+
 def get_datasets(
     data_dir: str,
     fold: int,
@@ -572,90 +868,37 @@ def get_datasets(
     balance=False,
     features=None,
     obliterate_p=0.0,
+    feature_cache: Optional[FeatureCache] = None,
+    batch_size: Optional[int] = None,
+    world_size: int = 1,
+    local_rank: int = 0,
 ):
+    """
+    :param balance: If True, returns BalancedQFSampler for train set (Batches of single quality factor
+        balanced across classes). Requires batch_size.
+    :param batch_size: Per-replica batch size of train loader (Used by sampler)
+    :param world_size: Number of replicas in distributed training (Used by sampler)
+    :param local_rank: Rank of the replica in distributed training (Used by sampler)
+    """
     from .augmentations import get_augmentations, get_obliterate_augs
 
     train_transform = get_augmentations(augmentation)
     valid_transform = A.NoOp()
 
-    data_folds = pd.read_csv(os.path.join(os.path.dirname(os.path.dirname(__file__)), "folds_v2.csv"))
-    data_folds["key"] = data_folds["image_id"] + "_" + data_folds["target"].apply(str)
-
-    unchanged = pd.read_csv(os.path.join(os.path.dirname(os.path.dirname(__file__)), "df_unchanged.csv"))
-
-    changed_bits = pd.read_csv(os.path.join(os.path.dirname(os.path.dirname(__file__)), "analyze_embeddings.csv"))
-    changed_bits["key"] = (
-        changed_bits["image"] + "_" + changed_bits["method"].apply(lambda x: METHOD_TO_INDEX[x]).apply(str)
-    )
-    changed_bits_table = {}
-    for i, row in changed_bits.iterrows():
-        changed_bits_table[row["key"]] = float(row["pd"]) / (512 * 512)
+    manifest = get_manifest("analyze_embeddings.csv")
 
     # Ignore holdout fold
-    data_folds = data_folds[data_folds[INPUT_FOLD_KEY] != HOLDOUT_FOLD]
+    manifest = manifest[manifest[INPUT_FOLD_KEY] != HOLDOUT_FOLD]
 
-    train_df = data_folds[data_folds[INPUT_FOLD_KEY] != fold]
-    valid_df = data_folds[data_folds[INPUT_FOLD_KEY] == fold]
+    train_df = manifest[manifest[INPUT_FOLD_KEY] != fold]
+    valid_df = manifest[manifest[INPUT_FOLD_KEY] == fold]
 
     if fast:
-        train_df = train_df[::50]
-        valid_df = valid_df[::50]
+        train_df = _every_nth_cover(train_df, 50)
+        valid_df = _every_nth_cover(valid_df, 50)
 
-    train_images = train_df[INPUT_IMAGE_ID_KEY].tolist()
-    valid_images = valid_df[INPUT_IMAGE_ID_KEY].tolist()
-
-    train_images = [os.path.join(data_dir, "Cover", x) for x in train_images]
-    valid_images = [os.path.join(data_dir, "Cover", x) for x in valid_images]
-
-    train_x = train_images.copy()
-    train_y = [0] * len(train_images)
-    train_qf = train_df["quality"].values.tolist()
-    train_bits = [0] * len(train_images)
-
-    valid_x = valid_images.copy()
-    valid_y = [0] * len(valid_images)
-    valid_qf = valid_df["quality"].values.tolist()
-    valid_bits = [0] * len(valid_images)
-
-    for method_index, method_name in enumerate(["JMiPOD", "JUNIWARD", "UERD"]):
-        # Filter images that does not have any alterations DCT (there are 250 of them)
-        unchanged_files = unchanged[unchanged["method"] == method_name].file.values
-        unchanged_files = list(map(fs.id_from_fname, unchanged_files))
-
-        for fname, qf in zip(train_images, train_df["quality"].values):
-            if fs.id_from_fname(fname) not in unchanged_files:
-                fname = fname.replace("Cover", method_name)
-                train_x.append(fname)
-                train_y.append(method_index + 1)
-                train_qf.append(qf)
-
-                key = os.path.basename(fname) + "_" + str(method_index + 1)
-                train_bits.append(changed_bits_table[key])
-            else:
-                # print("Removed unchanged file from the train set", fname)
-                pass
-
-        for fname, qf in zip(valid_images, valid_df["quality"].values):
-            if fs.id_from_fname(fname) not in unchanged_files:
-                fname = fname.replace("Cover", method_name)
-
-                valid_x.append(fname)
-                valid_y.append(method_index + 1)
-                valid_qf.append(qf)
-
-                key = os.path.basename(fname) + "_" + str(method_index + 1)
-                valid_bits.append(changed_bits_table[key])
-            else:
-                # print("Removed unchanged file from the valid set", fname)
-                pass
-
-        # train_x += [fname.replace("Cover", method) for fname in train_images]
-        # train_y += [i + 1] * len(train_images)
-        # train_qf += train_df["quality"].values.tolist()
-
-        # valid_x += [fname.replace("Cover", method) for fname in valid_images]
-        # valid_y += [i + 1] * len(valid_images)
-        # valid_qf += valid_df["quality"].values.tolist()
+    train_x, train_y, train_qf, train_bits = _manifest_to_lists(train_df, data_dir)
+    valid_x, valid_y, valid_qf, valid_bits = _manifest_to_lists(valid_df, data_dir)
 
     assert len(set(train_x).intersection(set(valid_x))) == 0, "Train set and valid set has common elements"
 
@@ -668,6 +911,7 @@ def get_datasets(
         features=features,
         obliterate=get_obliterate_augs() if obliterate_p > 0 else None,
         obliterate_p=obliterate_p,
+        feature_cache=feature_cache,
     )
     valid_ds = TrainingValidationDataset(
         images=valid_x,
@@ -676,80 +920,93 @@ def get_datasets(
         bits=valid_bits,
         transform=valid_transform,
         features=features,
+        feature_cache=feature_cache,
     )
 
     sampler = None
+    if balance:
+        if batch_size is None:
+            raise ValueError("batch_size is required for balanced sampler")
+        sampler = BalancedQFSampler(train_y, train_qf, batch_size, num_replicas=world_size, rank=local_rank)
+
     print("Train", train_ds)
     print("Valid", valid_ds)
+    if sampler is not None:
+        print("Sampler", sampler)
     return train_ds, valid_ds, sampler
 
 
 def get_datasets_paired(
-    data_dir: str, fold: int, augmentation: str = "light", bitmix=False, features=None, fast=False
+    data_dir: str,
+    fold: int,
+    augmentation: str = "light",
+    bitmix=False,
+    features=None,
+    fast=False,
+    feature_cache: Optional[FeatureCache] = None,
+    multi_stego=False,
 ):
+    """
+    :param multi_stego: Use MultiStegoPairedDataset (cover with all stego images in one sample) for training.
+        Each cover is read and it's features are computed once for all stego methods.
+    """
     from .augmentations import get_augmentations
 
     train_transform = get_augmentations(augmentation)
     valid_transform = A.NoOp()
 
-    data_folds = pd.read_csv(os.path.join(os.path.dirname(os.path.dirname(__file__)), "folds_v2.csv"))
-    unchanged = pd.read_csv(os.path.join(os.path.dirname(os.path.dirname(__file__)), "df_unchanged.csv"))
+    manifest = get_manifest()
 
     # Ignore holdout fold
-    data_folds = data_folds[data_folds[INPUT_FOLD_KEY] != HOLDOUT_FOLD]
-
-    train_df = data_folds[data_folds[INPUT_FOLD_KEY] != fold]
-    valid_df = data_folds[data_folds[INPUT_FOLD_KEY] == fold]
+    manifest = manifest[manifest[INPUT_FOLD_KEY] != HOLDOUT_FOLD]
 
-    train_df = train_df[~train_df[INPUT_IMAGE_ID_KEY].isin(unchanged.file)]
+    train_df = manifest[
+        (manifest[INPUT_FOLD_KEY] != fold) & (manifest["target"] == 0) & ~manifest["has_unchanged_stego"]
+    ]
+    valid_df = manifest[manifest[INPUT_FOLD_KEY] == fold]
 
     if fast:
-        train_df = train_df[::1000]
-        valid_df = valid_df[::1000]
-        # valid_df = train_df.copy()
-
-    train_images = train_df[INPUT_IMAGE_ID_KEY].tolist()
-    train_images = [os.path.join(data_dir, "Cover", x) for x in train_images]
-
-    train_qf = train_df["quality"].values.tolist()
-
-    # Validation
-    valid_images = valid_df[INPUT_IMAGE_ID_KEY].tolist()
-    valid_images = [os.path.join(data_dir, "Cover", x) for x in valid_images]
-
-    valid_x = valid_images.copy()
-    valid_y = [0] * len(valid_images)
-    valid_qf = valid_df["quality"].values.tolist()
-
-    for method_index, method_name in enumerate(["JMiPOD", "JUNIWARD", "UERD"]):
-        # Filter images that does not have any alterations DCT (there are 250 of them)
-        unchanged_files = unchanged[unchanged["method"] == method_name].file.values
-        unchanged_files = list(map(fs.id_from_fname, unchanged_files))
-
-        for fname, qf in zip(valid_images, valid_df["quality"].values):
-            if fs.id_from_fname(fname) not in unchanged_files:
-                fname = fname.replace("Cover", method_name)
-                valid_x.append(fname)
-                valid_y.append(method_index + 1)
-                valid_qf.append(qf)
-            else:
-                # print("Removed unchanged file from the valid set", fname)
-                pass
-
-    train_ds = (
-        PairedImageDataset(
-            train_images, train_qf, target=1, transform=train_transform, features=features, bitmix=bitmix
+        train_df = _every_nth_cover(train_df, 1000)
+        valid_df = _every_nth_cover(valid_df, 1000)
+
+    train_images, _, train_qf, _ = _manifest_to_lists(train_df, data_dir, need_bits=False)
+    valid_x, valid_y, valid_qf, _ = _manifest_to_lists(valid_df, data_dir, need_bits=False)
+
+    if multi_stego:
+        if bitmix:
+            raise ValueError("Bitmix is not supported by MultiStegoPairedDataset")
+
+        train_ds = MultiStegoPairedDataset(
+            train_images,
+            train_qf,
+            transform=train_transform,
+            features=features,
+            feature_cache=feature_cache,
         )
-        + PairedImageDataset(
-            train_images, train_qf, target=2, transform=train_transform, features=features, bitmix=bitmix
-        )
-        + PairedImageDataset(
-            train_images, train_qf, target=3, transform=train_transform, features=features, bitmix=bitmix
+    else:
+        train_ds = ConcatDataset(
+            [
+                PairedImageDataset(
+                    train_images,
+                    train_qf,
+                    target=target,
+                    transform=train_transform,
+                    features=features,
+                    bitmix=bitmix,
+                    feature_cache=feature_cache,
+                )
+                for target in [1, 2, 3]
+            ]
         )
-    )
 
     valid_ds = TrainingValidationDataset(
-        images=valid_x, targets=valid_y, quality=valid_qf, bits=None, transform=valid_transform, features=features
+        images=valid_x,
+        targets=valid_y,
+        quality=valid_qf,
+        bits=None,
+        transform=valid_transform,
+        features=features,
+        feature_cache=feature_cache,
     )
 
     sampler = None
@@ -758,49 +1015,14 @@ def get_datasets_paired(
     return train_ds, valid_ds, sampler
 
 
-def get_holdout(data_dir: str, features=None):
+def get_holdout(data_dir: str, features=None, feature_cache: Optional[FeatureCache] = None):
     valid_transform = A.NoOp()
 
-    data_folds = pd.read_csv(os.path.join(os.path.dirname(os.path.dirname(__file__)), "folds_v2.csv"))
-    unchanged = pd.read_csv(os.path.join(os.path.dirname(os.path.dirname(__file__)), "df_unchanged.csv"))
-
-    changed_bits = pd.read_csv(os.path.join(os.path.dirname(os.path.dirname(__file__)), "changed_bits.csv"))
-    changed_bits["key"] = (
-        changed_bits["file"] + "_" + changed_bits["method"].apply(lambda x: METHOD_TO_INDEX[x]).apply(str)
-    )
-    changed_bits_table = {}
-    for i, row in changed_bits.iterrows():
-        changed_bits_table[row["key"]] = row["nbits"]
+    manifest = get_manifest("changed_bits.csv")
 
     # Take only holdout fold
-    holdout_df = data_folds[data_folds[INPUT_FOLD_KEY] == HOLDOUT_FOLD]
-
-    holdout_images = holdout_df[INPUT_IMAGE_ID_KEY].tolist()
-    holdout_images = [os.path.join(data_dir, "Cover", x) for x in holdout_images]
-
-    valid_x = holdout_images.copy()
-    valid_y = [0] * len(holdout_images)
-    valid_qf = holdout_df["quality"].values.tolist()
-    valid_bits = [0] * len(holdout_images)
-
-    for method_index, method_name in enumerate(["JMiPOD", "JUNIWARD", "UERD"]):
-        # Filter images that does not have any alterations DCT (there are 250 of them)
-        unchanged_files = unchanged[unchanged["method"] == method_name].file.values
-        unchanged_files = list(map(fs.id_from_fname, unchanged_files))
-
-        for fname, qf in zip(holdout_images, holdout_df["quality"].values):
-            if fs.id_from_fname(fname) not in unchanged_files:
-                fname = fname.replace("Cover", method_name)
-                valid_x.append(fname)
-                valid_y.append(method_index + 1)
-                valid_qf.append(qf)
-
-                key = os.path.basename(fname) + "_" + str(method_index)
-                valid_bits.append(changed_bits_table[key])
-
-            else:
-                # print("Removed unchanged file from the holdout set", fname)
-                pass
+    holdout_df = manifest[manifest[INPUT_FOLD_KEY] == HOLDOUT_FOLD]
+    valid_x, valid_y, valid_qf, valid_bits = _manifest_to_lists(holdout_df, data_dir)
 
     holdout_ds = TrainingValidationDataset(
         images=valid_x,
@@ -809,63 +1031,30 @@ def get_holdout(data_dir: str, features=None):
         bits=valid_bits,
         transform=valid_transform,
         features=features,
+        feature_cache=feature_cache,
     )
 
     print("Holdout", holdout_ds)
     return holdout_ds
 
 
-def get_train_except_holdout(data_dir: str, features=None):
+def get_train_except_holdout(data_dir: str, features=None, feature_cache: Optional[FeatureCache] = None):
     valid_transform = A.NoOp()
 
-    data_folds = pd.read_csv(os.path.join(os.path.dirname(os.path.dirname(__file__)), "folds_v2.csv"))
-    unchanged = pd.read_csv(os.path.join(os.path.dirname(os.path.dirname(__file__)), "df_unchanged.csv"))
-
-    changed_bits = pd.read_csv(os.path.join(os.path.dirname(os.path.dirname(__file__)), "changed_bits.csv"))
-    changed_bits["key"] = (
-        changed_bits["file"] + "_" + changed_bits["method"].apply(lambda x: METHOD_TO_INDEX[x]).apply(str)
-    )
-    changed_bits_table = {}
-    for i, row in changed_bits.iterrows():
-        changed_bits_table[row["key"]] = row["nbits"]
+    manifest = get_manifest("changed_bits.csv")
 
     # Take all but holdout fold
-    holdout_df = data_folds[data_folds[INPUT_FOLD_KEY] != HOLDOUT_FOLD]
-
-    holdout_images = holdout_df[INPUT_IMAGE_ID_KEY].tolist()
-    holdout_images = [os.path.join(data_dir, "Cover", x) for x in holdout_images]
-
-    valid_x = holdout_images.copy()
-    valid_y = [0] * len(holdout_images)
-    valid_qf = holdout_df["quality"].values.tolist()
-    valid_bits = [0] * len(holdout_images)
-
-    for method_index, method_name in enumerate(["JMiPOD", "JUNIWARD", "UERD"]):
-        # Filter images that does not have any alterations DCT (there are 250 of them)
-        unchanged_files = unchanged[unchanged["method"] == method_name].file.values
-        unchanged_files = list(map(fs.id_from_fname, unchanged_files))
-
-        for fname, qf in zip(holdout_images, holdout_df["quality"].values):
-            if fs.id_from_fname(fname) not in unchanged_files:
-                fname = fname.replace("Cover", method_name)
-                valid_x.append(fname)
-                valid_y.append(method_index + 1)
-                valid_qf.append(qf)
-
-                key = os.path.basename(fname) + "_" + str(method_index)
-                valid_bits.append(changed_bits_table[key])
-
-            else:
-                # print("Removed unchanged file from the holdout set", fname)
-                pass
+    train_df = manifest[manifest[INPUT_FOLD_KEY] != HOLDOUT_FOLD]
+    train_x, train_y, train_qf, train_bits = _manifest_to_lists(train_df, data_dir)
 
     train_ds = TrainingValidationDataset(
-        images=valid_x,
-        targets=valid_y,
-        quality=valid_qf,
-        bits=valid_bits,
+        images=train_x,
+        targets=train_y,
+        quality=train_qf,
+        bits=train_bits,
         transform=valid_transform,
         features=features,
+        feature_cache=feature_cache,
     )
 
     print("Train (all folds)", train_ds)
@@ -898,7 +1087,7 @@ def get_negatives_ds(data_dir, features, fold: int, local_rank=0, image_size=(51
     )
 
 
-def get_test_dataset(data_dir, features):
+def get_test_dataset(data_dir, features, feature_cache: Optional[FeatureCache] = None):
     valid_transform = A.NoOp()
     # images = fs.find_images_in_dir(os.path.join(data_dir, "Test"))
     test_df = pd.read_csv(os.path.join(os.path.dirname(os.path.dirname(__file__)), "test_dataset_qf_qt.csv"))
@@ -911,6 +1100,7 @@ def get_test_dataset(data_dir, features):
         quality=test_df["quality"].values.tolist(),
         transform=valid_transform,
         features=features,
+        feature_cache=feature_cache,
     )
 
 
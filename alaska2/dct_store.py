@@ -0,0 +1,328 @@
+import json
+import os
+from functools import lru_cache
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+from pytorch_toolbelt.utils import fs
+
+from jpeg_tools.header import estimate_quality_factor
+
+__all__ = [
+    "DCT_STORE_DIR",
+    "DctStore",
+    "DctStoreWriter",
+    "dct_store_key",
+    "estimate_quality_factor",
+    "get_dct_store",
+    "read_npz_record",
+    "sparse_delta",
+]
+
+# Name of the store directory inside dataset root (next to Cover, JMiPOD, JUNIWARD, UERD, Test folders)
+DCT_STORE_DIR = "dct_store"
+DCT_STORE_VERSION = 2
+
+# Version 1 stores (without sparse delta records) are still readable
+SUPPORTED_DCT_STORE_VERSIONS = (1, 2)
+
+
+def dct_store_key(fname: str) -> str:
+    """
+    Key of the image in the DCT store: "<method folder>/<image id>". Works for .jpg and .npz filenames.
+    """
+    return os.path.basename(os.path.dirname(fname)) + "/" + fs.id_from_fname(fname)
+
+
+def sparse_delta(base: np.ndarray, dct: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Sparse difference of DCT coefficients of stego image and it's cover.
+    :return: Tuple of flat indexes into [3, H, W] record (plane * H * W + row * W + col) and deltas
+    """
+    delta = dct.astype(np.int32).reshape(-1) - base.astype(np.int32).reshape(-1)
+    (indexes,) = np.nonzero(delta)
+    return indexes.astype(np.int32), delta[indexes]
+
+
+class DctStore:
+    """
+    Read-only store of dequantized DCT coefficients kept as fixed-size int16 records [3, H, W] (Y, Cb, Cr)
+    in several memory-mapped shard files. Records are returned as zero-copy views of the mapping,
+    so the OS page cache is shared between all data loader workers and training processes.
+
+    Stego images may be stored as sparse delta records relative to their cover (See sparse_delta), since
+    embedding changes only a small fraction of coefficients. Such records are reconstructed on read
+    and returned as new arrays.
+
+    Layout of the store directory:
+        meta.json                          - Version, record shape & dtype, number of records per shard
+        index.csv                          - key, shard, record, quality, base, delta_start, delta_count
+        qtables.npy                        - Quantization tables (qm0, qm1) of each image [N, 2, 8, 8]
+        shard_000.bin, shard_001.bin, ...  - Raw coefficients of dense records
+        deltas_index.bin, deltas_value.bin - Flat indexes (int32) and deltas of all delta records
+    """
+
+    def __init__(self, root: str):
+        self.root = root
+        with open(os.path.join(root, "meta.json")) as f:
+            self.meta = json.load(f)
+
+        if self.meta["version"] not in SUPPORTED_DCT_STORE_VERSIONS:
+            raise ValueError(f"Unsupported DCT store version {self.meta['version']} in {root}")
+
+        self.record_shape = tuple(self.meta["record_shape"])
+        self.dtype = np.dtype(self.meta["dtype"])
+
+        index = pd.read_csv(os.path.join(root, "index.csv"))
+        self.keys = index["key"].values
+        self.shard = index["shard"].values
+        self.record = index["record"].values
+        self.quality = index["quality"].values
+        self.base = index["base"].values if "base" in index else np.full(len(index), -1)
+        self.delta_start = index["delta_start"].values if "delta_start" in index else np.zeros(len(index), dtype=int)
+        self.delta_count = index["delta_count"].values if "delta_count" in index else np.zeros(len(index), dtype=int)
+        self.key_to_index: Dict[str, int] = dict(zip(self.keys, range(len(self.keys))))
+
+        self._shards = {}
+        self._qtables = None
+        self._deltas = None
+
+    def __getstate__(self):
+        # Mappings are re-opened lazily in each DataLoader worker
+        state = self.__dict__.copy()
+        state["_shards"] = {}
+        state["_qtables"] = None
+        state["_deltas"] = None
+        return state
+
+    def __len__(self):
+        return len(self.keys)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self.key_to_index
+
+    def __repr__(self):
+        return f"DctStore(root={self.root}, len={len(self)}, shards={self.meta['num_shards']})"
+
+    def _get_shard(self, shard: int) -> np.memmap:
+        mm = self._shards.get(shard)
+        if mm is None:
+            shard_fname = os.path.join(self.root, f"shard_{shard:03d}.bin")
+            mm = np.memmap(shard_fname, dtype=self.dtype, mode="r").reshape((-1,) + self.record_shape)
+            self._shards[shard] = mm
+        return mm
+
+    def index_of(self, key: str) -> int:
+        return self.key_to_index[key]
+
+    def _get_deltas(self) -> Tuple[np.ndarray, np.ndarray]:
+        if self._deltas is None:
+            self._deltas = (
+                np.memmap(os.path.join(self.root, "deltas_index.bin"), dtype=np.int32, mode="r"),
+                np.memmap(os.path.join(self.root, "deltas_value.bin"), dtype=self.dtype, mode="r"),
+            )
+        return self._deltas
+
+    def is_delta(self, index: int) -> bool:
+        return self.base[index] >= 0
+
+    def get_delta(self, index: int) -> Tuple[int, np.ndarray, np.ndarray]:
+        """
+        :return: Tuple of base record index, flat indexes and deltas of the delta record
+        """
+        if not self.is_delta(index):
+            raise ValueError(f"Record {self.keys[index]} is not a delta record")
+
+        start, count = int(self.delta_start[index]), int(self.delta_count[index])
+        if count == 0:
+            return int(self.base[index]), np.zeros(0, dtype=np.int32), np.zeros(0, dtype=self.dtype)
+
+        indexes, values = self._get_deltas()
+        return int(self.base[index]), indexes[start : start + count], values[start : start + count]
+
+    def get(self, index: int) -> np.ndarray:
+        """
+        :return: Read-only view of DCT coefficients [3, H, W] in (Y, Cb, Cr) order
+            (New array for delta records)
+        """
+        if self.is_delta(index):
+            base, indexes, values = self.get_delta(index)
+            dct = np.array(self.get(base))
+            dct.reshape(-1)[indexes] += values
+            return dct
+
+        return self._get_shard(int(self.shard[index]))[int(self.record[index])]
+
+    def __getitem__(self, key: str) -> np.ndarray:
+        return self.get(self.key_to_index[key])
+
+    def qtables(self, key: str) -> np.ndarray:
+        """
+        :return: Luminance and chrominance quantization tables [2, 8, 8]
+        """
+        if self._qtables is None:
+            self._qtables = np.load(os.path.join(self.root, "qtables.npy"), mmap_mode="r")
+        return self._qtables[self.key_to_index[key]]
+
+    def quality_of(self, key: str) -> int:
+        return int(self.quality[self.key_to_index[key]])
+
+
+class DctStoreWriter:
+    """
+    Preallocates shard files for given list of keys and fills them record by record.
+    Keys listed in bases are stored as sparse delta records relative to their base key (See write_delta).
+    Index and metadata are written on close(), so incomplete store is never picked up by readers.
+    """
+
+    def __init__(
+        self,
+        root: str,
+        keys: List[str],
+        record_shape=(3, 512, 512),
+        dtype=np.int16,
+        records_per_shard: int = 8192,
+        bases: Optional[Dict[str, str]] = None,
+    ):
+        """
+        :param bases: Optional mapping of stego key to the key of it's cover (Which must be a dense record)
+        """
+        os.makedirs(root, exist_ok=True)
+        self.root = root
+        self.keys = list(keys)
+        self.record_shape = tuple(record_shape)
+        self.dtype = np.dtype(dtype)
+        self.records_per_shard = records_per_shard
+        self.quality = np.full(len(self.keys), -1, dtype=np.int32)
+
+        bases = bases or {}
+        key_to_index = dict(zip(self.keys, range(len(self.keys))))
+        self.base = np.array([key_to_index.get(bases[key], -2) if key in bases else -1 for key in self.keys])
+        if np.any(self.base == -2):
+            raise KeyError("Base keys must be present in the store")
+        if np.any(self.base[self.base[self.base >= 0]] >= 0):
+            raise ValueError("Base of delta record must be a dense record")
+
+        # Position of dense records in shards
+        is_dense = self.base < 0
+        self.dense_index = np.where(is_dense, np.cumsum(is_dense) - 1, -1)
+        num_dense = int(is_dense.sum())
+        self.num_shards = (num_dense + records_per_shard - 1) // records_per_shard
+
+        self.delta_start = np.zeros(len(self.keys), dtype=np.int64)
+        self.delta_count = np.zeros(len(self.keys), dtype=np.int64)
+        self.num_deltas = 0
+        self.deltas_index = open(os.path.join(root, "deltas_index.bin"), "wb")
+        self.deltas_value = open(os.path.join(root, "deltas_value.bin"), "wb")
+
+        self.shards = []
+        for shard in range(self.num_shards):
+            num_records = min(records_per_shard, num_dense - shard * records_per_shard)
+            self.shards.append(
+                np.memmap(
+                    os.path.join(root, f"shard_{shard:03d}.bin"),
+                    dtype=self.dtype,
+                    mode="w+",
+                    shape=(num_records,) + self.record_shape,
+                )
+            )
+
+        self.qtables = np.lib.format.open_memmap(
+            os.path.join(root, "qtables.npy"), mode="w+", dtype=np.int16, shape=(len(self.keys), 2, 8, 8)
+        )
+
+    def write(self, index: int, dct: np.ndarray, qtables: Optional[np.ndarray] = None):
+        """
+        :param index: Index of the key
+        :param dct: Dequantized DCT coefficients [3, H, W] in (Y, Cb, Cr) order
+        :param qtables: Quantization tables [2, 8, 8]
+        """
+        if dct.shape != self.record_shape:
+            raise ValueError(f"Record {self.keys[index]} has shape {dct.shape}, expected {self.record_shape}")
+        if self.base[index] >= 0:
+            raise ValueError(f"Record {self.keys[index]} is a delta record, use write_delta")
+
+        shard, record = divmod(int(self.dense_index[index]), self.records_per_shard)
+        self.shards[shard][record] = dct
+        self._write_qtables(index, qtables)
+
+    def write_delta(self, index: int, indexes: np.ndarray, values: np.ndarray, qtables: Optional[np.ndarray] = None):
+        """
+        :param index: Index of the key
+        :param indexes: Flat indexes of changed coefficients (See sparse_delta)
+        :param values: Deltas of changed coefficients
+        :param qtables: Quantization tables [2, 8, 8]
+        """
+        if self.base[index] < 0:
+            raise ValueError(f"Record {self.keys[index]} is a dense record, use write")
+
+        np.asarray(indexes, dtype=np.int32).tofile(self.deltas_index)
+        np.asarray(values, dtype=self.dtype).tofile(self.deltas_value)
+        self.delta_start[index] = self.num_deltas
+        self.delta_count[index] = len(indexes)
+        self.num_deltas += len(indexes)
+        self._write_qtables(index, qtables)
+
+    def _write_qtables(self, index: int, qtables: Optional[np.ndarray]):
+        if qtables is not None:
+            self.qtables[index] = qtables
+            self.quality[index] = estimate_quality_factor(qtables[0])
+
+    def close(self):
+        for mm in self.shards:
+            mm.flush()
+        self.qtables.flush()
+        self.deltas_index.close()
+        self.deltas_value.close()
+
+        pd.DataFrame.from_dict(
+            {
+                "key": self.keys,
+                "shard": np.where(self.dense_index >= 0, self.dense_index // self.records_per_shard, -1),
+                "record": np.where(self.dense_index >= 0, self.dense_index % self.records_per_shard, -1),
+                "quality": self.quality,
+                "base": self.base,
+                "delta_start": self.delta_start,
+                "delta_count": self.delta_count,
+            }
+        ).to_csv(os.path.join(self.root, "index.csv"), index=False)
+
+        with open(os.path.join(self.root, "meta.json"), "w") as f:
+            json.dump(
+                {
+                    "version": DCT_STORE_VERSION,
+                    "record_shape": list(self.record_shape),
+                    "dtype": self.dtype.name,
+                    "records_per_shard": self.records_per_shard,
+                    "num_shards": self.num_shards,
+                    "num_deltas": self.num_deltas,
+                },
+                f,
+                indent=2,
+            )
+
+
+@lru_cache(maxsize=None)
+def get_dct_store(data_dir: str) -> Optional[DctStore]:
+    """
+    Open DCT store of the dataset if it has been created with convert_dct_to_store.py.
+    Result is cached per process.
+    :return: DctStore instance or None if there is no store in data_dir
+    """
+    root = os.path.join(data_dir, DCT_STORE_DIR)
+    if not os.path.isfile(os.path.join(root, "meta.json")):
+        return None
+    return DctStore(root)
+
+
+def read_npz_record(dct_fname: str) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Read .npz file produced by save_dct.py
+    :return: Tuple of DCT coefficients [3, H, W] (Y, Cb, Cr) and quantization tables [2, 8, 8]
+    """
+    dct = np.load(dct_fname)
+    return (
+        np.stack([dct["dct_y"], dct["dct_cb"], dct["dct_cr"]]),
+        np.stack([dct["qm0"], dct["qm1"]]),
+    )
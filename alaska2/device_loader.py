@@ -0,0 +1,136 @@
+from typing import Dict, Iterable, Optional, Union
+
+import torch
+from torch.utils.data import DataLoader, Dataset
+from torch.utils.data.dataloader import default_collate
+
+from .dataset import (
+    INPUT_FEATURES_BLUR_KEY,
+    INPUT_FEATURES_DCT_CB_KEY,
+    INPUT_FEATURES_DCT_CR_KEY,
+    INPUT_FEATURES_DCT_KEY,
+    INPUT_FEATURES_DCT_Y_KEY,
+    INPUT_FEATURES_ELA_KEY,
+    INPUT_FEATURES_ELA_RICH_KEY,
+    INPUT_IMAGE_KEY,
+    INPUT_TRUE_MODIFICATION_MASK,
+)
+
+__all__ = ["COMPACT_DTYPES", "DeviceLoader", "compact_collate", "get_data_loader"]
+
+# Integer-valued input features and the smallest dtype that holds them losslessly.
+# Images are uint8 pixels, ELA & blur features are differences of uint8 images, DCT coefficients
+# are dequantized integers (Same as DCT store) and the modification mask is binary.
+COMPACT_DTYPES = {
+    INPUT_IMAGE_KEY: torch.uint8,
+    INPUT_FEATURES_ELA_KEY: torch.int16,
+    INPUT_FEATURES_ELA_RICH_KEY: torch.int16,
+    INPUT_FEATURES_BLUR_KEY: torch.int16,
+    INPUT_FEATURES_DCT_KEY: torch.int16,
+    INPUT_FEATURES_DCT_Y_KEY: torch.int16,
+    INPUT_FEATURES_DCT_CB_KEY: torch.int16,
+    INPUT_FEATURES_DCT_CR_KEY: torch.int16,
+    INPUT_TRUE_MODIFICATION_MASK: torch.uint8,
+}
+
+
+def _to_compact(x: torch.Tensor, dtype: torch.dtype) -> torch.Tensor:
+    """
+    Cast tensor to dtype if it can be done without loss of precision, otherwise return it as is
+    """
+    if x.dtype == dtype or not x.numel():
+        return x
+    info = torch.iinfo(dtype)
+    if x.min() < info.min or x.max() > info.max:
+        return x
+    if x.is_floating_point() and not torch.equal(x, torch.round(x)):
+        return x
+    return x.to(dtype)
+
+
+def compact_collate(batch):
+    """
+    Collate function that converts integer-valued features to uint8 / int16 tensors (See COMPACT_DTYPES).
+    It runs in data loader workers, so batches are sent through shared memory in compact form.
+    """
+    batch = default_collate(batch)
+    for key, dtype in COMPACT_DTYPES.items():
+        if key in batch:
+            batch[key] = _to_compact(batch[key], dtype)
+    return batch
+
+
+class DeviceLoader:
+    """
+    Wraps DataLoader and copies batches to the device on a side CUDA stream while the previous batch is processed.
+    Features of compact dtype are converted to float32 on the device (Normalization is done by the models).
+    Other attributes (dataset, sampler, batch_size, ...) are forwarded to the wrapped loader.
+    """
+
+    def __init__(self, loader: DataLoader, device="cuda", float_keys: Iterable[str] = tuple(COMPACT_DTYPES.keys())):
+        """
+        :param loader: Data loader (Should use pin_memory=True for asynchronous copies)
+        :param float_keys: Keys of tensors that are converted to float32 after the copy
+        """
+        self.loader = loader
+        self.device = torch.device(device)
+        self.float_keys = set(float_keys)
+
+    def __len__(self):
+        return len(self.loader)
+
+    def __getattr__(self, name):
+        if name == "loader":
+            raise AttributeError(name)
+        return getattr(self.loader, name)
+
+    def __repr__(self):
+        return f"DeviceLoader(device={self.device}, batches={len(self)})"
+
+    def to_device(self, batch: Dict) -> Dict:
+        result = {}
+        for key, value in batch.items():
+            if torch.is_tensor(value):
+                value = value.to(self.device, non_blocking=True)
+                if key in self.float_keys and not value.is_floating_point():
+                    value = value.float()
+            result[key] = value
+        return result
+
+    def _preload(self, iterator, stream: Optional["torch.cuda.Stream"]) -> Optional[Dict]:
+        try:
+            batch = next(iterator)
+        except StopIteration:
+            return None
+
+        if stream is None:
+            return self.to_device(batch)
+        with torch.cuda.stream(stream):
+            return self.to_device(batch)
+
+    def __iter__(self):
+        stream = torch.cuda.Stream(self.device) if self.device.type == "cuda" else None
+        iterator = iter(self.loader)
+
+        next_batch = self._preload(iterator, stream)
+        while next_batch is not None:
+            batch = next_batch
+            if stream is not None:
+                current_stream = torch.cuda.current_stream(self.device)
+                current_stream.wait_stream(stream)
+                for value in batch.values():
+                    if torch.is_tensor(value):
+                        value.record_stream(current_stream)
+
+            next_batch = self._preload(iterator, stream)
+            yield batch
+
+
+def get_data_loader(dataset: Dataset, compact=False, device="cuda", **kwargs) -> Union[DataLoader, DeviceLoader]:
+    """
+    :param compact: If True, returns DeviceLoader over DataLoader with compact_collate
+    :param kwargs: Arguments of DataLoader
+    """
+    if not compact:
+        return DataLoader(dataset, **kwargs)
+    return DeviceLoader(DataLoader(dataset, collate_fn=compact_collate, **kwargs), device=device)
@@ -0,0 +1,243 @@
+import json
+import os
+from collections import defaultdict
+from functools import lru_cache
+from multiprocessing import Pool
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+from pytorch_toolbelt.utils import fs
+from tqdm import tqdm
+
+from .dct_store import dct_store_key
+
+__all__ = [
+    "EMBEDDING_MASKS_DIR",
+    "EmbeddingMasks",
+    "EmbeddingMasksWriter",
+    "analyze_cover",
+    "analyze_embeddings",
+    "changed_blocks",
+    "count_changed_bits",
+    "count_changed_coefficients",
+    "get_embedding_masks",
+]
+
+# Name of the masks directory inside dataset root (next to Cover, JMiPOD, JUNIWARD, UERD folders)
+EMBEDDING_MASKS_DIR = "embedding_masks"
+EMBEDDING_MASKS_VERSION = 1
+
+STEGO_METHODS = ["JMiPOD", "JUNIWARD", "UERD"]
+
+# Number of set bits in each byte value
+POPCOUNT_TABLE = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+
+def changed_blocks(cover: np.ndarray, stego: np.ndarray) -> np.ndarray:
+    """
+    Mask of 8x8 blocks where at least one DCT coefficient differs.
+    These are exactly the blocks where the (non-rounded) decoded image changes, but not every pixel of
+    such block has to change: changes of several coefficients may cancel each other at some pixels.
+
+    :param cover: DCT coefficients [3, H, W]
+    :param stego: DCT coefficients [3, H, W]
+    :return: Boolean mask [H // 8, W // 8]
+    """
+    changed = (cover != stego).any(axis=0)
+    rows, cols = changed.shape
+    return changed.reshape(rows // 8, 8, cols // 8, 8).any(axis=(1, 3))
+
+
+def count_changed_coefficients(cover: np.ndarray, stego: np.ndarray) -> np.ndarray:
+    """
+    :return: Number of changed coefficients in each plane [3]
+    """
+    return np.count_nonzero((cover != stego).reshape(len(cover), -1), axis=1)
+
+
+def count_changed_bits(cover: np.ndarray, stego: np.ndarray) -> np.ndarray:
+    """
+    :return: Number of changed bits of binary representation of coefficients in each plane [3]
+    """
+    cover = np.ascontiguousarray(cover)
+    stego = np.ascontiguousarray(stego, dtype=cover.dtype)
+    unsigned = np.dtype(f"u{cover.dtype.itemsize}")
+    xor = np.bitwise_xor(cover.view(unsigned), stego.view(unsigned))
+    return POPCOUNT_TABLE[xor.view(np.uint8)].reshape(len(cover), -1).sum(axis=1, dtype=np.int64)
+
+
+def analyze_cover(cover: np.ndarray, stegos: List[np.ndarray]) -> Tuple[np.ndarray, Dict[str, List]]:
+    """
+    Compare DCT coefficients of the cover with each of it's stego images.
+
+    :return: Tuple of block masks [1 + len(stegos), H // 8, W // 8] (Union of stego masks for cover first)
+        and per-stego statistics (changed_blocks - number of changed 8x8 blocks, dct_* - number of changed
+        coefficients, dct_bits_* - number of changed bits)
+    """
+    masks = np.stack([changed_blocks(cover, stego) for stego in stegos])
+    masks = np.concatenate([masks.any(axis=0, keepdims=True), masks])
+
+    stats = defaultdict(list)
+    for stego, mask in zip(stegos, masks[1:]):
+        dct_y, dct_cb, dct_cr = count_changed_coefficients(cover, stego)
+        bits_y, bits_cb, bits_cr = count_changed_bits(cover, stego)
+        stats["changed_blocks"].append(int(np.count_nonzero(mask)))
+        stats["dct_total"].append(dct_y + dct_cr + dct_cb)
+        stats["dct_y"].append(dct_y)
+        stats["dct_cr"].append(dct_cr)
+        stats["dct_cb"].append(dct_cb)
+        stats["dct_bits_total"].append(bits_y + bits_cr + bits_cb)
+        stats["dct_bits_y"].append(bits_y)
+        stats["dct_bits_cr"].append(bits_cr)
+        stats["dct_bits_cb"].append(bits_cb)
+    return masks, stats
+
+
+class EmbeddingMasks:
+    """
+    Read-only store of 8x8-block modification masks of the training set (Cover and stego images).
+    Masks are kept as bit-packed rows in one memory-mapped file.
+
+    Layout of the store directory:
+        meta.json   - Version, block shape
+        index.csv   - key (See dct_store_key)
+        masks.npy   - Packed masks [N, H // 8, ceil(W / 64)]
+    """
+
+    def __init__(self, root: str):
+        self.root = root
+        with open(os.path.join(root, "meta.json")) as f:
+            self.meta = json.load(f)
+
+        if self.meta["version"] != EMBEDDING_MASKS_VERSION:
+            raise ValueError(f"Unsupported embedding masks version {self.meta['version']} in {root}")
+
+        self.block_shape = tuple(self.meta["block_shape"])
+        self.keys = pd.read_csv(os.path.join(root, "index.csv"))["key"].values
+        self.key_to_index: Dict[str, int] = dict(zip(self.keys, range(len(self.keys))))
+        self._masks = None
+
+    def __getstate__(self):
+        # Mapping is re-opened lazily in each DataLoader worker
+        state = self.__dict__.copy()
+        state["_masks"] = None
+        return state
+
+    def __len__(self):
+        return len(self.keys)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self.key_to_index
+
+    def __repr__(self):
+        return f"EmbeddingMasks(root={self.root}, len={len(self)}, block_shape={self.block_shape})"
+
+    def get_block_mask(self, key: str) -> np.ndarray:
+        """
+        :return: Boolean mask of changed 8x8 blocks [H // 8, W // 8]
+        """
+        if self._masks is None:
+            self._masks = np.load(os.path.join(self.root, "masks.npy"), mmap_mode="r")
+        packed = self._masks[self.key_to_index[key]]
+        return np.unpackbits(packed, axis=-1, count=self.block_shape[1]).astype(bool)
+
+    def get_pixel_mask(self, key: str) -> np.ndarray:
+        """
+        Block mask expanded to pixels: all 64 pixels of a changed block are marked, even those that
+        have the same value in cover and stego images.
+        :return: Boolean mask [H, W]
+        """
+        return np.repeat(np.repeat(self.get_block_mask(key), 8, axis=0), 8, axis=1)
+
+
+class EmbeddingMasksWriter:
+    """
+    Preallocates masks file for given list of keys and fills it mask by mask.
+    Index and metadata are written on close(), so incomplete store is never picked up by readers.
+    """
+
+    def __init__(self, root: str, keys: List[str], block_shape=(64, 64)):
+        os.makedirs(root, exist_ok=True)
+        if os.path.exists(os.path.join(root, "meta.json")):
+            os.remove(os.path.join(root, "meta.json"))
+
+        self.root = root
+        self.keys = list(keys)
+        self.block_shape = tuple(block_shape)
+        self.masks = np.lib.format.open_memmap(
+            os.path.join(root, "masks.npy"),
+            mode="w+",
+            dtype=np.uint8,
+            shape=(len(self.keys), self.block_shape[0], (self.block_shape[1] + 7) // 8),
+        )
+
+    def write(self, index: int, block_mask: np.ndarray):
+        if block_mask.shape != self.block_shape:
+            raise ValueError(f"Mask {self.keys[index]} has shape {block_mask.shape}, expected {self.block_shape}")
+        self.masks[index] = np.packbits(block_mask, axis=-1)
+
+    def close(self):
+        self.masks.flush()
+        pd.DataFrame.from_dict({"key": self.keys}).to_csv(os.path.join(self.root, "index.csv"), index=False)
+        with open(os.path.join(self.root, "meta.json"), "w") as f:
+            json.dump(
+                {"version": EMBEDDING_MASKS_VERSION, "block_shape": list(self.block_shape)},
+                f,
+                indent=2,
+            )
+
+
+@lru_cache(maxsize=None)
+def get_embedding_masks(data_dir: str) -> Optional[EmbeddingMasks]:
+    """
+    Open embedding masks of the dataset if they have been created with make_masks.py or analyze_embeddings.py.
+    Result is cached per process.
+    :return: EmbeddingMasks instance or None if there are no masks in data_dir
+    """
+    root = os.path.join(data_dir, EMBEDDING_MASKS_DIR)
+    if not os.path.isfile(os.path.join(root, "meta.json")):
+        return None
+    return EmbeddingMasks(root)
+
+
+def _analyze_cover_file(cover_fname: str):
+    from .dataset import load_dct
+
+    cover = load_dct(cover_fname)
+    stegos = [load_dct(cover_fname.replace("Cover", method)) for method in STEGO_METHODS]
+    return analyze_cover(cover, stegos)
+
+
+def analyze_embeddings(data_dir: str, workers: int = 8, max_images: Optional[int] = None) -> pd.DataFrame:
+    """
+    Compare DCT coefficients of every cover of the training set with it's JMiPOD, JUNIWARD & UERD images
+    (Using DCT store if present) and save block masks to <data_dir>/embedding_masks.
+    :return: Dataframe of statistics with columns image, method, changed_blocks, dct_* and dct_bits_*
+    """
+    from .dataset import load_dct
+
+    covers = [x for x in fs.find_images_in_dir(os.path.join(data_dir, "Cover")) if x.endswith(".jpg")]
+    if max_images is not None:
+        covers = covers[:max_images]
+
+    methods = ["Cover"] + STEGO_METHODS
+    keys = [dct_store_key(cover.replace("Cover", method)) for cover in covers for method in methods]
+    rows, cols = load_dct(covers[0]).shape[1:]
+    writer = EmbeddingMasksWriter(os.path.join(data_dir, EMBEDDING_MASKS_DIR), keys, (rows // 8, cols // 8))
+
+    results_df = defaultdict(list)
+    with Pool(workers) as wp:
+        for i, (masks, stats) in enumerate(
+            tqdm(wp.imap(_analyze_cover_file, covers, chunksize=16), total=len(covers))
+        ):
+            for j, mask in enumerate(masks):
+                writer.write(i * len(methods) + j, mask)
+
+            results_df["image"].extend([os.path.basename(covers[i])] * len(STEGO_METHODS))
+            results_df["method"].extend(STEGO_METHODS)
+            for key, values in stats.items():
+                results_df[key].extend(values)
+
+    writer.close()
+    return pd.DataFrame.from_dict(results_df)
@@ -0,0 +1,213 @@
+import json
+from collections import defaultdict
+from typing import Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+import torch
+from pytorch_toolbelt.utils import fs, to_numpy
+from torch import nn
+from torch.utils.data import DataLoader, Dataset
+from tqdm import tqdm
+
+from .dataset import INPUT_IMAGE_ID_KEY, OUTPUT_PRED_MODIFICATION_FLAG, OUTPUT_PRED_MODIFICATION_TYPE
+
+__all__ = [
+    "CpuRunner",
+    "ExportWrapper",
+    "SubtractMean",
+    "export_model",
+    "fold_input_normalization",
+]
+
+EXPORT_FORMATS = ("torchscript", "onnx")
+
+
+class SubtractMean(nn.Module):
+    """
+    Remainder of the input normalization after folding 1/std into the first convolution
+    """
+
+    def __init__(self, mean: torch.Tensor):
+        super().__init__()
+        self.register_buffer("mean", mean.detach().float().view(1, -1, 1, 1).clone())
+
+    def forward(self, x):
+        return x.type_as(self.mean) - self.mean
+
+
+def _get_input_conv(model: nn.Module) -> Optional[nn.Conv2d]:
+    from .models.timm import TimmRgbModel
+
+    # Only models where output of rgb_bn goes straight to the stem of the encoder
+    if isinstance(model, TimmRgbModel):
+        for name in ["conv_stem", "conv1"]:
+            conv = getattr(model.encoder, name, None)
+            if isinstance(conv, nn.Conv2d):
+                return conv
+    return None
+
+
+@torch.no_grad()
+def fold_input_normalization(model: nn.Module, conv: Optional[nn.Conv2d] = None) -> bool:
+    """
+    Fold scale of input normalization (model.rgb_bn) into weights of the first convolution.
+    Mean subtraction is kept as a separate op, since folding it into conv bias would change values at zero-padded
+    borders. Output of the model is unchanged.
+    :param conv: Convolution that consumes output of rgb_bn (Detected automatically for TimmRgbModel)
+    :return: True if normalization was folded
+    """
+    conv = conv or _get_input_conv(model)
+    if conv is None or conv.groups != 1 or not hasattr(model, "rgb_bn"):
+        return False
+
+    # rgb_bn is per-channel affine: f(x) = (x - mean) * scale
+    zeros = torch.zeros((1, conv.in_channels, 1, 1), device=conv.weight.device)
+    bias = model.rgb_bn(zeros).view(-1)
+    scale = model.rgb_bn(zeros + 1).view(-1) - bias
+
+    conv.weight.mul_(scale.view(1, -1, 1, 1).to(conv.weight.dtype))
+    model.rgb_bn = SubtractMean(-bias / scale)
+    return True
+
+
+class ExportWrapper(nn.Module):
+    """
+    Adapter of models with dict inputs & outputs to positional tensors, as required by tracing and ONNX export
+    """
+
+    def __init__(self, model: nn.Module, inputs: List[str], outputs: List[str]):
+        super().__init__()
+        self.model = model
+        self.inputs = inputs
+        self.outputs = outputs
+
+    def forward(self, *args):
+        output = self.model(**dict(zip(self.inputs, args)))
+        return tuple(output[key] for key in self.outputs)
+
+
+def _meta_fname(artifact_fname: str) -> str:
+    return fs.change_extension(artifact_fname, ".json")
+
+
+@torch.no_grad()
+def export_model(
+    model: nn.Module,
+    sample: Dict[str, torch.Tensor],
+    artifact_fname: str,
+    export_format: str = "torchscript",
+    outputs: List[str] = (OUTPUT_PRED_MODIFICATION_FLAG, OUTPUT_PRED_MODIFICATION_TYPE),
+    fold_normalization: bool = True,
+    opset_version: int = 11,
+) -> Dict:
+    """
+    Trace model on CPU and save it as TorchScript (.pt) or ONNX (.onnx) with batch dimension of all inputs
+    and outputs being dynamic. Metadata (input and output names) is saved next to artifact as .json.
+    :param sample: Sample of dataset (Without batch dimension), used as example input
+    :return: Metadata with max. absolute difference between outputs of eager and exported models
+    """
+    if export_format not in EXPORT_FORMATS:
+        raise KeyError(export_format)
+
+    model = model.cpu().eval()
+    inputs = list(model.required_features)
+    example = tuple(sample[key].unsqueeze(0).float() for key in inputs)
+    expected = ExportWrapper(model, inputs, list(outputs))(*example)
+
+    folded = fold_normalization and fold_input_normalization(model)
+    wrapper = ExportWrapper(model, inputs, list(outputs)).eval()
+
+    if export_format == "torchscript":
+        exported = torch.jit.trace(wrapper, example)
+        if hasattr(torch.jit, "freeze"):
+            exported = torch.jit.freeze(exported)
+        torch.jit.save(exported, artifact_fname)
+    else:
+        dynamic_axes = dict((key, {0: "batch"}) for key in inputs + list(outputs))
+        torch.onnx.export(
+            wrapper,
+            example,
+            artifact_fname,
+            input_names=inputs,
+            output_names=list(outputs),
+            dynamic_axes=dynamic_axes,
+            opset_version=opset_version,
+        )
+
+    actual = CpuRunner(artifact_fname, meta={"inputs": inputs, "outputs": list(outputs)}).forward(example)
+
+    meta = {
+        "format": export_format,
+        "inputs": inputs,
+        "outputs": list(outputs),
+        "input_shapes": [list(x.shape[1:]) for x in example],
+        "folded_normalization": bool(folded),
+        "max_abs_diff": max(float(np.abs(to_numpy(e) - a).max()) for e, a in zip(expected, actual)),
+    }
+    with open(_meta_fname(artifact_fname), "w") as f:
+        json.dump(meta, f, indent=2)
+    return meta
+
+
+class CpuRunner:
+    """
+    Runs exported model (TorchScript or ONNX, see export_model) on CPU.
+    Inputs are given as dict of batched tensors (Like in training), outputs are returned as dict of numpy arrays.
+    """
+
+    def __init__(self, artifact_fname: str, num_threads: Optional[int] = None, meta: Optional[Dict] = None):
+        """
+        :param num_threads: Number of intra-op threads (Default - framework default)
+        :param meta: Input & output names. By default read from .json file next to the artifact
+        """
+        if meta is None:
+            with open(_meta_fname(artifact_fname)) as f:
+                meta = json.load(f)
+
+        self.inputs: List[str] = meta["inputs"]
+        self.outputs: List[str] = meta["outputs"]
+        self.is_onnx = artifact_fname.endswith(".onnx")
+
+        if self.is_onnx:
+            import onnxruntime
+
+            options = onnxruntime.SessionOptions()
+            if num_threads is not None:
+                options.intra_op_num_threads = num_threads
+            self.session = onnxruntime.InferenceSession(artifact_fname, options, providers=["CPUExecutionProvider"])
+        else:
+            if num_threads is not None:
+                torch.set_num_threads(num_threads)
+            self.module = torch.jit.load(artifact_fname, map_location="cpu").eval()
+
+    def __repr__(self):
+        return f"CpuRunner(inputs={self.inputs}, outputs={self.outputs}, onnx={self.is_onnx})"
+
+    @torch.no_grad()
+    def forward(self, inputs) -> List[np.ndarray]:
+        """
+        :param inputs: Batched input tensors in order of self.inputs
+        """
+        inputs = [x.float() for x in inputs]
+        if self.is_onnx:
+            return self.session.run(self.outputs, dict(zip(self.inputs, [to_numpy(x) for x in inputs])))
+        return [to_numpy(x) for x in self.module(*inputs)]
+
+    def predict_batch(self, batch: Dict[str, torch.Tensor]) -> Dict[str, np.ndarray]:
+        return dict(zip(self.outputs, self.forward([batch[key] for key in self.inputs])))
+
+    def predict(self, dataset: Dataset, batch_size=1, workers=0) -> pd.DataFrame:
+        """
+        :return: Dataframe with image ids and outputs, in the same format as predictions of oof_predictions.py
+        """
+        df = defaultdict(list)
+        for batch in tqdm(DataLoader(dataset, batch_size=batch_size, num_workers=workers, shuffle=False)):
+            df[INPUT_IMAGE_ID_KEY].extend(batch[INPUT_IMAGE_ID_KEY])
+            for key, value in self.predict_batch(batch).items():
+                if value.ndim == 2 and value.shape[1] == 1:
+                    df[key].extend(value.flatten())
+                else:
+                    df[key].extend(value.tolist())
+
+        return pd.DataFrame.from_dict(df)
@@ -0,0 +1,113 @@
+import hashlib
+import os
+from typing import Optional
+
+import numpy as np
+
+__all__ = ["FEATURE_CACHE_VERSION", "FeatureCache"]
+
+# Bump this when implementation of any cached feature changes to invalidate all existing entries
+FEATURE_CACHE_VERSION = 1
+
+
+class FeatureCache:
+    """
+    Persistent on-disk cache of deterministic per-image features (ELA, blur, decoding residual).
+
+    Each entry is a single .npy file stored as <root>/<feature>/<2 hex digits>/<sha1>.npy where the hash covers
+    cache version, absolute image path, image modification time, feature name and feature parameters.
+    Entries are written atomically, so several DataLoader workers and DDP ranks can share one cache directory.
+    Integer-valued features are stored as int16 (lossless), others as float16. Values are returned as float32.
+
+    When max_size_gb is set, least recently used entries (by file modification time, which is updated on every hit)
+    are removed once the total size of the cache exceeds the limit.
+    """
+
+    def __init__(self, root: str, max_size_gb: Optional[float] = None, readonly=False):
+        self.root = root
+        self.readonly = readonly
+        self.max_size_bytes = int(max_size_gb * (1024 ** 3)) if max_size_gb is not None else None
+        # Size check requires directory scan, so it runs after every 1% of max size has been written by the process
+        self.check_interval_bytes = max(self.max_size_bytes // 100, 64 * 1024 * 1024) if self.max_size_bytes else None
+        self._bytes_since_check = 0
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(root, exist_ok=True)
+
+    def __repr__(self):
+        return f"FeatureCache(root={self.root}, max_size_bytes={self.max_size_bytes}, hits={self.hits}, misses={self.misses})"
+
+    def entry_path(self, image_fname: str, feature: str, params: str = "") -> str:
+        image_fname = os.path.abspath(image_fname)
+        mtime = os.stat(image_fname).st_mtime_ns
+        key = f"{FEATURE_CACHE_VERSION}|{image_fname}|{mtime}|{feature}|{params}"
+        digest = hashlib.sha1(key.encode("utf-8")).hexdigest()
+        return os.path.join(self.root, feature, digest[:2], digest + ".npy")
+
+    def get(self, image_fname: str, feature: str, params: str = "") -> Optional[np.ndarray]:
+        fname = self.entry_path(image_fname, feature, params)
+        try:
+            value = np.load(fname)
+        except (FileNotFoundError, ValueError, EOFError, OSError):
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        if not self.readonly:
+            try:
+                os.utime(fname)
+            except OSError:
+                pass
+        return value.astype(np.float32)
+
+    def put(self, image_fname: str, feature: str, value: np.ndarray, params: str = "", dtype=np.float16):
+        if self.readonly:
+            return
+
+        fname = self.entry_path(image_fname, feature, params)
+        os.makedirs(os.path.dirname(fname), exist_ok=True)
+
+        tmp_fname = f"{fname}.{os.getpid()}.tmp"
+        with open(tmp_fname, "wb") as f:
+            np.save(f, value.astype(dtype))
+        os.replace(tmp_fname, fname)
+
+        if self.max_size_bytes is not None:
+            self._bytes_since_check += os.path.getsize(fname)
+            if self._bytes_since_check > self.check_interval_bytes:
+                self._bytes_since_check = 0
+                self.evict()
+
+    def evict(self):
+        """
+        Remove least recently used entries until cache size is below 90% of max_size_gb
+        """
+        if self.max_size_bytes is None:
+            return
+
+        entries = []
+        total_size = 0
+        for dirpath, _, fnames in os.walk(self.root):
+            for fname in fnames:
+                if not fname.endswith(".npy"):
+                    continue
+                fname = os.path.join(dirpath, fname)
+                try:
+                    stat = os.stat(fname)
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, fname))
+                total_size += stat.st_size
+
+        if total_size <= self.max_size_bytes:
+            return
+
+        target_size = int(self.max_size_bytes * 0.9)
+        for _, size, fname in sorted(entries):
+            if total_size <= target_size:
+                break
+            try:
+                os.remove(fname)
+            except FileNotFoundError:
+                pass
+            total_size -= size
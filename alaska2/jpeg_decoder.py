@@ -0,0 +1 @@
+from jpeg_tools.decoder import *
@@ -1,11 +1,12 @@
 import itertools
-from typing import Callable
+from multiprocessing import Pool
+from typing import Callable, List, Optional, Tuple
 
 import torch
+import torch.distributed as dist
 from catalyst.dl import Callback, RunnerState, CallbackOrder
 from pytorch_toolbelt.utils import plot_confusion_matrix, render_figure_to_tensor
 from pytorch_toolbelt.utils.catalyst import get_tensorboard_logger
-from pytorch_toolbelt.utils.distributed import all_gather
 from pytorch_toolbelt.utils.torch_utils import to_numpy
 from sklearn import metrics
 import numpy as np
@@ -18,11 +19,17 @@ __all__ = [
     "CompetitionMetricCallback",
     "alaska_weighted_auc",
     "shaky_wauc",
+    "batch_wauc",
+    "bootstrap_wauc",
+    "wauc_sorted",
     "OutputDistributionCallback",
     "binary_logits_to_probas",
     "classifier_logits_to_probas",
     "embedding_to_probas",
     "CompetitionMetricCallbackFromMask",
+    "MetricAccumulator",
+    "StreamingWAUC",
+    "wauc_breakdown",
 ]
 
 
@@ -94,23 +101,212 @@ __all__ = [
 #     return ((fpr[1:] - fpr[:-1]) * yy).sum()
 
 
+TPR_THRESHOLDS = [0.0, 0.4, 1.0]
+TPR_WEIGHTS = [2.0, 1.0]
+
+
+def wauc_sorted(y_true: np.ndarray, y_pred: np.ndarray) -> np.ndarray:
+    """
+    Weighted AUC of one or many sets of predictions that are already sorted by descending score.
+    Computes ROC curve from cumulative counts of positives & negatives at each distinct threshold
+    and integrates it with 2:1 weights below & above TPR=0.4 (same as in the competition metric).
+    :param y_true: Binary targets [N] or [B, N] (sorted along last axis together with y_pred)
+    :param y_pred: Scores [N] or [B, N] sorted in descending order along last axis
+    :return: Scalar or array of [B] scores
+    """
+    is_batch = np.ndim(y_pred) == 2
+    y_true = np.atleast_2d(y_true).astype(np.float64)
+    y_pred = np.atleast_2d(y_pred)
+    batch_size, n = y_true.shape
+
+    # Only last element of each group of tied scores is a point of ROC curve. Remaining elements of the group are
+    # moved to the same point, so that they add segments of zero length.
+    index = np.broadcast_to(np.arange(n), (batch_size, n))
+    is_last = np.ones((batch_size, n), dtype=bool)
+    is_last[:, :-1] = y_pred[:, :-1] != y_pred[:, 1:]
+    last_index = np.minimum.accumulate(np.where(is_last, index, n)[:, ::-1], axis=1)[:, ::-1]
+
+    tps = np.take_along_axis(np.cumsum(y_true, axis=1), last_index, axis=1)
+    fps = np.take_along_axis(np.cumsum(1.0 - y_true, axis=1), last_index, axis=1)
+    auc = _wauc_from_cumulative_counts(tps, fps)
+    return auc if is_batch else auc[0]
+
+
+def _wauc_from_cumulative_counts(tps: np.ndarray, fps: np.ndarray) -> np.ndarray:
+    """
+    :param tps: Number of positives with score above each threshold [B, N] (thresholds in descending order)
+    :param fps: Number of negatives with score above each threshold [B, N]
+    :return: Array of [B] scores
+    """
+    zeros = np.zeros((len(tps), 1))
+    with np.errstate(divide="ignore", invalid="ignore"):
+        tpr = np.hstack([zeros, tps]) / tps[:, -1:]
+        fpr = np.hstack([zeros, fps]) / fps[:, -1:]
+
+    dx = fpr[:, 1:] - fpr[:, :-1]
+    auc = np.zeros(len(tps))
+    for idx in range(len(TPR_THRESHOLDS) - 1):
+        y = np.minimum(tpr, TPR_THRESHOLDS[idx + 1]) - TPR_THRESHOLDS[idx]
+        # Only points with TPR above lower threshold are integrated
+        segment = (tpr[:, :-1] >= TPR_THRESHOLDS[idx]) & (tpr[:, 1:] >= TPR_THRESHOLDS[idx])
+        auc += TPR_WEIGHTS[idx] * np.sum(np.where(segment, dx * (y[:, 1:] + y[:, :-1]) * 0.5, 0), axis=1)
+
+    return auc / np.dot(np.diff(TPR_THRESHOLDS), TPR_WEIGHTS)
+
+
+def batch_wauc(y_true: np.ndarray, y_pred: np.ndarray) -> np.ndarray:
+    """
+    Weighted AUC of a batch of predictions
+    :param y_true: Targets [B, N]. Values > 0 are positives (stego)
+    :param y_pred: Scores [B, N]
+    :return: Array of [B] scores
+    """
+    y_true = np.atleast_2d(y_true)
+    y_pred = np.atleast_2d(y_pred)
+    order = np.argsort(-y_pred, axis=1, kind="mergesort")
+    return wauc_sorted(np.take_along_axis(y_true > 0, order, axis=1), np.take_along_axis(y_pred, order, axis=1))
+
+
 def wauc(y_true, y_pred):
-    y_true = np.array(y_true)
-    fpr, tpr, thresholds = roc_curve((y_true > 0).astype(int), y_pred, drop_intermediate=False)
-    tpr_thresholds = [0.0, 0.4, 1.0]
-    weights = [2.0, 1.0]
-    auc_x = 0.0
-    for idx in range(len(tpr_thresholds) - 1):
-        mask = tpr >= tpr_thresholds[idx]
-        x = fpr[mask]
-        y = tpr[mask]
-        mask = y > tpr_thresholds[idx + 1]
-        y[mask] = tpr_thresholds[idx + 1]
-        y = y - tpr_thresholds[idx]
-        auc_x = auc_x + weights[idx] * np.trapz(y, x)
-    areas = np.array(tpr_thresholds[1:]) - np.array(tpr_thresholds[:-1])
-    normalization = np.dot(areas, np.array(weights))
-    return auc_x / normalization
+    return float(batch_wauc(np.reshape(y_true, (1, -1)), np.reshape(y_pred, (1, -1)))[0])
+
+
+def _draw_without_replacement(rng: np.random.Generator, population: int, num_samples: int, n: int) -> np.ndarray:
+    # [n, num_samples] matrix of indexes, each row is a sample without replacement from range(population)
+    return np.argsort(rng.random((n, population)), axis=1)[:, :num_samples]
+
+
+def _bootstrap_wauc_chunk(args) -> np.ndarray:
+    y_true, y_pred, class_indexes, samples, subset, n, seed = args
+    rng = np.random.default_rng(seed)
+    indexes = np.hstack(
+        [
+            class_index[_draw_without_replacement(rng, len(class_index), num_samples, n)]
+            for class_index, num_samples in zip(class_indexes, samples)
+        ]
+    )
+    if subset is not None:
+        indexes = np.take_along_axis(indexes, _draw_without_replacement(rng, indexes.shape[1], subset, n), axis=1)
+    return batch_wauc(y_true[indexes], y_pred[indexes])
+
+
+def bootstrap_wauc(
+    y_true,
+    y_pred,
+    n: int,
+    samples: List[int],
+    subset: Optional[int] = None,
+    chunk_size: int = 64,
+    workers: int = 0,
+    seed: Optional[int] = None,
+) -> np.ndarray:
+    """
+    Estimate distribution of wAUC by drawing n resamples with given number of samples of each class (without
+    replacement). All resamples of a chunk are drawn as a single index matrix and scored in one vectorized pass.
+    :param y_true: Class labels [N] (0 - cover)
+    :param y_pred: Scores [N]
+    :param n: Number of resamples
+    :param samples: Number of samples of each class in the resample
+    :param subset: If set, wAUC is computed on random subset of this size of each resample (public LB estimate)
+    :param chunk_size: Number of resamples scored at once
+    :param workers: Number of worker processes. If 0, chunks are scored in the calling process
+    :param seed: Random seed
+    :return: Array of [n] wAUC scores
+    """
+    y_true = np.asarray(y_true, dtype=int)
+    y_pred = np.asarray(y_pred)
+    class_indexes = [np.flatnonzero(y_true == class_index) for class_index in range(len(samples))]
+
+    seeds = np.random.SeedSequence(seed).spawn((n + chunk_size - 1) // chunk_size)
+    chunks = [
+        (y_true, y_pred, class_indexes, samples, subset, min(chunk_size, n - i * chunk_size), chunk_seed)
+        for i, chunk_seed in enumerate(seeds)
+    ]
+
+    if workers > 0:
+        with Pool(workers) as wp:
+            scores = wp.map(_bootstrap_wauc_chunk, chunks)
+    else:
+        scores = [_bootstrap_wauc_chunk(chunk) for chunk in chunks]
+    return np.concatenate(scores)
+
+
+class StreamingWAUC:
+    """
+    Streaming approximation of wAUC for evaluation sets that do not fit in memory.
+
+    Keeps fixed-resolution histograms of scores of negatives (cover) and positives (stego), optionally per group
+    (e.g. quality factor). Memory does not depend on number of samples, and histograms of several workers or
+    processes can be merged with merge() / all_reduce(). Samples that fall into the same bin are treated as ties.
+    Since the true ROC curve within a bin may only lie inside the rectangle spanned by the bin's FPR & TPR increments,
+    error of the approximation vs. exact wAUC of unbinned scores is bounded by the sum of areas of these rectangles
+    (scaled by max TPR weight / 2 and normalization) that is reported by compute().
+    """
+
+    def __init__(self, num_bins: int = 65536, score_range=(0.0, 1.0), num_groups: int = 1, device="cpu"):
+        self.num_bins = num_bins
+        self.score_range = score_range
+        self.num_groups = num_groups
+        self.negatives = torch.zeros((num_groups, num_bins), dtype=torch.long, device=device)
+        self.positives = torch.zeros((num_groups, num_bins), dtype=torch.long, device=device)
+
+    @torch.no_grad()
+    def update(self, y_true: torch.Tensor, y_pred: torch.Tensor, groups: Optional[torch.Tensor] = None):
+        """
+        :param y_true: Targets [N]. Values > 0 are positives (stego)
+        :param y_pred: Scores [N]. Scores outside of score_range are clipped to the first/last bin
+        :param groups: Optional group index of each sample [N]
+        """
+        y_true = torch.as_tensor(y_true, device=self.negatives.device).reshape(-1)
+        y_pred = torch.as_tensor(y_pred, device=self.negatives.device).reshape(-1).double()
+
+        low, high = self.score_range
+        bins = ((y_pred - low) * (self.num_bins / (high - low))).long().clamp_(0, self.num_bins - 1)
+        if groups is not None:
+            bins += torch.as_tensor(groups, device=bins.device).reshape(-1).long() * self.num_bins
+
+        size = self.num_groups * self.num_bins
+        positive = y_true > 0
+        self.positives += torch.bincount(bins[positive], minlength=size).view(self.num_groups, self.num_bins)
+        self.negatives += torch.bincount(bins[~positive], minlength=size).view(self.num_groups, self.num_bins)
+
+    def merge(self, other: "StreamingWAUC") -> "StreamingWAUC":
+        if self.num_bins != other.num_bins or self.num_groups != other.num_groups:
+            raise ValueError("Cannot merge StreamingWAUC instances with different number of bins or groups")
+        self.negatives += other.negatives.to(self.negatives.device)
+        self.positives += other.positives.to(self.positives.device)
+        return self
+
+    def all_reduce(self) -> "StreamingWAUC":
+        """
+        Sum histograms of all processes of distributed run
+        """
+        if dist.is_available() and dist.is_initialized():
+            dist.all_reduce(self.negatives)
+            dist.all_reduce(self.positives)
+        return self
+
+    def compute(self, group: Optional[int] = None) -> Tuple[float, float]:
+        """
+        :param group: Index of the group or None to compute metric over all samples
+        :return: Tuple of approximate wAUC and upper bound of its absolute error
+        """
+        if group is None:
+            negatives = to_numpy(self.negatives.sum(dim=0))
+            positives = to_numpy(self.positives.sum(dim=0))
+        else:
+            negatives = to_numpy(self.negatives[group])
+            positives = to_numpy(self.positives[group])
+
+        # Bins in descending order of scores
+        tps = np.cumsum(positives[::-1]).astype(np.float64)
+        fps = np.cumsum(negatives[::-1]).astype(np.float64)
+        score = _wauc_from_cumulative_counts(tps[None, :], fps[None, :])[0]
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+            rectangles = (positives / tps[-1]) * (negatives / fps[-1])
+        error = 0.5 * max(TPR_WEIGHTS) * rectangles.sum() / np.dot(np.diff(TPR_THRESHOLDS), TPR_WEIGHTS)
+        return float(score), float(error)
 
 
 # EXPECTED_TEST_DISTRIBUTION = [0.25, 0.25, 0.25, 0.25]
@@ -118,36 +314,24 @@ EXPECTED_TEST_DISTRIBUTION = [0.5, 0.5 / 3, 0.5 / 3, 0.5 / 3]
 
 
 def shaky_wauc(
-    y_true, y_pred, n: int = 1000, k=5000, j=5000, distribution=EXPECTED_TEST_DISTRIBUTION, return_scores=False
+    y_true,
+    y_pred,
+    n: int = 1000,
+    k=5000,
+    j=5000,
+    distribution=EXPECTED_TEST_DISTRIBUTION,
+    return_scores=False,
+    workers: int = 0,
 ):
     samples = (np.array(distribution) * k).astype(int)
 
     y_true = np.array(y_true, dtype=int)
     assert len(np.unique(y_true)) > 2
     y_pred = np.array(y_pred, dtype=np.float32)
-    scores = []
-    for _ in range(n):
-        sample_y_true = []
-        sample_y_pred = []
-        for class_index, num_samples in enumerate(samples):
-            y_true_i = y_true[y_true == class_index]
-            y_pred_i = y_pred[y_true == class_index]
-            indexes = np.random.choice(np.arange(len(y_true_i)), num_samples, replace=False)
-            sample_y_true.extend(y_true_i[indexes])
-            sample_y_pred.extend(y_pred_i[indexes])
-
-        sample_y_true = np.array(sample_y_true)
-        sample_y_pred = np.array(sample_y_pred)
-        if j != k:
-            public_lb_indexes = np.random.choice(np.arange(len(sample_y_true)), 1000, replace=False)
-            sample_y_true = sample_y_true[public_lb_indexes]
-            sample_y_pred = sample_y_pred[public_lb_indexes]
-
-        wauc_score = alaska_weighted_auc(sample_y_true, sample_y_pred)
-        scores.append(wauc_score)
+    scores = bootstrap_wauc(y_true, y_pred, n, samples, subset=j if j != k else None, workers=workers)
 
     if return_scores:
-        return scores
+        return scores.tolist()
 
     return np.mean(scores)
 
@@ -187,15 +371,103 @@ def embedding_to_probas(x: torch.Tensor):
     return predicted
 
 
+def _all_gather_tensor(x: torch.Tensor) -> torch.Tensor:
+    """
+    Concatenate 1D tensors of different lengths from all processes with tensor collectives (no pickling)
+    """
+    if not dist.is_available() or not dist.is_initialized() or dist.get_world_size() == 1:
+        return x
+
+    world_size = dist.get_world_size()
+    size = torch.tensor([len(x)], device=x.device, dtype=torch.long)
+    sizes = [torch.zeros_like(size) for _ in range(world_size)]
+    dist.all_gather(sizes, size)
+    sizes = [int(s.item()) for s in sizes]
+
+    padded = x.new_zeros(max(sizes))
+    padded[: len(x)] = x
+    gathered = [torch.zeros_like(padded) for _ in range(world_size)]
+    dist.all_gather(gathered, padded)
+    return torch.cat([g[:s] for g, s in zip(gathered, sizes)])
+
+
+class MetricAccumulator:
+    """
+    Accumulates per-sample targets, scores and (optionally) quality factors of the epoch in preallocated tensors
+    on the device of the model outputs, so that no host synchronization happens per batch.
+    Buffers grow by doubling when capacity is exceeded.
+    """
+
+    def __init__(self, capacity: int = 4096):
+        self.capacity = capacity
+        self.size = 0
+        self.buffers = {}
+
+    def reset(self):
+        self.size = 0
+
+    def update(self, **values: torch.Tensor):
+        """
+        :param values: 1D tensors of the same length (e.g. labels, scores, quality factors)
+        """
+        values = dict((key, value.detach().reshape(-1)) for key, value in values.items())
+        batch_size = len(next(iter(values.values())))
+        end = self.size + batch_size
+
+        for key, value in values.items():
+            buffer = self.buffers.get(key)
+            if buffer is None or buffer.device != value.device or len(buffer) < end:
+                capacity = max(self.capacity, 2 * len(buffer) if buffer is not None else 0)
+                while capacity < end:
+                    capacity *= 2
+                new_buffer = value.new_empty(capacity)
+                if buffer is not None and self.size > 0:
+                    new_buffer[: self.size] = buffer[: self.size].to(value.device)
+                self.buffers[key] = buffer = new_buffer
+            buffer[self.size : end] = value
+
+        self.size = end
+
+    def get(self, key: str, gather=True) -> np.ndarray:
+        """
+        :param gather: If True, values of all processes of distributed run are concatenated
+        :return: Accumulated values of the key
+        """
+        if key not in self.buffers:
+            return np.zeros(0)
+
+        values = self.buffers[key][: self.size]
+        if gather:
+            values = _all_gather_tensor(values)
+        return to_numpy(values)
+
+
+def wauc_breakdown(true_labels: np.ndarray, pred_labels: np.ndarray, groups: List[np.ndarray]) -> List[float]:
+    """
+    Compute wAUC of the whole set and of subsets given by masks, sorting predictions only once
+    :param true_labels: Targets [N] (values > 0 are positives)
+    :param pred_labels: Scores [N]
+    :param groups: List of boolean masks [N]
+    :return: Score of the whole set followed by score of each group
+    """
+    order = np.argsort(-pred_labels, kind="mergesort")
+    true_labels = true_labels[order] > 0
+    pred_labels = pred_labels[order]
+
+    scores = [wauc_sorted(true_labels, pred_labels)]
+    for mask in groups:
+        mask = mask[order]
+        scores.append(wauc_sorted(true_labels[mask], pred_labels[mask]))
+    return [float(x) for x in scores]
+
+
 class CompetitionMetricCallback(Callback):
     def __init__(self, input_key: str, output_key: str, output_activation: Callable, prefix="auc", class_names=None):
         super().__init__(CallbackOrder.Metric)
         self.prefix = prefix
         self.input_key = input_key
         self.output_key = output_key
-        self.true_labels = []
-        self.pred_labels = []
-        self.quality_factors = []
+        self.accumulator = MetricAccumulator()
         self.output_activation = output_activation
         if class_names is None:
             class_names = ["Cover", "JMiPOD", "JUNIWARD", "UERD"]
@@ -203,56 +475,45 @@ class CompetitionMetricCallback(Callback):
         self.class_names = class_names
 
     def on_loader_start(self, state: RunnerState):
-        self.true_labels = []
-        self.pred_labels = []
-        self.quality_factors = []
+        self.accumulator.reset()
 
     @torch.no_grad()
     def on_batch_end(self, state: RunnerState):
-        output = self.output_activation(state.output[self.output_key].detach().cpu())
+        output = self.output_activation(state.output[self.output_key].detach())
+        values = {"true_labels": state.input[self.input_key], "pred_labels": output}
         if INPUT_IMAGE_QF_KEY in state.input:
-            self.quality_factors.extend(to_numpy(state.input[INPUT_IMAGE_QF_KEY]).flatten())
-        self.true_labels.extend(to_numpy(state.input[self.input_key]).flatten())
-        self.pred_labels.extend(to_numpy(output).flatten())
+            values["quality_factors"] = state.input[INPUT_IMAGE_QF_KEY]
+        self.accumulator.update(**dict((key, value.to(output.device)) for key, value in values.items()))
 
     def on_loader_end(self, state: RunnerState):
-        true_labels = np.array(self.true_labels)
-        pred_labels = np.array(self.pred_labels)
-        quality_factors = np.array(self.quality_factors)
-
-        true_labels = all_gather(true_labels)
-        true_labels = np.concatenate(true_labels)
+        true_labels = self.accumulator.get("true_labels")
+        pred_labels = self.accumulator.get("pred_labels")
+        quality_factors = self.accumulator.get("quality_factors")
 
-        pred_labels = all_gather(pred_labels)
-        pred_labels = np.concatenate(pred_labels)
+        true_labels_b = (true_labels > 0).astype(int)
 
-        quality_factors = all_gather(quality_factors)
-        quality_factors = np.concatenate(quality_factors)
+        # Overall, per-QF and per-(QF, method) scores from a single sort of predictions
+        groups = []
+        if len(quality_factors) > 0:
+            for qf in [0, 1, 2]:
+                groups.append(quality_factors == qf)
+            for qf in [0, 1, 2]:
+                for target in range(len(self.class_names) - 1):
+                    groups.append((quality_factors == qf) & ((true_labels == 0) | (true_labels == target + 1)))
 
-        true_labels_b = (true_labels > 0).astype(int)
-        # Just ensure true_labels are 0,1
-        score = alaska_weighted_auc(true_labels_b, pred_labels)
-        state.metrics.epoch_values[state.loader_name][self.prefix] = float(score)
+        scores = wauc_breakdown(true_labels, pred_labels, groups)
+        state.metrics.epoch_values[state.loader_name][self.prefix] = scores[0]
 
         logger = get_tensorboard_logger(state)
         logger.add_pr_curve(self.prefix, true_labels_b, pred_labels)
 
         # Compute
         if len(quality_factors) > 0:
-            score_75 = alaska_weighted_auc(true_labels_b[quality_factors == 0], pred_labels[quality_factors == 0])
-            score_90 = alaska_weighted_auc(true_labels_b[quality_factors == 1], pred_labels[quality_factors == 1])
-            score_95 = alaska_weighted_auc(true_labels_b[quality_factors == 2], pred_labels[quality_factors == 2])
+            state.metrics.epoch_values[state.loader_name][self.prefix + "/qf_75"] = scores[1]
+            state.metrics.epoch_values[state.loader_name][self.prefix + "/qf_90"] = scores[2]
+            state.metrics.epoch_values[state.loader_name][self.prefix + "/qf_95"] = scores[3]
 
-            state.metrics.epoch_values[state.loader_name][self.prefix + "/qf_75"] = float(score_75)
-            state.metrics.epoch_values[state.loader_name][self.prefix + "/qf_90"] = float(score_90)
-            state.metrics.epoch_values[state.loader_name][self.prefix + "/qf_95"] = float(score_95)
-
-            score_mask = np.zeros((3, 3))
-            for qf in [0, 1, 2]:
-                for target in range(len(self.class_names) - 1):
-                    mask = (quality_factors == qf) & ((true_labels == 0) | (true_labels == target + 1))
-                    score = alaska_weighted_auc(true_labels_b[mask], pred_labels[mask])
-                    score_mask[qf, target] = score
+            score_mask = np.array(scores[4:]).reshape(3, len(self.class_names) - 1)
 
             fig = self.plot_matrix(
                 score_mask,
@@ -330,27 +591,15 @@ class CompetitionMetricCallbackFromMask(CompetitionMetricCallback):
         super().__init__(input_key, output_key, output_activation, prefix)
         self.input_activation = input_activation
 
-    def on_loader_start(self, state: RunnerState):
-        self.true_labels = []
-        self.pred_labels = []
-
     @torch.no_grad()
     def on_batch_end(self, state: RunnerState):
-        target = self.input_activation(state.input[self.input_key].detach().cpu())
-        output = self.output_activation(state.output[self.output_key].detach().cpu())
-
-        self.true_labels.extend(to_numpy(target).flatten())
-        self.pred_labels.extend(to_numpy(output).flatten())
+        target = self.input_activation(state.input[self.input_key].detach())
+        output = self.output_activation(state.output[self.output_key].detach())
+        self.accumulator.update(true_labels=target.to(output.device), pred_labels=output)
 
     def on_loader_end(self, state: RunnerState):
-        true_labels = np.array(self.true_labels)
-        pred_labels = np.array(self.pred_labels)
-
-        true_labels = all_gather(true_labels)
-        true_labels = np.concatenate(true_labels)
-
-        pred_labels = all_gather(pred_labels)
-        pred_labels = np.concatenate(pred_labels)
+        true_labels = self.accumulator.get("true_labels")
+        pred_labels = self.accumulator.get("pred_labels")
 
         true_labels_b = (true_labels > 0).astype(int)
         # Just ensure true_labels are 0,1
@@ -367,24 +616,20 @@ class OutputDistributionCallback(Callback):
         self.prefix = prefix
         self.input_key = input_key
         self.output_key = output_key
-        self.true_labels = []
-        self.pred_labels = []
+        self.accumulator = MetricAccumulator()
         self.output_activation = output_activation
 
     def on_loader_start(self, state: RunnerState):
-        self.true_labels = []
-        self.pred_labels = []
+        self.accumulator.reset()
 
     @torch.no_grad()
     def on_batch_end(self, state: RunnerState):
-        output = state.output[self.output_key].detach()
-
-        self.true_labels.extend(to_numpy(state.input[self.input_key]).flatten())
-        self.pred_labels.extend(to_numpy(self.output_activation(output)).flatten())
+        output = self.output_activation(state.output[self.output_key].detach())
+        self.accumulator.update(true_labels=state.input[self.input_key].to(output.device), pred_labels=output)
 
     def on_loader_end(self, state: RunnerState):
-        true_labels = np.array(self.true_labels)
-        pred_probas = np.array(self.pred_labels)
+        true_labels = self.accumulator.get("true_labels", gather=False)
+        pred_probas = self.accumulator.get("pred_labels", gather=False)
 
         if len(np.unique(true_labels) > 2):
             true_labels = true_labels > 0.5
@@ -0,0 +1,202 @@
+from typing import Dict, Optional
+
+import numpy as np
+import torch
+import torch.distributed as dist
+import torch.nn.functional as F
+from catalyst.dl import Callback, CallbackOrder, RunnerState
+from torch.utils.data import Sampler
+
+from .dataset import INPUT_INDEX_KEY, INPUT_TRUE_MODIFICATION_FLAG, OUTPUT_PRED_MODIFICATION_FLAG
+
+__all__ = ["HardExampleMiningCallback", "HardExampleSampler", "SampleLossTracker"]
+
+
+class SampleLossTracker:
+    """
+    Exponential moving average of per-sample training loss, indexed by position of the sample in the dataset.
+    Losses are kept in float16 array, so tracking the whole training set takes ~2 bytes per sample.
+    """
+
+    def __init__(self, num_samples: int, momentum: float = 0.5):
+        """
+        :param momentum: Weight of the previous value in the moving average
+        """
+        self.momentum = momentum
+        self.losses = np.zeros(num_samples, dtype=np.float16)
+        self.seen = np.zeros(num_samples, dtype=bool)
+
+    def __len__(self):
+        return len(self.losses)
+
+    def __repr__(self):
+        return f"SampleLossTracker(samples={len(self)}, seen={int(self.seen.sum())}, momentum={self.momentum})"
+
+    def update(self, indexes: np.ndarray, losses: np.ndarray):
+        indexes = np.asarray(indexes, dtype=np.int64)
+        losses = np.asarray(losses, dtype=np.float32)
+        previous = self.losses[indexes].astype(np.float32)
+        ema = np.where(self.seen[indexes], self.momentum * previous + (1 - self.momentum) * losses, losses)
+        self.losses[indexes] = np.minimum(ema, np.finfo(np.float16).max)
+        self.seen[indexes] = True
+
+    def get_losses(self) -> np.ndarray:
+        """
+        :return: Per-sample losses (float32), where samples that were not seen yet get mean loss of seen samples
+        """
+        losses = self.losses.astype(np.float32)
+        if self.seen.any():
+            losses[~self.seen] = losses[self.seen].mean()
+        return losses
+
+    def synchronize(self):
+        """
+        Merge statistics of all replicas in distributed training (Each replica updates only samples of its shard)
+        """
+        if not (dist.is_available() and dist.is_initialized()) or dist.get_world_size() == 1:
+            return
+
+        device = torch.device("cuda") if dist.get_backend() == "nccl" else torch.device("cpu")
+        seen = torch.from_numpy(self.seen.astype(np.float32)).to(device)
+        losses = torch.from_numpy(self.losses.astype(np.float32)).to(device) * seen
+        dist.all_reduce(losses)
+        dist.all_reduce(seen)
+
+        seen = seen.cpu().numpy()
+        self.seen = seen > 0
+        self.losses = np.where(self.seen, losses.cpu().numpy() / np.maximum(seen, 1), 0).astype(np.float16)
+
+    def state_dict(self) -> Dict:
+        return {"momentum": self.momentum, "losses": self.losses.copy(), "seen": self.seen.copy()}
+
+    def load_state_dict(self, state: Dict):
+        if len(state["losses"]) != len(self):
+            raise ValueError(f"Loss tracker has {len(state['losses'])} samples, expected {len(self)}")
+        self.momentum = state["momentum"]
+        self.losses = np.asarray(state["losses"], dtype=np.float16).copy()
+        self.seen = np.asarray(state["seen"], dtype=bool).copy()
+
+
+class HardExampleSampler(Sampler):
+    """
+    Samples training set with replacement, with probabilities proportional to exp(loss / temperature),
+    mixed with uniform distribution (uniform_p) so that easy samples are still visited.
+    Probabilities are recomputed from the tracker every refresh_every epochs.
+
+    Like DistributedSampler, all replicas draw the same indexes for the epoch (seed + epoch) and take
+    disjoint shards of them. Epoch is incremented after each pass, or can be set explicitly with set_epoch().
+    """
+
+    def __init__(
+        self,
+        tracker: SampleLossTracker,
+        num_samples: Optional[int] = None,
+        temperature: float = 1.0,
+        uniform_p: float = 0.5,
+        refresh_every: int = 1,
+        num_replicas: int = 1,
+        rank: int = 0,
+        seed: int = 42,
+    ):
+        """
+        :param num_samples: Number of samples per epoch (all replicas). Default is size of the dataset.
+        :param temperature: Lower values focus sampling on hardest examples
+        :param uniform_p: Fraction of probability mass that is distributed uniformly
+        """
+        if not 0 <= rank < num_replicas:
+            raise ValueError(f"Invalid rank {rank}, should be in range [0, {num_replicas})")
+        if temperature <= 0:
+            raise ValueError("Temperature must be positive")
+
+        self.tracker = tracker
+        self.num_samples = (num_samples or len(tracker)) // num_replicas
+        self.temperature = temperature
+        self.uniform_p = uniform_p
+        self.refresh_every = refresh_every
+        self.num_replicas = num_replicas
+        self.rank = rank
+        self.seed = seed
+        self.epoch = 0
+        self.probabilities = np.full(len(tracker), 1.0 / len(tracker))
+
+    def __len__(self):
+        return self.num_samples
+
+    def __repr__(self):
+        return (
+            f"HardExampleSampler(samples={self.num_samples}, temperature={self.temperature}, "
+            f"uniform_p={self.uniform_p}, rank={self.rank}/{self.num_replicas})"
+        )
+
+    def set_epoch(self, epoch: int):
+        self.epoch = epoch
+
+    def refresh(self):
+        logits = self.tracker.get_losses() / self.temperature
+        weights = np.exp(logits - logits.max())
+        self.probabilities = (1 - self.uniform_p) * weights / weights.sum() + self.uniform_p / len(weights)
+
+    def __iter__(self):
+        if self.epoch % self.refresh_every == 0:
+            self.refresh()
+
+        rs = np.random.RandomState(self.seed + self.epoch)
+        self.epoch += 1
+
+        total = self.num_samples * self.num_replicas
+        indexes = rs.choice(len(self.probabilities), total, replace=True, p=self.probabilities)
+        return iter(indexes[self.rank :: self.num_replicas].tolist())
+
+    def state_dict(self) -> Dict:
+        return {"epoch": self.epoch, "probabilities": self.probabilities.copy()}
+
+    def load_state_dict(self, state: Dict):
+        self.epoch = state["epoch"]
+        self.probabilities = np.asarray(state["probabilities"]).copy()
+
+
+class HardExampleMiningCallback(Callback):
+    """
+    Updates SampleLossTracker with per-sample loss of each training batch.
+    Loss is binary cross-entropy of the modification flag (or cross-entropy for multi-class outputs).
+    Tracker & sampler states are stored in checkpoint_data["hard_example_mining"].
+    """
+
+    def __init__(
+        self,
+        tracker: SampleLossTracker,
+        sampler: Optional[HardExampleSampler] = None,
+        input_key: str = INPUT_TRUE_MODIFICATION_FLAG,
+        output_key: str = OUTPUT_PRED_MODIFICATION_FLAG,
+        index_key: str = INPUT_INDEX_KEY,
+    ):
+        super().__init__(CallbackOrder.Metric)
+        self.tracker = tracker
+        self.sampler = sampler
+        self.input_key = input_key
+        self.output_key = output_key
+        self.index_key = index_key
+
+    @torch.no_grad()
+    def on_batch_end(self, state: RunnerState):
+        if not state.loader_name.startswith("train"):
+            return
+
+        output = state.output[self.output_key].detach().float()
+        target = state.input[self.input_key].to(output.device)
+        if output.size(1) == 1:
+            losses = F.binary_cross_entropy_with_logits(output.view(-1), target.view(-1).float(), reduction="none")
+        else:
+            losses = F.cross_entropy(output, target.view(-1).long(), reduction="none")
+
+        self.tracker.update(state.input[self.index_key].cpu().numpy(), losses.cpu().numpy())
+
+    def on_loader_end(self, state: RunnerState):
+        if state.loader_name.startswith("train"):
+            self.tracker.synchronize()
+
+    def on_epoch_end(self, state: RunnerState):
+        mining_state = {"tracker": self.tracker.state_dict()}
+        if self.sampler is not None:
+            mining_state["sampler"] = self.sampler.state_dict()
+        state.checkpoint_data["hard_example_mining"] = mining_state
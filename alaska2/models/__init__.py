@@ -113,11 +113,19 @@ def model_from_checkpoint(
     return model.eval(), checkpoint
 
 
-def wrap_model_with_tta(model, tta_mode, inputs, outputs):
+def wrap_model_with_tta(model, tta_mode, inputs, outputs, batched=True, max_batch_size=None):
+    """
+    :param batched: If True, all augmented views are processed in a single forward pass
+    :param max_batch_size: Optional limit of the number of samples in a single forward pass in batched mode
+    """
     if tta_mode == "flip-hv":
-        model = HVFlipTTA(model, inputs=inputs, outputs=outputs, average=True)
+        model = HVFlipTTA(
+            model, inputs=inputs, outputs=outputs, average=True, batched=batched, max_batch_size=max_batch_size
+        )
     elif tta_mode == "d4":
-        model = D4TTA(model, inputs=inputs, outputs=outputs, average=True)
+        model = D4TTA(
+            model, inputs=inputs, outputs=outputs, average=True, batched=batched, max_batch_size=max_batch_size
+        )
     else:
         pass
 
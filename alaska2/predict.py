@@ -1,13 +1,23 @@
-from typing import List
+from typing import List, Optional
 
 import pytorch_toolbelt.inference.functional as AF
 import torch
 import torch.nn.functional as F
 from torch import nn
 
+from .augmentations import torch_dct_fliplr, torch_dct_flipud, torch_dct_rot90, torch_dct_transpose
 from .dataset import *
 
-__all__ = ["HVFlipTTA", "D4TTA"]
+__all__ = ["HVFlipTTA", "D4TTA", "DCT_INPUT_KEYS"]
+
+# Inputs holding 8x8 block DCT coefficients. Spatial augmentations of them are performed in DCT domain,
+# so model sees exactly the coefficients of rotated/flipped JPEG instead of the naively rotated coefficients grid.
+DCT_INPUT_KEYS = {
+    INPUT_FEATURES_DCT_KEY,
+    INPUT_FEATURES_DCT_Y_KEY,
+    INPUT_FEATURES_DCT_CB_KEY,
+    INPUT_FEATURES_DCT_CR_KEY,
+}
 
 
 def torch_flip_ud_lr(x: torch.Tensor):
@@ -19,76 +29,116 @@ def torch_flip_ud_lr(x: torch.Tensor):
     return x.flip(2).flip(3)
 
 
-class HVFlipTTA(nn.Module):
-    def __init__(self, model, inputs, outputs, average=True):
-        super().__init__()
-        self.model = model
-        self.inputs = inputs
-        self.output_keys = outputs
-        self.average = average
+def torch_transpose_rot90(x: torch.Tensor):
+    return AF.torch_rot90(AF.torch_transpose(x))
 
-    def augment_inputs(self, augment_fn, kwargs):
-        augmented_inputs = dict(
-            (key, augment_fn(value) if key in self.inputs else value) for key, value in kwargs.items()
-        )
-        return augmented_inputs
 
-    def forward(self, **kwargs):
+def torch_transpose_rot180(x: torch.Tensor):
+    return AF.torch_rot180(AF.torch_transpose(x))
 
-        normal_input = kwargs
-        outputs = self.model(**normal_input)
 
-        other_outputs = [
-            self.model(**self.augment_inputs(AF.torch_fliplr, normal_input)),
-            self.model(**self.augment_inputs(AF.torch_flipud, normal_input)),
-            self.model(**self.augment_inputs(torch_flip_ud_lr, normal_input)),
-        ]
+def torch_transpose_rot270(x: torch.Tensor):
+    return AF.torch_rot270(AF.torch_transpose(x))
 
-        # Create extra output with _tta suffix that contains contatenated predictions
-        for output_key in self.output_keys:
-            tta_outputs = [outputs[output_key]] + [out[output_key] for out in other_outputs]
-            outputs[output_key + "_tta"] = torch.cat(tta_outputs, dim=1)
 
-        for tta_outputs in other_outputs:
-            for output_key in self.output_keys:
-                outputs[output_key] += tta_outputs[output_key]
+def torch_identity(x: torch.Tensor):
+    return x
 
-        scale = 1.0 / (1 + len(other_outputs))
-        for output_key in self.output_keys:
-            outputs[output_key] *= scale
 
-        return outputs
+def torch_dct_flip_ud_lr(x: torch.Tensor):
+    return torch_dct_fliplr(torch_dct_flipud(x))
+
+
+def torch_dct_rot180(x: torch.Tensor):
+    return torch_dct_rot90(x, 2)
 
 
-class D4TTA(nn.Module):
-    def __init__(self, model, inputs, outputs, average=True):
+def torch_dct_rot270(x: torch.Tensor):
+    return torch_dct_rot90(x, 3)
+
+
+def torch_dct_transpose_rot90(x: torch.Tensor):
+    return torch_dct_rot90(torch_dct_transpose(x), 1)
+
+
+def torch_dct_transpose_rot180(x: torch.Tensor):
+    return torch_dct_rot90(torch_dct_transpose(x), 2)
+
+
+def torch_dct_transpose_rot270(x: torch.Tensor):
+    return torch_dct_rot90(torch_dct_transpose(x), 3)
+
+
+def _is_out_of_memory(e: RuntimeError) -> bool:
+    return "out of memory" in str(e)
+
+
+def _has_batch_size(value, batch_size: int) -> bool:
+    return torch.is_tensor(value) and value.dim() > 0 and value.size(0) == batch_size
+
+
+class _TTAWrapper(nn.Module):
+    """
+    Base class for test-time augmentation wrappers.
+    Predictions of each augmented view are averaged in output keys and concatenated (in order of views)
+    in extra outputs with "_tta" suffix.
+
+    In batched mode all views are stacked along batch dimension and processed by single forward pass.
+    If max_batch_size is set, stacked batch is split into micro-batches of at most max_batch_size samples.
+    When micro-batch does not fit into GPU memory, its size is halved until it fits and remembered for next calls.
+
+    Inputs listed in dct_inputs are transformed with DCT-domain counterparts of the views (dct_views),
+    which is an exact permutation & sign change of coefficients and costs no IDCT/DCT round-trip.
+    """
+
+    # Functions applied to input tensors of each view. First view must be identity.
+    views = []
+    # Same views for inputs of 8x8 block DCT coefficients
+    dct_views = []
+
+    def __init__(
+        self,
+        model,
+        inputs,
+        outputs,
+        average=True,
+        batched=True,
+        max_batch_size: Optional[int] = None,
+        dct_inputs: Optional[List[str]] = None,
+    ):
+        """
+        :param dct_inputs: Input keys that are augmented in DCT domain. Default is all of inputs in DCT_INPUT_KEYS
+        """
         super().__init__()
         self.model = model
         self.inputs = inputs
         self.output_keys = outputs
         self.average = average
-
-    def augment_inputs(self, augment_fn, kwargs):
-        augmented_inputs = dict(
-            (key, augment_fn(value) if key in self.inputs else value) for key, value in kwargs.items()
-        )
+        self.batched = batched
+        self.max_batch_size = max_batch_size
+        if dct_inputs is None:
+            dct_inputs = [key for key in inputs if key in DCT_INPUT_KEYS]
+        self.dct_inputs = dct_inputs
+
+    def augment_input(self, view_index: int, key: str, value: torch.Tensor) -> torch.Tensor:
+        if key in self.dct_inputs:
+            return self.dct_views[view_index](value)
+        if key in self.inputs:
+            return self.views[view_index](value)
+        return value
+
+    def augment_inputs(self, view_index: int, kwargs):
+        augmented_inputs = dict((key, self.augment_input(view_index, key, value)) for key, value in kwargs.items())
         return augmented_inputs
 
     def forward(self, **kwargs):
-        normal_input = kwargs
-        fliped_input = self.augment_inputs(AF.torch_transpose, kwargs)
+        if self.batched:
+            view_outputs = self.forward_batched(kwargs)
+        else:
+            view_outputs = [self.model(**self.augment_inputs(i, kwargs)) for i in range(len(self.views))]
 
-        outputs = self.model(**normal_input)
-
-        other_outputs = [
-            self.model(**self.augment_inputs(AF.torch_rot90, normal_input)),
-            self.model(**self.augment_inputs(AF.torch_rot180, normal_input)),
-            self.model(**self.augment_inputs(AF.torch_rot270, normal_input)),
-            self.model(**fliped_input),
-            self.model(**self.augment_inputs(AF.torch_rot90, fliped_input)),
-            self.model(**self.augment_inputs(AF.torch_rot180, fliped_input)),
-            self.model(**self.augment_inputs(AF.torch_rot270, fliped_input)),
-        ]
+        outputs = view_outputs[0]
+        other_outputs = view_outputs[1:]
 
         # Create extra output with _tta suffix that contains contatenated predictions
         for output_key in self.output_keys:
@@ -104,3 +154,93 @@ class D4TTA(nn.Module):
             outputs[output_key] *= scale
 
         return outputs
+
+    def forward_batched(self, kwargs) -> List:
+        """
+        Run all views of the batch in a single (or several micro-batched) forward pass
+        :return: List of outputs for each view
+        """
+        batch_size = None
+        for key in list(self.inputs) + list(self.dct_inputs):
+            if key in kwargs:
+                batch_size = kwargs[key].size(0)
+                break
+
+        num_views = len(self.views)
+        stacked_inputs = {}
+        for key, value in kwargs.items():
+            if key in self.inputs or key in self.dct_inputs:
+                stacked_inputs[key] = torch.cat([self.augment_input(i, key, value) for i in range(num_views)], dim=0)
+            elif _has_batch_size(value, batch_size):
+                stacked_inputs[key] = torch.cat([value] * num_views, dim=0)
+            else:
+                stacked_inputs[key] = value
+
+        stacked_outputs = self.forward_micro_batched(stacked_inputs, batch_size * num_views)
+
+        view_outputs = [dict() for _ in range(num_views)]
+        for key, value in stacked_outputs.items():
+            if _has_batch_size(value, batch_size * num_views):
+                for view_index, view_value in enumerate(value.chunk(num_views, dim=0)):
+                    view_outputs[view_index][key] = view_value
+            else:
+                for view_output in view_outputs:
+                    view_output[key] = value
+        return view_outputs
+
+    def forward_micro_batched(self, stacked_inputs, total_size: int):
+        while True:
+            chunk_size = min(self.max_batch_size or total_size, total_size)
+            try:
+                if chunk_size == total_size:
+                    return self.model(**stacked_inputs)
+
+                chunk_outputs = []
+                for start in range(0, total_size, chunk_size):
+                    chunk_inputs = {}
+                    for key, value in stacked_inputs.items():
+                        chunk_inputs[key] = (
+                            value[start : start + chunk_size] if _has_batch_size(value, total_size) else value
+                        )
+                    chunk_outputs.append(self.model(**chunk_inputs))
+
+                outputs = {}
+                for key, value in chunk_outputs[0].items():
+                    if _has_batch_size(value, chunk_size):
+                        outputs[key] = torch.cat([out[key] for out in chunk_outputs], dim=0)
+                    else:
+                        outputs[key] = value
+                return outputs
+            except RuntimeError as e:
+                if not _is_out_of_memory(e) or chunk_size == 1:
+                    raise
+                torch.cuda.empty_cache()
+                self.max_batch_size = max(1, chunk_size // 2)
+
+
+class HVFlipTTA(_TTAWrapper):
+    views = [torch_identity, AF.torch_fliplr, AF.torch_flipud, torch_flip_ud_lr]
+    dct_views = [torch_identity, torch_dct_fliplr, torch_dct_flipud, torch_dct_flip_ud_lr]
+
+
+class D4TTA(_TTAWrapper):
+    views = [
+        torch_identity,
+        AF.torch_rot90,
+        AF.torch_rot180,
+        AF.torch_rot270,
+        AF.torch_transpose,
+        torch_transpose_rot90,
+        torch_transpose_rot180,
+        torch_transpose_rot270,
+    ]
+    dct_views = [
+        torch_identity,
+        torch_dct_rot90,
+        torch_dct_rot180,
+        torch_dct_rot270,
+        torch_dct_transpose,
+        torch_dct_transpose_rot90,
+        torch_dct_transpose_rot180,
+        torch_dct_transpose_rot270,
+    ]
@@ -0,0 +1,160 @@
+import json
+import os
+from collections import defaultdict
+from typing import Dict, List
+
+import numpy as np
+import pandas as pd
+from pytorch_toolbelt.utils import fs
+
+__all__ = [
+    "PREDICTIONS_STORE_EXTENSION",
+    "PredictionWriter",
+    "predictions_store_path",
+    "read_prediction_arrays",
+    "read_predictions",
+]
+
+PREDICTIONS_STORE_EXTENSION = ".preds"
+PREDICTIONS_STORE_VERSION = 1
+
+# Per-sample columns that are kept in the index instead of shards
+INDEX_COLUMNS = ["image_id", "true_modification_flag", "true_modification_type"]
+
+
+def predictions_store_path(fname: str) -> str:
+    """
+    Location of the predictions store that corresponds to given .csv filename
+    """
+    return fs.change_extension(fname, PREDICTIONS_STORE_EXTENSION)
+
+
+class PredictionWriter:
+    """
+    Streaming writer of model predictions in columnar format.
+
+    Each prediction column is a fixed-width float32 array ([N] for logits, [N, K] for class logits,
+    TTA logits & embeddings). Batches are buffered and flushed to npz shards of rows_per_shard rows,
+    so memory usage does not depend on dataset size. Image ids and labels are written to index.csv.
+
+    Layout of the store directory:
+        meta.json                          - Version, number of rows & shards, column shapes
+        index.csv                          - image_id, true_modification_flag, true_modification_type
+        shard_00000.npz, ...               - Prediction columns
+    Metadata is written on close(), so incomplete store is never picked up by readers.
+    """
+
+    def __init__(self, root: str, rows_per_shard: int = 8192):
+        os.makedirs(root, exist_ok=True)
+        if os.path.exists(os.path.join(root, "meta.json")):
+            os.remove(os.path.join(root, "meta.json"))
+
+        self.root = root
+        self.rows_per_shard = rows_per_shard
+        self.num_rows = 0
+        self.num_shards = 0
+        self.columns: Dict[str, List[int]] = {}
+        self.index = defaultdict(list)
+        self._buffer = defaultdict(list)
+        self._buffered_rows = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is None:
+            self.close()
+
+    def write(self, batch: Dict):
+        """
+        :param batch: Dictionary of per-sample values (Lists or numpy arrays with first dimension of batch size)
+        """
+        batch_size = None
+        for key, value in batch.items():
+            if key in INDEX_COLUMNS:
+                self.index[key].extend(np.asarray(value).reshape(-1).tolist())
+                continue
+
+            value = np.asarray(value, dtype=np.float32)
+            value = value.reshape(len(value), -1) if value.ndim > 1 else value
+            if key not in self.columns:
+                self.columns[key] = list(value.shape[1:])
+            elif list(value.shape[1:]) != self.columns[key]:
+                raise ValueError(f"Column {key} has shape {value.shape[1:]}, expected {self.columns[key]}")
+
+            self._buffer[key].append(value)
+            batch_size = len(value)
+
+        if batch_size is not None:
+            self._buffered_rows += batch_size
+            self.num_rows += batch_size
+            if self._buffered_rows >= self.rows_per_shard:
+                self.flush()
+
+    def flush(self):
+        if self._buffered_rows == 0:
+            return
+
+        shard = dict((key, np.concatenate(values)) for key, values in self._buffer.items())
+        np.savez(os.path.join(self.root, f"shard_{self.num_shards:05d}.npz"), **shard)
+        self.num_shards += 1
+        self._buffer.clear()
+        self._buffered_rows = 0
+
+    def close(self):
+        self.flush()
+        pd.DataFrame.from_dict(self.index).to_csv(os.path.join(self.root, "index.csv"), index=False)
+
+        with open(os.path.join(self.root, "meta.json"), "w") as f:
+            json.dump(
+                {
+                    "version": PREDICTIONS_STORE_VERSION,
+                    "num_rows": self.num_rows,
+                    "num_shards": self.num_shards,
+                    "columns": self.columns,
+                },
+                f,
+                indent=2,
+            )
+
+
+def read_prediction_arrays(root: str) -> Dict[str, np.ndarray]:
+    """
+    Read predictions store as dictionary of arrays. Index columns are returned as well.
+    """
+    with open(os.path.join(root, "meta.json")) as f:
+        meta = json.load(f)
+
+    if meta["version"] != PREDICTIONS_STORE_VERSION:
+        raise ValueError(f"Unsupported predictions store version {meta['version']} in {root}")
+
+    shards = defaultdict(list)
+    for shard in range(meta["num_shards"]):
+        with np.load(os.path.join(root, f"shard_{shard:05d}.npz")) as data:
+            for key in meta["columns"]:
+                shards[key].append(data[key])
+
+    index = pd.read_csv(os.path.join(root, "index.csv"), dtype={"image_id": str})
+    arrays = dict((key, index[key].values) for key in index.columns)
+    for key, shape in meta["columns"].items():
+        arrays[key] = np.concatenate(shards[key]) if len(shards[key]) else np.zeros([0] + shape, dtype=np.float32)
+    return arrays
+
+
+def read_predictions(fname: str) -> pd.DataFrame:
+    """
+    Read predictions produced by oof_predictions.py as DataFrame.
+    Supports predictions stores and legacy .csv (where arrays are stored as strings) and .pkl files.
+    If there is a store next to requested .csv file, store is used instead.
+    Array columns of store are returned as columns of numpy arrays, which are accepted by parse_array and friends.
+    """
+    store = fname if os.path.isdir(fname) else predictions_store_path(fname)
+    if os.path.isfile(os.path.join(store, "meta.json")):
+        arrays = read_prediction_arrays(store)
+        return pd.DataFrame.from_dict(
+            dict((key, list(value) if value.ndim > 1 else value) for key, value in arrays.items())
+        )
+
+    if fname.endswith(".pkl"):
+        return pd.read_pickle(fname)
+    return pd.read_csv(fname)
@@ -0,0 +1,238 @@
+import os
+import random
+from typing import Any, Dict, Optional
+
+import numpy as np
+import torch
+from catalyst.dl import Callback, CallbackOrder, RunnerState
+from catalyst.utils import pack_checkpoint, unpack_checkpoint
+from torch.utils.data import Sampler
+
+__all__ = ["ResumableSampler", "ResumeCallback", "get_rng_state", "set_rng_state"]
+
+
+def _numpy_to_torch(x: Any) -> Any:
+    """
+    Recursively replace numpy arrays with tensors, so that checkpoint can be loaded by torch.load
+    with weights_only=True (Default since PyTorch 2.6). Loaders convert them back with np.asarray.
+    Unsigned arrays (e.g. state of numpy generator) are stored as int64, since older PyTorch lacks uint32 tensors.
+    """
+    if isinstance(x, np.ndarray):
+        if x.dtype.kind == "u" and x.dtype != np.uint8:
+            x = x.astype(np.int64)
+        return torch.from_numpy(np.ascontiguousarray(x))
+    if isinstance(x, dict):
+        return dict((key, _numpy_to_torch(value)) for key, value in x.items())
+    if isinstance(x, (list, tuple)):
+        return type(x)(_numpy_to_torch(value) for value in x)
+    return x
+
+
+def get_rng_state() -> Dict:
+    """
+    :return: States of python, numpy & torch (CPU and all CUDA devices) random generators
+    """
+    return {
+        "python": random.getstate(),
+        "numpy": np.random.get_state(),
+        "torch": torch.get_rng_state(),
+        "cuda": torch.cuda.get_rng_state_all() if torch.cuda.is_available() else [],
+    }
+
+
+def set_rng_state(rng_state: Dict):
+    random.setstate(rng_state["python"])
+    name, keys, *rest = rng_state["numpy"]
+    np.random.set_state((name, np.asarray(keys, dtype=np.uint32), *rest))
+    torch.set_rng_state(rng_state["torch"])
+    if torch.cuda.is_available() and len(rng_state["cuda"]):
+        torch.cuda.set_rng_state_all(rng_state["cuda"])
+
+
+class ResumableSampler(Sampler):
+    """
+    Wraps another sampler (Or replaces shuffle=True if sampler is None) and remembers the order of samples
+    of the current epoch, so that interrupted epoch can be continued from given position.
+    Without wrapped sampler, order is a permutation seeded with seed + epoch.
+    Wrapped samplers that have set_epoch() (DistributedSampler, BalancedQFSampler, HardExampleSampler)
+    are called with the epoch of this sampler before each pass.
+    """
+
+    def __init__(self, sampler: Optional[Sampler], num_samples: int, seed: int = 42):
+        """
+        :param sampler: Sampler to wrap or None for random permutation of num_samples
+        :param num_samples: Size of the dataset
+        """
+        self.sampler = sampler
+        self.num_samples = num_samples
+        self.seed = seed
+        self.epoch = 0
+
+        # Order of samples of the last started epoch
+        self.indexes: Optional[np.ndarray] = None
+        # Position to continue from on next pass
+        self.start = 0
+
+    def __len__(self):
+        return len(self.sampler) if self.sampler is not None else self.num_samples
+
+    def __repr__(self):
+        return f"ResumableSampler(sampler={self.sampler}, epoch={self.epoch})"
+
+    def set_epoch(self, epoch: int):
+        self.epoch = epoch
+
+    def get_indexes(self, epoch: int) -> np.ndarray:
+        if self.sampler is None:
+            return np.random.RandomState(self.seed + epoch).permutation(self.num_samples)
+
+        if hasattr(self.sampler, "set_epoch"):
+            self.sampler.set_epoch(epoch)
+        return np.array(list(self.sampler), dtype=np.int64)
+
+    def __iter__(self):
+        if self.start == 0 or self.indexes is None:
+            self.indexes = self.get_indexes(self.epoch)
+
+        start = self.start
+        self.start = 0
+        self.epoch += 1
+        return iter(self.indexes[start:].tolist())
+
+    def state_dict(self, position: int = 0) -> Dict:
+        """
+        :param position: Number of samples of the current epoch that were processed.
+            If zero, current epoch is considered complete.
+        """
+        if position == 0:
+            return {"epoch": self.epoch, "indexes": None, "position": 0}
+        return {"epoch": self.epoch - 1, "indexes": self.indexes, "position": position}
+
+    def load_state_dict(self, state: Dict):
+        self.epoch = state["epoch"]
+        self.indexes = np.asarray(state["indexes"], dtype=np.int64) if state["indexes"] is not None else None
+        self.start = state["position"]
+
+
+class ResumeCallback(Callback):
+    """
+    Saves everything that is needed to continue interrupted training: model, optimizer, scheduler, AMP state,
+    RNG states, order of samples & position within the current epoch and states of additional objects
+    (Anything with state_dict() / load_state_dict(), e.g. SampleLossTracker).
+
+    Resume checkpoint is written every save_every train batches and at the end of each epoch
+    (via temporary file, so interruption during saving does not corrupt it).
+    If resume is True and checkpoint exists, state is restored at the start of the stage and the train loader
+    continues from the saved position. Runner restarts stage epochs from zero, so num_epochs of the stage is
+    reduced by the number of already completed epochs (A finished stage runs no epochs at all).
+    Each replica in distributed training should use its own checkpoint file.
+    """
+
+    def __init__(
+        self,
+        checkpoint_fname: str,
+        sampler: ResumableSampler,
+        resume: bool = False,
+        save_every: int = 500,
+        fp16: bool = False,
+        stateful: Optional[Dict[str, Any]] = None,
+    ):
+        """
+        :param sampler: Sampler of the train loader
+        :param save_every: Save checkpoint every N train batches (0 - only at the end of epoch)
+        :param fp16: Whether to save state of Apex AMP (fp16 training)
+        :param stateful: Additional objects to save and restore
+        """
+        super().__init__(CallbackOrder.External)
+        self.checkpoint_fname = checkpoint_fname
+        self.sampler = sampler
+        self.resume = resume
+        self.save_every = save_every
+        self.fp16 = fp16
+        self.stateful = stateful or {}
+
+        self.position = 0
+        self.num_batches = 0
+        self.rng_state = None
+        # Number of stage epochs completed before resuming
+        self.completed_epochs = 0
+
+    def save(self, state: RunnerState, epoch_complete: bool):
+        checkpoint = pack_checkpoint(model=state.model, optimizer=state.optimizer, scheduler=state.scheduler)
+        checkpoint["epoch"] = state.epoch + int(epoch_complete)
+        checkpoint["stage_epoch"] = self.completed_epochs + state.stage_epoch + int(epoch_complete)
+        checkpoint["step"] = state.step
+        checkpoint["best_main_metric_value"] = getattr(state.metrics, "best_main_metric_value", None)
+        checkpoint["sampler_state_dict"] = _numpy_to_torch(
+            self.sampler.state_dict(0 if epoch_complete else self.position)
+        )
+        checkpoint["rng_state"] = _numpy_to_torch(get_rng_state())
+        checkpoint["stateful"] = _numpy_to_torch(
+            dict((key, value.state_dict()) for key, value in self.stateful.items())
+        )
+        if self.fp16:
+            from apex import amp
+
+            checkpoint["amp_state_dict"] = amp.state_dict()
+
+        os.makedirs(os.path.dirname(self.checkpoint_fname), exist_ok=True)
+        tmp_fname = self.checkpoint_fname + ".tmp"
+        torch.save(checkpoint, tmp_fname)
+        os.replace(tmp_fname, self.checkpoint_fname)
+
+    def on_stage_start(self, state: RunnerState):
+        if not (self.resume and os.path.isfile(self.checkpoint_fname)):
+            return
+
+        checkpoint = torch.load(self.checkpoint_fname, map_location="cpu")
+        unpack_checkpoint(checkpoint, model=state.model, optimizer=state.optimizer, scheduler=state.scheduler)
+        state.epoch = checkpoint["epoch"]
+        state.step = checkpoint["step"]
+        self.completed_epochs = checkpoint["stage_epoch"]
+        state.num_epochs = max(state.num_epochs - self.completed_epochs, 0)
+        if checkpoint["best_main_metric_value"] is not None:
+            state.metrics.best_main_metric_value = checkpoint["best_main_metric_value"]
+
+        self.sampler.load_state_dict(checkpoint["sampler_state_dict"])
+        for key, value in self.stateful.items():
+            value.load_state_dict(checkpoint["stateful"][key])
+        if self.fp16:
+            from apex import amp
+
+            amp.load_state_dict(checkpoint["amp_state_dict"])
+
+        # RNG state is restored at the start of train loader, since runner re-seeds generators on each epoch
+        self.position = checkpoint["sampler_state_dict"]["position"]
+        self.rng_state = checkpoint["rng_state"]
+        print(
+            "Resuming training from",
+            self.checkpoint_fname,
+            "at epoch",
+            self.completed_epochs,
+            "sample",
+            self.position,
+        )
+
+    def on_loader_start(self, state: RunnerState):
+        if not state.loader_name.startswith("train"):
+            return
+
+        if self.rng_state is not None:
+            set_rng_state(self.rng_state)
+            self.rng_state = None
+        else:
+            self.position = 0
+        self.num_batches = 0
+
+    def on_batch_end(self, state: RunnerState):
+        if not state.loader_name.startswith("train"):
+            return
+
+        self.position += state.batch_size
+        self.num_batches += 1
+        if self.save_every and self.num_batches % self.save_every == 0:
+            self.save(state, epoch_complete=False)
+
+    def on_epoch_end(self, state: RunnerState):
+        self.position = 0
+        self.save(state, epoch_complete=True)
@@ -0,0 +1,102 @@
+from typing import List, Union
+
+import numpy as np
+from torch.utils.data import Sampler
+
+__all__ = ["BalancedQFSampler"]
+
+
+class BalancedQFSampler(Sampler):
+    """
+    Sampler that yields indices in groups of batch_size, where each group contains images of the same quality factor
+    and (nearly) equal number of images of each class (Cover, JMiPOD, JUNIWARD, UERD).
+    Must be used with DataLoader(batch_size=batch_size), so each group becomes one batch.
+
+    Like DistributedSampler, batches are shuffled with a seed that depends on the epoch and split between replicas,
+    so all replicas iterate over disjoint batches. Epoch is incremented after each pass,
+    or can be set explicitly with set_epoch().
+    Number of batches of each quality factor is proportional to number of its images; smaller classes are
+    repeated to fill their share of the batch.
+    """
+
+    def __init__(
+        self,
+        targets: Union[List, np.ndarray],
+        quality: Union[List, np.ndarray],
+        batch_size: int,
+        num_replicas: int = 1,
+        rank: int = 0,
+        seed: int = 42,
+    ):
+        """
+        :param targets: Class of each sample
+        :param quality: Quality factor of each sample
+        :param batch_size: Per-replica batch size
+        """
+        if not 0 <= rank < num_replicas:
+            raise ValueError(f"Invalid rank {rank}, should be in range [0, {num_replicas})")
+
+        self.targets = np.asarray(targets)
+        self.quality = np.asarray(quality)
+        self.batch_size = batch_size
+        self.num_replicas = num_replicas
+        self.rank = rank
+        self.seed = seed
+        self.epoch = 0
+
+        # Per quality factor: list of indexes of each class
+        self.groups = []
+        for qf in np.unique(self.quality):
+            in_qf = self.quality == qf
+            classes = [np.flatnonzero(in_qf & (self.targets == c)) for c in np.unique(self.targets[in_qf])]
+            self.groups.append((int(np.count_nonzero(in_qf)) // batch_size, classes))
+
+        num_batches = sum(num_batches for num_batches, _ in self.groups)
+        self.num_batches = num_batches // num_replicas
+
+    def __len__(self):
+        return self.num_batches * self.batch_size
+
+    def __repr__(self):
+        return (
+            f"BalancedQFSampler(batch_size={self.batch_size}, batches={self.num_batches}, "
+            f"qf_groups={len(self.groups)}, rank={self.rank}/{self.num_replicas})"
+        )
+
+    def set_epoch(self, epoch: int):
+        self.epoch = epoch
+
+    def get_batches(self, epoch: int) -> List[np.ndarray]:
+        """
+        :return: Batches (Arrays of sample indexes) of all replicas for given epoch
+        """
+        rs = np.random.RandomState(self.seed + epoch)
+        batches = []
+        for num_batches, classes in self.groups:
+            if num_batches == 0:
+                continue
+
+            # Number of samples of each class in each batch [num_batches, num_classes]
+            num_classes = len(classes)
+            counts = np.full((num_batches, num_classes), self.batch_size // num_classes)
+            for row in counts:
+                row[rs.choice(num_classes, self.batch_size % num_classes, replace=False)] += 1
+
+            offsets = np.cumsum(counts, axis=0) - counts
+            pools = [np.resize(rs.permutation(indexes), counts[:, c].sum()) for c, indexes in enumerate(classes)]
+            for b in range(num_batches):
+                batch = np.concatenate(
+                    [pools[c][offsets[b, c] : offsets[b, c] + counts[b, c]] for c in range(num_classes)]
+                )
+                batches.append(rs.permutation(batch))
+
+        order = rs.permutation(len(batches))
+        return [batches[i] for i in order]
+
+    def __iter__(self):
+        batches = self.get_batches(self.epoch)
+        self.epoch += 1
+
+        batches = batches[: self.num_batches * self.num_replicas][self.rank :: self.num_replicas]
+        for batch in batches:
+            yield from batch.tolist()
@@ -6,6 +6,7 @@ import torch
 from pytorch_toolbelt.utils import logit, fs, to_numpy
 from typing import List, Union, Tuple
 import numpy as np
+from scipy.special import expit, softmax
 from scipy.stats import rankdata
 
 from sklearn.calibration import CalibratedClassifierCV
@@ -13,11 +14,14 @@ from torch.nn import functional as F
 from alaska2 import (
     OUTPUT_PRED_MODIFICATION_FLAG,
     alaska_weighted_auc,
+    bootstrap_wauc,
     OUTPUT_PRED_MODIFICATION_TYPE,
     OUTPUT_PRED_EMBEDDING,
 )
 import re
 
+from alaska2.prediction_store import read_predictions
+
 __all__ = [
     "make_classifier_predictions",
     "make_classifier_predictions_calibrated",
@@ -25,6 +29,10 @@ __all__ = [
     "make_binary_predictions_calibrated",
     "temperature_scaling",
     "sigmoid",
+    "batch_sigmoid",
+    "batch_parse_classifier_probas",
+    "batch_classifier_probas",
+    "batch_temperature_scaling",
     "noop",
     "winsorize",
     "parse_classifier_probas",
@@ -106,6 +114,64 @@ def classifier_probas(x):
     return float(yp)
 
 
+def _as_matrix(column: pd.Series) -> np.ndarray:
+    """
+    Convert column of arrays (or their string representation in legacy .csv files) to [N, K] float32 matrix
+    """
+    values = column.values
+    if len(values) and isinstance(values[0], np.ndarray):
+        return np.stack(values).astype(np.float32, copy=False)
+    return np.array(column.apply(parse_array).tolist(), dtype=np.float32)
+
+
+def _as_vector(column) -> np.ndarray:
+    return np.asarray(column, dtype=np.float64).reshape(-1)
+
+
+def _stego_probability(logits: np.ndarray) -> np.ndarray:
+    # Probability mass of all stego classes (1 - P(cover)) from [N, num_classes] logits
+    return softmax(logits, axis=1)[:, 1:].sum(axis=1)
+
+
+def _nan_to_stego(x: np.ndarray) -> np.ndarray:
+    invalid = ~np.isfinite(x)
+    if invalid.any():
+        print(f"Detected Nan in {invalid.sum()} model predictions. Setting probability of stego to 1.0")
+        x = np.where(invalid, 1.0, x)
+    return x
+
+
+def batch_sigmoid(column) -> np.ndarray:
+    """
+    Vectorized sigmoid() for the whole column of binary logits
+    """
+    return _nan_to_stego(expit(_as_vector(column)))
+
+
+def batch_parse_classifier_probas(column) -> np.ndarray:
+    """
+    Vectorized parse_classifier_probas() for the whole column of class logits
+    (strings of legacy .csv files, arrays or [N, num_classes] matrix)
+    """
+    logits = column if isinstance(column, np.ndarray) and column.ndim == 2 else _as_matrix(pd.Series(column))
+    return _stego_probability(logits)
+
+
+def batch_classifier_probas(column) -> np.ndarray:
+    """
+    Vectorized classifier_probas() for the whole column of class logits
+    """
+    return _nan_to_stego(batch_parse_classifier_probas(column))
+
+
+def batch_temperature_scaling(x, t) -> np.ndarray:
+    """
+    Vectorized temperature_scaling() for the array of probabilities
+    """
+    x = np.clip(_as_vector(x), 1e-5, 1.0 - 1e-5)
+    return expit(np.log(x / (1.0 - x)) * t)
+
+
 def just_probas(x):
     return 1 - x[0]
 
@@ -121,31 +187,27 @@ def winsorize(x):
     return x_w
 
 
-def calibrated(test_predictions, oof_predictions, flag_transform=sigmoid, type_transform=parse_classifier_probas):
+def calibrated(
+    test_predictions, oof_predictions, flag_transform=batch_sigmoid, type_transform=batch_parse_classifier_probas
+):
     """
     Update test predictions w.r.t to calibration trained on OOF predictions
     :param test_predictions:
     :param oof_predictions:
+    :param flag_transform: Function applied to the whole column of binary logits
+    :param type_transform: Function applied to the whole column of class logits
     :return:
     """
     from sklearn.isotonic import IsotonicRegression as IR
     import matplotlib.pyplot as plt
 
     oof_predictions = oof_predictions.copy()
-    oof_predictions[OUTPUT_PRED_MODIFICATION_TYPE] = oof_predictions[OUTPUT_PRED_MODIFICATION_TYPE].apply(
-        type_transform
-    )
-    oof_predictions[OUTPUT_PRED_MODIFICATION_FLAG] = oof_predictions[OUTPUT_PRED_MODIFICATION_FLAG].apply(
-        flag_transform
-    )
+    oof_predictions[OUTPUT_PRED_MODIFICATION_TYPE] = type_transform(oof_predictions[OUTPUT_PRED_MODIFICATION_TYPE])
+    oof_predictions[OUTPUT_PRED_MODIFICATION_FLAG] = flag_transform(oof_predictions[OUTPUT_PRED_MODIFICATION_FLAG])
 
     test_predictions = test_predictions.copy()
-    test_predictions[OUTPUT_PRED_MODIFICATION_TYPE] = test_predictions[OUTPUT_PRED_MODIFICATION_TYPE].apply(
-        type_transform
-    )
-    test_predictions[OUTPUT_PRED_MODIFICATION_FLAG] = test_predictions[OUTPUT_PRED_MODIFICATION_FLAG].apply(
-        flag_transform
-    )
+    test_predictions[OUTPUT_PRED_MODIFICATION_TYPE] = type_transform(test_predictions[OUTPUT_PRED_MODIFICATION_TYPE])
+    test_predictions[OUTPUT_PRED_MODIFICATION_FLAG] = flag_transform(test_predictions[OUTPUT_PRED_MODIFICATION_FLAG])
 
     y_true = oof_predictions["true_modification_flag"].values.astype(int)
     # print("Target", np.bincount(oof_predictions["true_modification_type"].values.astype(int)))
@@ -217,28 +279,28 @@ def calibrated(test_predictions, oof_predictions, flag_transform=sigmoid, type_t
 
 
 def submit_from_average_binary(preds: List[str]):
-    preds_df = [pd.read_csv(x) for x in preds]
+    preds_df = [read_predictions(x) for x in preds]
 
     submission = preds_df[0].copy().rename(columns={"image_id": "Id"})[["Id"]]
-    submission["Label"] = sum([df["pred_modification_flag"].apply(sigmoid).values for df in preds_df]) / len(preds_df)
+    submission["Label"] = sum([batch_sigmoid(df["pred_modification_flag"]) for df in preds_df]) / len(preds_df)
     return submission
 
 
 def submit_from_average_classifier(preds: List[str]):
     assert isinstance(preds, list)
-    preds_df = [pd.read_csv(x) for x in preds]
+    preds_df = [read_predictions(x) for x in preds]
 
     submission = preds_df[0].copy().rename(columns={"image_id": "Id"})[["Id"]]
-    submission["Label"] = sum(
-        [df["pred_modification_type"].apply(parse_classifier_probas).values for df in preds_df]
-    ) / len(preds_df)
+    submission["Label"] = sum([batch_parse_classifier_probas(df["pred_modification_type"]) for df in preds_df]) / len(
+        preds_df
+    )
     return submission
 
 
 def submit_from_median_classifier(test_predictions: List[str]):
-    preds_df = [pd.read_csv(x) for x in test_predictions]
+    preds_df = [read_predictions(x) for x in test_predictions]
 
-    p = np.stack([df["pred_modification_type"].apply(parse_classifier_probas).values for df in preds_df])
+    p = np.stack([batch_parse_classifier_probas(df["pred_modification_type"]) for df in preds_df])
     p = np.median(p, axis=0)
 
     submission = preds_df[0].copy().rename(columns={"image_id": "Id"})[["Id"]]
@@ -253,7 +315,7 @@ def submit_from_binary_calibrated(test_predictions: List[str], oof_predictions:
 
     preds_df = []
     for x, y in zip(test_predictions, oof_predictions):
-        calibrated_test, scores = calibrated(pd.read_csv(x), pd.read_csv(y))
+        calibrated_test, scores = calibrated(read_predictions(x), read_predictions(y))
         print(scores)
         preds_df.append(calibrated_test)
 
@@ -269,7 +331,7 @@ def submit_from_classifier_calibrated(test_predictions: List[str], oof_predictio
 
     preds_df = []
     for x, y in zip(test_predictions, oof_predictions):
-        calibrated_test, scores = calibrated(pd.read_csv(x), pd.read_csv(y))
+        calibrated_test, scores = calibrated(read_predictions(x), read_predictions(y))
         print(scores)
         preds_df.append(calibrated_test)
 
@@ -306,8 +368,8 @@ def as_d4_tta(predictions):
 def make_binary_predictions(test_predictions: List[str]) -> List[pd.DataFrame]:
     preds_df = []
     for x in test_predictions:
-        df = pd.read_csv(x).rename(columns={"image_id": "Id"})
-        df["Label"] = df["pred_modification_flag"].apply(sigmoid)
+        df = read_predictions(x).rename(columns={"image_id": "Id"})
+        df["Label"] = batch_sigmoid(df["pred_modification_flag"])
 
         keys = ["Id", "Label"]
         if "true_modification_flag" in df:
@@ -332,7 +394,7 @@ def make_binary_predictions_calibrated(
 
     preds_df = []
     for x, y in zip(test_predictions, oof_predictions):
-        calibrated_test, scores = calibrated(pd.read_csv(x), pd.read_csv(y))
+        calibrated_test, scores = calibrated(read_predictions(x), read_predictions(y))
         if print_results:
             print(scores)
 
@@ -346,9 +408,9 @@ def make_binary_predictions_calibrated(
 def make_classifier_predictions(test_predictions: List[str]) -> List[pd.DataFrame]:
     preds_df = []
     for x in test_predictions:
-        df = pd.read_csv(x)
+        df = read_predictions(x)
         df = df.rename(columns={"image_id": "Id"})
-        df["Label"] = df["pred_modification_type"].apply(parse_classifier_probas)
+        df["Label"] = batch_parse_classifier_probas(df["pred_modification_type"])
 
         keys = ["Id", "Label"]
         if "true_modification_flag" in df:
@@ -370,10 +432,10 @@ def make_product_predictions(test_predictions: List[str]) -> List[pd.DataFrame]:
     """
     preds_df = []
     for x in test_predictions:
-        df = pd.read_csv(x)
+        df = read_predictions(x)
         df = df.rename(columns={"image_id": "Id"})
-        df["Label"] = df["pred_modification_type"].apply(parse_classifier_probas) * df["pred_modification_flag"].apply(
-            sigmoid
+        df["Label"] = batch_parse_classifier_probas(df["pred_modification_type"]) * batch_sigmoid(
+            df["pred_modification_flag"]
         )
 
         keys = ["Id", "Label"]
@@ -399,7 +461,7 @@ def make_classifier_predictions_calibrated(
 
     preds_df = []
     for x, y in zip(test_predictions, oof_predictions):
-        calibrated_test, scores = calibrated(pd.read_csv(x), pd.read_csv(y))
+        calibrated_test, scores = calibrated(read_predictions(x), read_predictions(y))
         if print_results:
             print(scores)
 
@@ -432,21 +494,14 @@ def get_x_y_for_stacking(
     X = []
 
     for p in predictions:
-        if p.endswith(".csv"):
-            p = pd.read_csv(p)
-        elif p.endswith(".pkl"):
-            p = pd.read_pickle(p)
-        else:
-            raise FileNotFoundError(p)
+        p = read_predictions(p)
 
         if "true_modification_type" in p:
             y = p["true_modification_type"].values.astype(int)
 
         if with_probas:
-            pred_modification_flag = np.expand_dims(p["pred_modification_flag"].apply(sigmoid).values, -1)
-            pred_modification_type = np.expand_dims(
-                p["pred_modification_type"].apply(parse_classifier_probas).values, -1
-            )
+            pred_modification_flag = np.expand_dims(batch_sigmoid(p["pred_modification_flag"]), -1)
+            pred_modification_type = np.expand_dims(batch_parse_classifier_probas(p["pred_modification_type"]), -1)
             X.append(pred_modification_flag)
             X.append(pred_modification_type)
             X.append(pred_modification_type * pred_modification_flag)
@@ -454,86 +509,45 @@ def get_x_y_for_stacking(
 
         if with_logits:
             pred_modification_flag = np.expand_dims(p["pred_modification_flag"].values, -1)
-            pred_modification_type = np.array(p["pred_modification_type"].apply(parse_array).tolist())
+            pred_modification_type = _as_matrix(p["pred_modification_type"])
             X.append(pred_modification_flag)
             X.append(pred_modification_type)
             print("Added logits", pred_modification_flag.shape, pred_modification_type.shape)
 
         if with_embeddings:
-            embeddings_matrix = p[OUTPUT_PRED_EMBEDDING].apply(parse_array).tolist()
-            embeddings_matrix = np.array(embeddings_matrix)
+            embeddings_matrix = _as_matrix(p[OUTPUT_PRED_EMBEDDING])
             X.append(embeddings_matrix)
             print("Added embeddings matrix", embeddings_matrix.shape)
 
         if "pred_modification_type_tta" in p:
-
-            def prase_tta_softmax(x):
-                x = parse_array(x)
-                x = torch.tensor(x)
-
-                x = x.view((4, 8))
-                x = x.softmax(dim=0)
-
-                # x = x.view((8,4))
-                # x = x.softmax(dim=1)
-                x = x.view(-1)
-                return x.tolist()
-
             if tta_logits:
-                pred_modification_type_tta = np.array(p["pred_modification_type_tta"].apply(parse_array).tolist())
+                pred_modification_type_tta = _as_matrix(p["pred_modification_type_tta"])
                 X.append(pred_modification_type_tta)
                 print("Added pred_modification_type_tta", pred_modification_type_tta.shape)
 
             if tta_probas:
-                pred_modification_type_tta = np.array(
-                    p["pred_modification_type_tta"].apply(prase_tta_softmax).tolist()
+                # Softmax over classes of each TTA view (logits are [4 classes, 8 views])
+                pred_modification_type_tta = _as_matrix(p["pred_modification_type_tta"])
+                pred_modification_type_tta = softmax(pred_modification_type_tta.reshape(-1, 4, 8), axis=1).reshape(
+                    len(pred_modification_type_tta), -1
                 )
                 X.append(pred_modification_type_tta)
                 print("Added pred_modification_type_tta", pred_modification_type_tta.shape)
 
         if "pred_modification_flag_tta" in p:
             if tta_logits:
-                col = p["pred_modification_flag_tta"].apply(parse_array)
-                X.append(col.tolist())
+                X.append(_as_matrix(p["pred_modification_flag_tta"]))
             if tta_probas:
-                col = (
-                    p["pred_modification_flag_tta"]
-                    .apply(parse_array)
-                    .apply(lambda x: torch.tensor(x).sigmoid().tolist())
-                )
-                X.append(col.tolist())
+                X.append(to_numpy(torch.from_numpy(_as_matrix(p["pred_modification_flag_tta"])).sigmoid()))
 
     X = np.column_stack(X).astype(np.float32, copy=False)
     return X, y
 
 
-def evaluate_wauc_shakeup_using_bagging(oof_predictions: pd.DataFrame, y_true_type, n):
-    wauc = []
-
+def evaluate_wauc_shakeup_using_bagging(oof_predictions: pd.DataFrame, y_true_type, n, workers: int = 0):
     distribution = [3500, 500, 500, 500]
-
-    oof_predictions = oof_predictions.copy()
-    oof_predictions["y_true_type"] = y_true_type
-    oof_predictions["y_true"] = y_true_type > 0
-
-    cover = oof_predictions[oof_predictions["y_true_type"] == 0]
-    juni = oof_predictions[oof_predictions["y_true_type"] == 1]
-    jimi = oof_predictions[oof_predictions["y_true_type"] == 2]
-    uerd = oof_predictions[oof_predictions["y_true_type"] == 3]
-
-    for _ in range(n):
-        bagging_df = pd.concat(
-            [
-                cover.sample(distribution[0]),
-                juni.sample(distribution[1]),
-                jimi.sample(distribution[2]),
-                uerd.sample(distribution[3]),
-            ]
-        )
-        auc = alaska_weighted_auc(bagging_df["y_true"], bagging_df["Label"])
-        wauc.append(auc)
-
-    return wauc
+    wauc = bootstrap_wauc(y_true_type, oof_predictions["Label"].values, n, distribution, workers=workers)
+    return wauc.tolist()
 
 
 def compute_checksum_v2(fnames: List[str]):
@@ -0,0 +1,115 @@
+import warnings
+
+warnings.simplefilter("ignore", UserWarning)
+warnings.simplefilter("ignore", FutureWarning)
+
+import argparse
+import os
+from collections import defaultdict
+
+import numpy as np
+import pandas as pd
+from catalyst.utils import any2device
+from pytorch_toolbelt.utils import fs, to_numpy
+from tqdm import tqdm
+
+from alaska2 import *
+from alaska2.prediction_store import read_predictions
+from alaska2.submissions import batch_sigmoid
+
+
+@torch.no_grad()
+def compute_cascade_predictions(model, dataset, batch_size=1, workers=0, compact_loader=False) -> pd.DataFrame:
+    df = defaultdict(list)
+    for batch in tqdm(
+        get_data_loader(
+            dataset,
+            compact=compact_loader,
+            batch_size=batch_size,
+            num_workers=workers,
+            shuffle=False,
+            drop_last=False,
+            pin_memory=True,
+        )
+    ):
+        batch = any2device(batch, device="cuda")
+        outputs = model(**batch)
+
+        df[INPUT_IMAGE_ID_KEY].extend(batch[INPUT_IMAGE_ID_KEY])
+        df[OUTPUT_PRED_MODIFICATION_FLAG].extend(to_numpy(outputs[OUTPUT_PRED_MODIFICATION_FLAG]).flatten())
+        df[OUTPUT_CASCADE_DEPTH].extend(to_numpy(outputs[OUTPUT_CASCADE_DEPTH]).flatten())
+
+    return pd.DataFrame.from_dict(df)
+
+
+@torch.no_grad()
+def main():
+    # Give no chance to randomness
+    torch.manual_seed(0)
+    np.random.seed(0)
+    torch.backends.cudnn.deterministic = True
+    torch.backends.cudnn.benchmark = False
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("checkpoint", type=str, nargs="+", help="Checkpoints in cascade order (Cheapest first)")
+    parser.add_argument("-dd", "--data-dir", type=str, default=os.environ.get("KAGGLE_2020_ALASKA2"))
+    parser.add_argument("-b", "--batch-size", type=int, default=1)
+    parser.add_argument("-w", "--workers", type=int, default=0)
+    parser.add_argument("-d4", "--d4-tta", action="store_true")
+    parser.add_argument("-hv", "--hv-tta", action="store_true")
+    parser.add_argument("--costs", type=float, nargs="+", default=None, help="Relative cost of each checkpoint")
+    parser.add_argument(
+        "--max-wauc-drop", type=float, default=0.001, help="Allowed drop of holdout wAUC compared to full ensemble"
+    )
+    parser.add_argument("--compact-loader", action="store_true")
+    parser.add_argument("-o", "--output", type=str, default="cascade_submission.csv")
+    args = parser.parse_args()
+
+    checkpoint_fnames = args.checkpoint
+    tta = "d4" if args.d4_tta else "flip-hv" if args.hv_tta else None
+    suffix = ("_flip_hv_tta" if args.hv_tta else "") + ("_d4_tta" if args.d4_tta else "")
+
+    # Calibrate bands on holdout predictions of each checkpoint (Computed by oof_predictions.py with same TTA)
+    holdout = [
+        read_predictions(fs.change_extension(x, f"_holdout_predictions{suffix}.csv")) for x in checkpoint_fnames
+    ]
+    for df in holdout[1:]:
+        if not np.array_equal(df[INPUT_IMAGE_ID_KEY].values, holdout[0][INPUT_IMAGE_ID_KEY].values):
+            raise ValueError("Holdout predictions of checkpoints have different order of images")
+
+    y_true = holdout[0][INPUT_TRUE_MODIFICATION_FLAG].values
+    probas = [batch_sigmoid(df[OUTPUT_PRED_MODIFICATION_FLAG]) for df in holdout]
+    costs = args.costs or [1.0] * len(checkpoint_fnames)
+
+    bands = calibrate_cascade_bands(probas, y_true, costs=costs, max_wauc_drop=args.max_wauc_drop)
+    predictions, depth = simulate_cascade(probas, bands)
+
+    print("Bands            :", bands)
+    print("Holdout wAUC     :", alaska_weighted_auc(y_true, np.mean(probas, axis=0)), "(full ensemble)")
+    print("Holdout wAUC     :", alaska_weighted_auc(y_true, predictions), "(cascade)")
+    print("Relative cost    :", cascade_cost(depth, costs))
+    print("Exits per stage  :", np.bincount(depth, minlength=len(probas) + 1)[1:])
+
+    model, checkpoints, required_features = cascade_from_checkpoints(
+        checkpoint_fnames, bands, outputs=[OUTPUT_PRED_MODIFICATION_FLAG], tta=tta
+    )
+    model = model.cuda().eval()
+
+    test_ds = get_test_dataset(args.data_dir, features=required_features)
+    test_predictions = compute_cascade_predictions(
+        model, test_ds, batch_size=args.batch_size, workers=args.workers, compact_loader=args.compact_loader
+    )
+    print("Test cost        :", cascade_cost(test_predictions[OUTPUT_CASCADE_DEPTH].values, costs))
+    test_predictions.to_csv(fs.change_extension(args.output, "_raw_predictions.csv"), index=False)
+
+    submission = pd.DataFrame.from_dict(
+        {
+            "Id": test_predictions[INPUT_IMAGE_ID_KEY].values,
+            "Label": test_predictions[OUTPUT_PRED_MODIFICATION_FLAG].values.astype(np.float32),
+        }
+    )
+    submission.to_csv(args.output, index=False)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+import argparse
+import os
+from multiprocessing import Pool
+
+from pytorch_toolbelt.utils import fs
+from tqdm import tqdm
+
+from alaska2.dct_store import DCT_STORE_DIR, DctStoreWriter, dct_store_key, read_npz_record, sparse_delta
+
+STEGO_FOLDERS = ["JMiPOD", "JUNIWARD", "UERD"]
+
+
+def read_record(args):
+    index, dct_fname, cover_fname = args
+    dct, qtables = read_npz_record(dct_fname)
+    if cover_fname is None:
+        return index, dct, None, qtables
+
+    cover_dct, _ = read_npz_record(cover_fname)
+    return index, None, sparse_delta(cover_dct, dct), qtables
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert .npz files of save_dct.py to memory-mapped DCT store")
+    parser.add_argument("-dd", "--data-dir", type=str, default=os.environ.get("KAGGLE_2020_ALASKA2"))
+    parser.add_argument("-od", "--output-dir", type=str, default=None, help="Default is <data-dir>/dct_store")
+    parser.add_argument(
+        "-f", "--folders", type=str, nargs="+", default=["Cover", "JMiPOD", "JUNIWARD", "UERD", "Test"]
+    )
+    parser.add_argument("-s", "--records-per-shard", type=int, default=8192)
+    parser.add_argument("-w", "--workers", type=int, default=16)
+    parser.add_argument(
+        "--sparse-stego",
+        action="store_true",
+        help="Store stego images as sparse differences to their cover (Requires Cover folder)",
+    )
+
+    args = parser.parse_args()
+    data_dir = args.data_dir
+    output_dir = args.output_dir or os.path.join(data_dir, DCT_STORE_DIR)
+
+    dct_files = []
+    for folder in args.folders:
+        folder_files = [x for x in fs.find_in_dir(os.path.join(data_dir, folder)) if x.endswith(".npz")]
+        print(folder, len(folder_files))
+        dct_files += folder_files
+
+    keys = [dct_store_key(x) for x in dct_files]
+    cover_files = [None] * len(dct_files)
+    if args.sparse_stego:
+        if "Cover" not in args.folders:
+            raise ValueError("Sparse stego records require Cover folder")
+
+        cover_keys = set(key for key in keys if key.startswith("Cover/"))
+        for i, dct_fname in enumerate(dct_files):
+            folder = os.path.basename(os.path.dirname(dct_fname))
+            cover_fname = os.path.join(data_dir, "Cover", os.path.basename(dct_fname))
+            if folder in STEGO_FOLDERS and dct_store_key(cover_fname) in cover_keys:
+                cover_files[i] = cover_fname
+
+    bases = dict((key, dct_store_key(cover)) for key, cover in zip(keys, cover_files) if cover is not None)
+    writer = DctStoreWriter(output_dir, keys=keys, records_per_shard=args.records_per_shard, bases=bases)
+
+    with Pool(args.workers) as wp:
+        for index, dct, delta, qtables in tqdm(
+            wp.imap_unordered(read_record, zip(range(len(dct_files)), dct_files, cover_files), chunksize=16),
+            total=len(dct_files),
+        ):
+            if delta is not None:
+                writer.write_delta(index, *delta, qtables)
+            else:
+                writer.write(index, dct, qtables)
+
+    writer.close()
+    print("Saved DCT store to", output_dir)
+    if bases:
+        print("Sparse stego records", len(bases), "changed coefficients", writer.num_deltas)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,34 +1,10 @@
 import argparse
 import os
-from collections import defaultdict
 
-import numpy as np
-import cv2
-import torch
-from pytorch_toolbelt.utils import fs, to_numpy
-from tqdm import tqdm
-
-from alaska2 import idct8
-from alaska2.dataset import idct8v2
-from alaska2.models.dct import SpaceToDepth
-
-import torch
 import pandas as pd
-from torch import Tensor
-from typing import Iterable
-
+from pytorch_toolbelt.utils import fs
 
-def quality_factror_from_qm(qm):
-    if qm[0, 0] == 2:
-        # print('Quality Factor is 95')
-        return 95
-    elif qm[0, 0] == 3:
-        # print('Quality Factor is 90')
-        return 90
-    elif qm[0, 0] == 8:
-        return 75
-    else:
-        raise ValueError("Unknown quality factor" + str(qm[0, 0]))
+from alaska2.jpeg_header import get_qf_index
 
 
 def target_from_fname(image_fname):
@@ -46,6 +22,7 @@ def target_from_fname(image_fname):
 def main():
     parser = argparse.ArgumentParser()
     parser.add_argument("-dd", "--data-dir", type=str, default=os.environ.get("KAGGLE_2020_ALASKA2"))
+    parser.add_argument("-w", "--workers", type=int, default=8, help="Number of worker processes")
 
     args = parser.parse_args()
     data_dir = args.data_dir
@@ -61,25 +38,20 @@ def main():
         + fs.find_images_in_dir(JUNIWARD)
         + fs.find_images_in_dir(UERD)
     )
-    # dataset = dataset[:500]
-    df = defaultdict(list)
-    for image_fname in tqdm(dataset):
-        target = target_from_fname(image_fname)
-        dct_fname = fs.change_extension(image_fname, ".npz")
-        dct_data = np.load(dct_fname)
-        qm0 = dct_data["qm0"]
-        qm1 = dct_data["qm1"]
-        qf = quality_factror_from_qm(qm0)
-        fsize = os.stat(image_fname).st_size
 
-        df["image_id"].append(fs.id_from_fname(image_fname))
-        df["target"].append(target)
-        df["quality"].append(qf)
-        df["qm0"].append(qm0.flatten().tolist())
-        df["qm1"].append(qm1.flatten().tolist())
-        df["file_size"].append(fsize)
-
-    df = pd.DataFrame.from_dict(df)
+    # Quality factors & quantization tables are read from JPEG headers
+    index = get_qf_index(dataset, os.path.join(data_dir, "qf_index.pkl"), workers=args.workers)
+
+    df = pd.DataFrame.from_dict(
+        {
+            "image_id": [fs.id_from_fname(x) for x in dataset],
+            "target": [target_from_fname(x) for x in dataset],
+            "quality": index["quality"].values,
+            "qm0": index["qm0"].values,
+            "qm1": index["qm1"].values,
+            "file_size": index["file_size"].values,
+        }
+    )
     df.to_csv("dataset_qf_qt.csv", index=False)
 
 
@@ -12,3 +12,5 @@ python save_dct.py -f JUNIWARD -p 1
 python save_dct.py -f UERD -p 1
 
 python save_dct.py -f Test
+
+python convert_dct_to_store.py
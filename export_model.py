@@ -0,0 +1,48 @@
+import warnings
+
+warnings.simplefilter("ignore", UserWarning)
+warnings.simplefilter("ignore", FutureWarning)
+
+import argparse
+import os
+
+from pytorch_toolbelt.utils import fs
+
+from alaska2 import *
+from alaska2.models import model_from_checkpoint
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("checkpoint", type=str, nargs="+")
+    parser.add_argument("-dd", "--data-dir", type=str, default=os.environ.get("KAGGLE_2020_ALASKA2"))
+    parser.add_argument("-f", "--format", type=str, default="torchscript", choices=["torchscript", "onnx"])
+    parser.add_argument("--no-fold", action="store_true", help="Do not fold input normalization into first conv")
+    parser.add_argument("--opset", type=int, default=11, help="ONNX opset version")
+    args = parser.parse_args()
+
+    for checkpoint_fname in args.checkpoint:
+        model, checkpoint = model_from_checkpoint(checkpoint_fname)
+
+        # Real sample defines shapes of all required features
+        holdout_ds = get_holdout(args.data_dir, features=model.required_features)
+        artifact_fname = fs.change_extension(
+            checkpoint_fname, "_torchscript.pt" if args.format == "torchscript" else ".onnx"
+        )
+
+        meta = export_model(
+            model,
+            holdout_ds[0],
+            artifact_fname,
+            export_format=args.format,
+            fold_normalization=not args.no_fold,
+            opset_version=args.opset,
+        )
+        print("Exported", checkpoint_fname, "to", artifact_fname)
+        print("  Inputs         :", meta["inputs"], meta["input_shapes"])
+        print("  Folded rgb_bn  :", meta["folded_normalization"])
+        print("  Max abs. diff  :", meta["max_abs_diff"])
+
+
+if __name__ == "__main__":
+    main()
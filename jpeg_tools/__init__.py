@@ -0,0 +1,5 @@
+# JPEG helpers shared by alaska2 and abba (abba imports them without alaska2 and its training dependencies),
+# so this package must depend only on numpy, scipy, pandas & tqdm (jpegio is imported lazily)
+from .block_dct import *
+from .decoder import *
+from .header import *
@@ -0,0 +1,154 @@
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional, Tuple, Union
+
+import numpy as np
+
+from .block_dct import block_idct2_fast
+
+__all__ = [
+    "NonRoundedDecoder",
+    "decode_non_rounded",
+    "read_dct_from_jpegio",
+    "read_dct_from_npz",
+]
+
+# Coefficients used by cv2.cvtColor(..., cv2.COLOR_YCrCb2BGR) for floating-point input
+CV2_YCRCB_COEFFS = (1.403, -0.714, -0.344, 1.773)
+
+# Coefficients of JFIF YCbCr -> RGB conversion (used by abba models)
+JFIF_YCBCR_COEFFS = (1.402, -0.71414, -0.34414, 1.772)
+
+# Channel order, color conversion coefficients and level shift of supported NR conventions:
+# - "bgr" matches alaska2.dataset.decode_bgr_from_dct (level shift of 127.5 and OpenCV conversion)
+# - "rgb" matches abba jpeg_utils.decompress_structure + ycbcr2rgb (level shift of 128 and JFIF conversion)
+DECODER_CONVENTIONS = {
+    "bgr": ("bgr", CV2_YCRCB_COEFFS, 127.5),
+    "rgb": ("rgb", JFIF_YCBCR_COEFFS, 128.0),
+}
+
+DctCoefficients = Tuple[np.ndarray, Optional[np.ndarray]]
+
+
+def read_dct_from_npz(dct_fname: str) -> DctCoefficients:
+    """
+    Read dequantized DCT coefficients from .npz file produced by save_dct.py
+
+    :return: Tuple of DCT coefficients [3, H, W] in (Y, Cb, Cr) order and None (Coefficients are already dequantized)
+    """
+    dct = np.load(dct_fname)
+    return np.stack([dct["dct_y"], dct["dct_cb"], dct["dct_cr"]]), None
+
+
+def read_dct_from_jpegio(jpeg: Union[str, "jpegio.DecompressedJpeg"]) -> DctCoefficients:
+    """
+    Read quantized DCT coefficients and quantization tables of JPEG image using jpegio.
+
+    :param jpeg: Image filename or already parsed jpegio structure
+    :return: Tuple of DCT coefficients [3, H, W] in (Y, Cb, Cr) order and quantization tables [3, 8, 8]
+    """
+    if isinstance(jpeg, str):
+        import jpegio as jio
+
+        jpeg = jio.read(jpeg)
+
+    num_planes = len(jpeg.coef_arrays)
+    if num_planes != 3:
+        raise ValueError(f"Expected 3 color planes, got {num_planes}")
+
+    coef_arrays = jpeg.coef_arrays
+    if coef_arrays[0].shape != coef_arrays[1].shape or coef_arrays[0].shape != coef_arrays[2].shape:
+        raise ValueError("Chroma subsampling is not supported")
+
+    quant_tables = [jpeg.quant_tables[jpeg.comp_info[i].quant_tbl_no] for i in range(num_planes)]
+    return np.stack(coef_arrays), np.stack(quant_tables)
+
+
+def decode_non_rounded(
+    dct: np.ndarray, qm: Optional[np.ndarray] = None, convention: str = "bgr", dtype=np.float32
+) -> np.ndarray:
+    """
+    Decode batch of JPEG images from DCT coefficients without rounding & clipping of pixel values.
+
+    :param dct: DCT coefficients of shape [B, 3, H, W] or [3, H, W] in (Y, Cb, Cr) order
+    :param qm: Optional quantization tables of shape [B, 3, 8, 8] or [3, 8, 8] if coefficients are not dequantized
+    :param convention: "bgr" (alaska2 NR input) or "rgb" (abba NR input). See DECODER_CONVENTIONS.
+    :param dtype: Floating-point type used for computation and output
+    :return: Images of shape [B, H, W, 3] (or [H, W, 3]) with values roughly in [0, 1] range
+    """
+    channels, (c_cr_r, c_cr_g, c_cb_g, c_cb_b), level_shift = DECODER_CONVENTIONS[convention]
+
+    ycbcr = block_idct2_fast(dct, qm, dtype=dtype)
+    y, cb, cr = ycbcr[..., 0, :, :], ycbcr[..., 1, :, :], ycbcr[..., 2, :, :]
+    y += dtype(level_shift)
+
+    r = y + dtype(c_cr_r) * cr
+    g = y + dtype(c_cr_g) * cr + dtype(c_cb_g) * cb
+    b = y + dtype(c_cb_b) * cb
+
+    image = np.stack([b, g, r] if channels == "bgr" else [r, g, b], axis=-1)
+    image *= dtype(1.0 / 255.0)
+    return image
+
+
+class NonRoundedDecoder:
+    """
+    Batched non-rounded JPEG decoder that accepts list of .jpg (read by jpegio) or .npz (saved DCT) files.
+    Files are read and decoded in chunks by a thread pool (File I/O, zip decompression and numpy matmul release GIL).
+    """
+
+    def __init__(self, convention: str = "bgr", num_threads: int = 0, dtype=np.float32):
+        if convention not in DECODER_CONVENTIONS:
+            raise KeyError(convention)
+        self.convention = convention
+        self.num_threads = num_threads
+        self.dtype = dtype
+        self._pool = None
+
+    def __getstate__(self):
+        # Thread pool cannot be pickled to DataLoader workers, each process creates own pool
+        state = self.__dict__.copy()
+        state["_pool"] = None
+        return state
+
+    def __repr__(self):
+        return f"NonRoundedDecoder(convention={self.convention}, num_threads={self.num_threads}, dtype={self.dtype})"
+
+    @staticmethod
+    def read(fname: str) -> DctCoefficients:
+        if fname.endswith(".npz"):
+            return read_dct_from_npz(fname)
+        return read_dct_from_jpegio(fname)
+
+    def decode(self, coefficients: List[DctCoefficients]) -> np.ndarray:
+        """
+        Decode list of (dct, qm) tuples of the same size in a single vectorized pass
+        :return: Array of shape [B, H, W, 3]
+        """
+        dct = np.stack([c[0] for c in coefficients])
+        if any(c[1] is not None for c in coefficients):
+            qm = np.stack([c[1] if c[1] is not None else np.ones((3, 8, 8), dtype=np.int32) for c in coefficients])
+        else:
+            qm = None
+        return decode_non_rounded(dct, qm, convention=self.convention, dtype=self.dtype)
+
+    def _read_and_decode(self, fnames: List[str]) -> np.ndarray:
+        return self.decode([self.read(x) for x in fnames])
+
+    def __call__(self, fnames: Union[str, List[str]]) -> np.ndarray:
+        """
+        Read & decode images
+        :param fnames: Single filename or list of filenames of images of the same size
+        :return: Array of shape [H, W, 3] for single filename or [B, H, W, 3] for list
+        """
+        if isinstance(fnames, str):
+            return self._read_and_decode([fnames])[0]
+
+        if self.num_threads <= 1 or len(fnames) <= 1:
+            return self._read_and_decode(fnames)
+
+        if self._pool is None:
+            self._pool = ThreadPoolExecutor(self.num_threads)
+
+        chunk_size = int(np.ceil(len(fnames) / self.num_threads))
+        chunks = [fnames[i : i + chunk_size] for i in range(0, len(fnames), chunk_size)]
+        return np.concatenate(list(self._pool.map(self._read_and_decode, chunks)))
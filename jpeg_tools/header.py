@@ -0,0 +1,197 @@
+import os
+import struct
+from collections import defaultdict
+from multiprocessing import Pool
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+from tqdm import tqdm
+
+__all__ = [
+    "build_qf_index",
+    "estimate_quality_factor",
+    "get_qf_index",
+    "qf_dicts_from_index",
+    "read_jpeg_qtables",
+]
+
+# Standard (Annex K) luminance quantization table of IJG libjpeg
+IJG_LUMINANCE_QTABLE = np.array(
+    [
+        [16, 11, 10, 16, 24, 40, 51, 61],
+        [12, 12, 14, 19, 26, 58, 60, 55],
+        [14, 13, 16, 24, 40, 57, 69, 56],
+        [14, 17, 22, 29, 51, 87, 80, 62],
+        [18, 22, 37, 56, 68, 109, 103, 77],
+        [24, 35, 55, 64, 81, 104, 113, 92],
+        [49, 64, 78, 87, 103, 121, 120, 101],
+        [72, 92, 95, 98, 112, 100, 103, 99],
+    ],
+    dtype=np.int32,
+)
+
+
+def _ijg_qtable(quality: int) -> np.ndarray:
+    scale = 5000 // quality if quality < 50 else 200 - quality * 2
+    return np.clip((IJG_LUMINANCE_QTABLE * scale + 50) // 100, 1, 255)
+
+
+def estimate_quality_factor(qm0: np.ndarray) -> int:
+    """
+    Find IJG quality factor which produces given luminance quantization table.
+    :return: Quality factor in [1..100] range or -1 if table is not one of standard IJG tables
+    """
+    qm0 = np.asarray(qm0).reshape(8, 8)
+    for quality in range(100, 0, -1):
+        if np.array_equal(_ijg_qtable(quality), qm0):
+            return quality
+    return -1
+
+
+# Position of each zigzag-ordered DQT entry in the natural (row-major) 8x8 table
+# fmt: off
+ZIGZAG_TO_NATURAL = np.array(
+    [
+        0, 1, 8, 16, 9, 2, 3, 10, 17, 24, 32, 25, 18, 11, 4, 5,
+        12, 19, 26, 33, 40, 48, 41, 34, 27, 20, 13, 6, 7, 14, 21, 28,
+        35, 42, 49, 56, 57, 50, 43, 36, 29, 22, 15, 23, 30, 37, 44, 51,
+        58, 59, 52, 45, 38, 31, 39, 46, 53, 60, 61, 54, 47, 55, 62, 63,
+    ]
+)
+# fmt: on
+
+MARKER_SOI = 0xD8
+MARKER_EOI = 0xD9
+MARKER_SOS = 0xDA
+MARKER_DQT = 0xDB
+
+# Markers without payload
+STANDALONE_MARKERS = {0x01, MARKER_SOI, MARKER_EOI} | set(range(0xD0, 0xD8))
+
+
+def _parse_dqt(payload: bytes, tables: Dict[int, np.ndarray]):
+    offset = 0
+    while offset < len(payload):
+        precision, table_id = payload[offset] >> 4, payload[offset] & 0x0F
+        offset += 1
+        if precision == 0:
+            values = np.frombuffer(payload, dtype=np.uint8, count=64, offset=offset)
+            offset += 64
+        else:
+            values = np.frombuffer(payload, dtype=">u2", count=64, offset=offset)
+            offset += 128
+
+        table = np.zeros(64, dtype=np.int32)
+        table[ZIGZAG_TO_NATURAL] = values
+        tables[table_id] = table.reshape(8, 8)
+
+
+def read_jpeg_qtables(image_fname: str) -> np.ndarray:
+    """
+    Read quantization tables of JPEG file by parsing DQT segments of the header (Image data is not read).
+    :return: Quantization tables [N, 8, 8] in natural order, sorted by table id (Same as jpegio quant_tables)
+    """
+    tables = {}
+    with open(image_fname, "rb") as f:
+        if f.read(2) != b"\xff\xd8":
+            raise ValueError(f"{image_fname} is not a JPEG file")
+
+        while True:
+            byte = f.read(1)
+            if not byte:
+                break
+            if byte != b"\xff":
+                continue
+
+            marker = f.read(1)
+            while marker == b"\xff":  # Fill bytes
+                marker = f.read(1)
+            if not marker:
+                break
+
+            marker = marker[0]
+            if marker in STANDALONE_MARKERS:
+                continue
+            if marker == MARKER_SOS:
+                break
+
+            (length,) = struct.unpack(">H", f.read(2))
+            if marker == MARKER_DQT:
+                _parse_dqt(f.read(length - 2), tables)
+            else:
+                f.seek(length - 2, os.SEEK_CUR)
+
+    if not tables:
+        raise ValueError(f"{image_fname} has no quantization tables")
+    return np.stack([tables[table_id] for table_id in sorted(tables.keys())])
+
+
+def _read_header_record(image_fname: str) -> Tuple[str, List, List, int]:
+    qtables = read_jpeg_qtables(image_fname)
+    qm0 = qtables[0]
+    qm1 = qtables[1] if len(qtables) > 1 else qtables[0]
+    return image_fname, qm0.flatten().tolist(), qm1.flatten().tolist(), os.stat(image_fname).st_size
+
+
+def build_qf_index(image_fnames: List[str], workers: int = 8) -> pd.DataFrame:
+    """
+    Read quality factors & quantization tables of JPEG files in parallel.
+    :return: Dataframe with columns image_fname, quality, qm0, qm1 (Flattened tables) and file_size
+    """
+    df = defaultdict(list)
+    if not len(image_fnames):
+        return pd.DataFrame(columns=["image_fname", "quality", "qm0", "qm1", "file_size"])
+
+    with Pool(workers) as wp:
+        for image_fname, qm0, qm1, file_size in tqdm(
+            wp.imap(_read_header_record, image_fnames, chunksize=256), total=len(image_fnames)
+        ):
+            df["image_fname"].append(image_fname)
+            df["quality"].append(estimate_quality_factor(np.array(qm0)))
+            df["qm0"].append(qm0)
+            df["qm1"].append(qm1)
+            df["file_size"].append(file_size)
+
+    return pd.DataFrame.from_dict(df)
+
+
+def get_qf_index(image_fnames: List[str], index_fname: str, workers: int = 8) -> pd.DataFrame:
+    """
+    Quality factor index of given files, cached in index_fname (.pkl).
+    Only files that are missing in the cached index (or have different size) are read.
+    :return: Dataframe with columns image_fname, quality, qm0, qm1 and file_size in order of image_fnames
+    """
+    cached: Optional[pd.DataFrame] = pd.read_pickle(index_fname) if os.path.isfile(index_fname) else None
+
+    missing = list(image_fnames)
+    if cached is not None:
+        file_size = dict(zip(cached["image_fname"], cached["file_size"]))
+        missing = [x for x in image_fnames if file_size.get(x, -1) != os.stat(x).st_size]
+
+    if len(missing) or cached is None:
+        update = build_qf_index(missing, workers=workers)
+        if cached is not None:
+            cached = cached[~cached["image_fname"].isin(set(missing))]
+            update = pd.concat([cached, update], ignore_index=True)
+        update.to_pickle(index_fname)
+        cached = update
+
+    return cached.set_index("image_fname", drop=False).loc[list(image_fnames)].reset_index(drop=True)
+
+
+def qf_dicts_from_index(index: pd.DataFrame) -> Tuple[Dict[str, int], Dict[int, List[str]]]:
+    """
+    :return: Mapping of image name to quality factor and mapping of quality factor to sorted list of names
+        (Same as jpeg_utils.get_qf_dicts)
+    """
+    names_qf = dict(
+        (os.path.basename(image_fname), int(quality))
+        for image_fname, quality in zip(index["image_fname"], index["quality"])
+    )
+
+    qf_names = defaultdict(list)
+    for key, value in sorted(names_qf.items()):
+        qf_names[value].append(key)
+
+    return names_qf, qf_names
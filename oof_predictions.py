@@ -13,13 +13,13 @@ from torch import nn
 from torch.utils.data import DataLoader, Dataset
 from tqdm import tqdm
 
-from collections import defaultdict
 from catalyst.utils import any2device
 from pytorch_toolbelt.utils import to_numpy, fs
 from pytorch_toolbelt.utils.catalyst import report_checkpoint
 
 from alaska2 import *
-from alaska2.submissions import sigmoid, parse_classifier_probas
+from alaska2.prediction_store import PredictionWriter, predictions_store_path, read_predictions
+from alaska2.submissions import batch_sigmoid, batch_parse_classifier_probas
 
 
 def update_bn(model: nn.Module, dataset: Dataset, batch_size=1, workers=0):
@@ -37,68 +37,100 @@ def update_bn(model: nn.Module, dataset: Dataset, batch_size=1, workers=0):
 
 
 @torch.no_grad()
-def compute_oof_predictions(model, dataset: Dataset, batch_size=1, workers=0) -> pd.DataFrame:
+def compute_oof_predictions(
+    model, dataset: Dataset, writer: PredictionWriter, batch_size=1, workers=0, compact_loader=False
+):
+    """
+    Run model on dataset and stream predictions (labels, logits, embeddings and TTA logits) to the writer
+    :param compact_loader: Transfer batches in compact form and prefetch them to GPU (See DeviceLoader)
+    """
     if torch.cuda.device_count() > 1:
         model = nn.DataParallel(model)
     model = model.eval()
 
-    df = defaultdict(list)
     for batch in tqdm(
-        DataLoader(
-            dataset, batch_size=batch_size, num_workers=workers, shuffle=False, drop_last=False, pin_memory=True
+        get_data_loader(
+            dataset,
+            compact=compact_loader,
+            batch_size=batch_size,
+            num_workers=workers,
+            shuffle=False,
+            drop_last=False,
+            pin_memory=True,
         )
     ):
         batch = any2device(batch, device="cuda")
+        columns = {INPUT_IMAGE_ID_KEY: batch[INPUT_IMAGE_ID_KEY]}
 
         if INPUT_TRUE_MODIFICATION_FLAG in batch:
-            y_trues = to_numpy(batch[INPUT_TRUE_MODIFICATION_FLAG]).flatten()
-            df[INPUT_TRUE_MODIFICATION_FLAG].extend(y_trues)
+            columns[INPUT_TRUE_MODIFICATION_FLAG] = to_numpy(batch[INPUT_TRUE_MODIFICATION_FLAG]).flatten()
 
         if INPUT_TRUE_MODIFICATION_TYPE in batch:
-            y_labels = to_numpy(batch[INPUT_TRUE_MODIFICATION_TYPE]).flatten()
-            df[INPUT_TRUE_MODIFICATION_TYPE].extend(y_labels)
-
-        image_ids = batch[INPUT_IMAGE_ID_KEY]
-        df[INPUT_IMAGE_ID_KEY].extend(image_ids)
+            columns[INPUT_TRUE_MODIFICATION_TYPE] = to_numpy(batch[INPUT_TRUE_MODIFICATION_TYPE]).flatten()
 
         outputs = model(**batch)
 
         if OUTPUT_PRED_MODIFICATION_FLAG in outputs:
-            df[OUTPUT_PRED_MODIFICATION_FLAG].extend(to_numpy(outputs[OUTPUT_PRED_MODIFICATION_FLAG]).flatten())
+            columns[OUTPUT_PRED_MODIFICATION_FLAG] = to_numpy(outputs[OUTPUT_PRED_MODIFICATION_FLAG]).flatten()
 
-        if OUTPUT_PRED_MODIFICATION_TYPE in outputs:
-            df[OUTPUT_PRED_MODIFICATION_TYPE].extend(to_numpy(outputs[OUTPUT_PRED_MODIFICATION_TYPE]).tolist())
+        # Save also TTA predictions for future use
+        for key in [
+            OUTPUT_PRED_MODIFICATION_TYPE,
+            OUTPUT_PRED_EMBEDDING,
+            OUTPUT_PRED_EMBEDDING_ARC_MARGIN,
+            OUTPUT_PRED_MODIFICATION_FLAG + "_tta",
+            OUTPUT_PRED_MODIFICATION_TYPE + "_tta",
+        ]:
+            if key in outputs:
+                columns[key] = to_numpy(outputs[key])
 
-        if OUTPUT_PRED_EMBEDDING in outputs:
-            df[OUTPUT_PRED_EMBEDDING].extend(to_numpy(outputs[OUTPUT_PRED_EMBEDDING]).tolist())
+        writer.write(columns)
 
-        if OUTPUT_PRED_EMBEDDING_ARC_MARGIN in outputs:
-            df[OUTPUT_PRED_EMBEDDING_ARC_MARGIN].extend(to_numpy(outputs[OUTPUT_PRED_EMBEDDING_ARC_MARGIN]).tolist())
+    writer.close()
 
-        # Save also TTA predictions for future use
-        if OUTPUT_PRED_MODIFICATION_FLAG + "_tta" in outputs:
-            df[OUTPUT_PRED_MODIFICATION_FLAG + "_tta"].extend(
-                to_numpy(outputs[OUTPUT_PRED_MODIFICATION_FLAG + "_tta"]).tolist()
-            )
 
-        if OUTPUT_PRED_MODIFICATION_TYPE + "_tta" in outputs:
-            df[OUTPUT_PRED_MODIFICATION_TYPE + "_tta"].extend(
-                to_numpy(outputs[OUTPUT_PRED_MODIFICATION_TYPE + "_tta"]).tolist()
-            )
+def predict_to_store(
+    model, dataset: Dataset, predictions_csv: str, save_csv: bool, batch_size=1, workers=0, compact_loader=False
+):
+    """
+    Compute predictions into the predictions store next to predictions_csv and optionally export legacy .csv
+    """
+    writer = PredictionWriter(predictions_store_path(predictions_csv))
+    compute_oof_predictions(
+        model, dataset, writer, batch_size=batch_size, workers=workers, compact_loader=compact_loader
+    )
+    if save_csv:
+        export_predictions_csv(predictions_csv)
 
-    df = pd.DataFrame.from_dict(df)
-    return df
+
+def export_predictions_csv(predictions_csv: str):
+    """
+    Export predictions store next to predictions_csv to legacy .csv (Still read by make_submissions_*.py & co)
+    """
+    df = read_predictions(predictions_store_path(predictions_csv))
+    for key in df.columns:
+        if df[key].dtype == object and len(df) and isinstance(df[key].iloc[0], np.ndarray):
+            df[key] = df[key].apply(lambda x: x.tolist())
+    df.to_csv(predictions_csv, index=False)
+
+
+def has_predictions(predictions_csv: str) -> bool:
+    """
+    :return: True if predictions were already computed, either into the predictions store or legacy .csv
+    """
+    has_store = os.path.isfile(os.path.join(predictions_store_path(predictions_csv), "meta.json"))
+    return has_store or os.path.isfile(predictions_csv)
 
 
 def score_predictions(predictions_fname):
-    holdout_predictions = pd.read_csv(predictions_fname)
+    holdout_predictions = read_predictions(predictions_fname)
 
     print(predictions_fname)
     print(
         "\tbAUC",
         alaska_weighted_auc(
             holdout_predictions[INPUT_TRUE_MODIFICATION_FLAG].values,
-            holdout_predictions[OUTPUT_PRED_MODIFICATION_FLAG].apply(sigmoid).values,
+            batch_sigmoid(holdout_predictions[OUTPUT_PRED_MODIFICATION_FLAG]),
         ),
     )
 
@@ -106,7 +138,7 @@ def score_predictions(predictions_fname):
         "\tcAUC",
         alaska_weighted_auc(
             holdout_predictions[INPUT_TRUE_MODIFICATION_FLAG].values,
-            holdout_predictions[OUTPUT_PRED_MODIFICATION_TYPE].apply(parse_classifier_probas).values,
+            batch_parse_classifier_probas(holdout_predictions[OUTPUT_PRED_MODIFICATION_TYPE]),
         ),
     )
 
@@ -130,6 +162,17 @@ def main():
     parser.add_argument("-oof", "--need-oof", action="store_true")
     parser.add_argument("-emb", "--need-embedding", action="store_true")
     parser.add_argument("-adabn", "--adabn", action="store_true")
+    parser.add_argument("--cache", action="store_true", help="Use persistent cache of ELA/blur/residual features")
+    parser.add_argument(
+        "--no-csv",
+        action="store_true",
+        help="Do not export legacy .csv predictions in addition to the predictions store",
+    )
+    parser.add_argument(
+        "--compact-loader",
+        action="store_true",
+        help="Transfer integer features as uint8/int16 and prefetch batches to GPU on a side stream",
+    )
 
     args = parser.parse_args()
 
@@ -141,8 +184,11 @@ def main():
     d4_tta = args.d4_tta
     hv_tta = args.hv_tta
     force_recompute = args.force_recompute
+    save_csv = not args.no_csv
     need_embedding = args.need_embedding
     adabn = args.adabn
+    compact_loader = args.compact_loader
+    feature_cache = FeatureCache(os.path.join(data_dir, "feature_cache")) if args.cache else None
 
     outputs = [OUTPUT_PRED_MODIFICATION_FLAG, OUTPUT_PRED_MODIFICATION_TYPE]
     suffix = (
@@ -166,34 +212,61 @@ def main():
 
         if args.need_oof:
             fold = checkpoints[0]["checkpoint_data"]["cmd_args"]["fold"]
-            _, valid_ds, _ = get_datasets(data_dir, fold=fold, features=required_features)
+            _, valid_ds, _ = get_datasets(data_dir, fold=fold, features=required_features, feature_cache=feature_cache)
 
             oof_predictions_csv = fs.change_extension(checkpoint_fname, f"_oof_predictions{suffix}.csv")
-            if force_recompute or not os.path.exists(oof_predictions_csv):
-                oof_predictions = compute_oof_predictions(model, valid_ds, batch_size=batch_size, workers=workers)
-                oof_predictions.to_csv(oof_predictions_csv, index=False)
+            if force_recompute or not has_predictions(oof_predictions_csv):
+                predict_to_store(
+                    model,
+                    valid_ds,
+                    oof_predictions_csv,
+                    save_csv,
+                    batch_size=batch_size,
+                    workers=workers,
+                    compact_loader=compact_loader,
+                )
+            elif save_csv and not os.path.isfile(oof_predictions_csv):
+                export_predictions_csv(oof_predictions_csv)
             print(f"OOF score ({suffix})")
             score_predictions(oof_predictions_csv)
 
         # Holdout
-        holdout_ds = get_holdout(data_dir, features=required_features)
+        holdout_ds = get_holdout(data_dir, features=required_features, feature_cache=feature_cache)
         holdout_predictions_csv = fs.change_extension(checkpoint_fname, f"_holdout_predictions{suffix}.csv")
-        if force_recompute or not os.path.exists(holdout_predictions_csv):
+        if force_recompute or not has_predictions(holdout_predictions_csv):
             if adabn:
                 update_bn(model, holdout_ds, batch_size=batch_size // torch.cuda.device_count(), workers=workers)
-            holdout_predictions = compute_oof_predictions(model, holdout_ds, batch_size=batch_size, workers=workers)
-            holdout_predictions.to_csv(holdout_predictions_csv, index=False)
+            predict_to_store(
+                model,
+                holdout_ds,
+                holdout_predictions_csv,
+                save_csv,
+                batch_size=batch_size,
+                workers=workers,
+                compact_loader=compact_loader,
+            )
+        elif save_csv and not os.path.isfile(holdout_predictions_csv):
+            export_predictions_csv(holdout_predictions_csv)
         print(f"Holdout score ({suffix})")
         score_predictions(holdout_predictions_csv)
 
         # Test
-        test_ds = get_test_dataset(data_dir, features=required_features)
+        test_ds = get_test_dataset(data_dir, features=required_features, feature_cache=feature_cache)
         test_predictions_csv = fs.change_extension(checkpoint_fname, f"_test_predictions{suffix}.csv")
-        if force_recompute or not os.path.exists(test_predictions_csv):
+        if force_recompute or not has_predictions(test_predictions_csv):
             if adabn:
                 update_bn(model, test_ds, batch_size=batch_size // torch.cuda.device_count(), workers=workers)
-            test_predictions = compute_oof_predictions(model, test_ds, batch_size=batch_size, workers=workers)
-            test_predictions.to_csv(test_predictions_csv, index=False)
+            predict_to_store(
+                model,
+                test_ds,
+                test_predictions_csv,
+                save_csv,
+                batch_size=batch_size,
+                workers=workers,
+                compact_loader=compact_loader,
+            )
+        elif save_csv and not os.path.isfile(test_predictions_csv):
+            export_predictions_csv(test_predictions_csv)
 
 
 if __name__ == "__main__":
@@ -1,6 +1,6 @@
 import warnings
 
-from alaska2.submissions import parse_classifier_probas, sigmoid
+from alaska2.submissions import batch_parse_classifier_probas, batch_sigmoid
 
 warnings.simplefilter("ignore", UserWarning)
 warnings.simplefilter("ignore", FutureWarning)
@@ -138,7 +138,7 @@ def main():
                     "\tbAUC",
                     alaska_weighted_auc(
                         holdout_predictions[INPUT_TRUE_MODIFICATION_FLAG].values,
-                        holdout_predictions[OUTPUT_PRED_MODIFICATION_FLAG].apply(sigmoid).values,
+                        batch_sigmoid(holdout_predictions[OUTPUT_PRED_MODIFICATION_FLAG]),
                     ),
                 )
 
@@ -146,7 +146,7 @@ def main():
                     "\tcAUC",
                     alaska_weighted_auc(
                         holdout_predictions[INPUT_TRUE_MODIFICATION_FLAG].values,
-                        holdout_predictions[OUTPUT_PRED_MODIFICATION_TYPE].apply(parse_classifier_probas).values,
+                        batch_parse_classifier_probas(holdout_predictions[OUTPUT_PRED_MODIFICATION_TYPE]),
                     ),
                 )
 
@@ -0,0 +1,48 @@
+import warnings
+
+warnings.simplefilter("ignore", UserWarning)
+warnings.simplefilter("ignore", FutureWarning)
+
+import argparse
+import os
+
+import numpy as np
+from pytorch_toolbelt.utils import fs
+
+from alaska2 import *
+from alaska2.submissions import batch_sigmoid
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("artifact", type=str, nargs="+", help="Models exported with export_model.py")
+    parser.add_argument("-dd", "--data-dir", type=str, default=os.environ.get("KAGGLE_2020_ALASKA2"))
+    parser.add_argument("-b", "--batch-size", type=int, default=1)
+    parser.add_argument("-w", "--workers", type=int, default=0)
+    parser.add_argument("-t", "--threads", type=int, default=None, help="Number of intra-op CPU threads")
+    parser.add_argument("--holdout", action="store_true", help="Predict holdout instead of test set")
+    args = parser.parse_args()
+
+    for artifact_fname in args.artifact:
+        runner = CpuRunner(artifact_fname, num_threads=args.threads)
+        print(runner)
+
+        if args.holdout:
+            dataset = get_holdout(args.data_dir, features=runner.inputs)
+            predictions_csv = fs.change_extension(artifact_fname, "_holdout_predictions_cpu.csv")
+        else:
+            dataset = get_test_dataset(args.data_dir, features=runner.inputs)
+            predictions_csv = fs.change_extension(artifact_fname, "_test_predictions_cpu.csv")
+
+        predictions = runner.predict(dataset, batch_size=args.batch_size, workers=args.workers)
+        predictions.to_csv(predictions_csv, index=False)
+        print("Saved predictions to", predictions_csv)
+
+        if args.holdout:
+            y_true = np.array(dataset.targets) > 0
+            y_pred = batch_sigmoid(predictions[OUTPUT_PRED_MODIFICATION_FLAG])
+            print("Holdout wAUC     :", alaska_weighted_auc(y_true, y_pred))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,52 @@
+import argparse
+import os
+from functools import partial
+from multiprocessing import Pool
+
+import cv2
+from pytorch_toolbelt.utils import fs
+from tqdm import tqdm
+
+from alaska2.dataset import CACHEABLE_FEATURES, compute_features
+from alaska2.feature_cache import FeatureCache
+
+
+def prefill_image(image_fname, features, feature_cache: FeatureCache):
+    image = cv2.imread(image_fname)
+    compute_features(image, image_fname, features, feature_cache)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Precompute ELA / blur / residual features into the feature cache")
+    parser.add_argument("-dd", "--data-dir", type=str, default=os.environ.get("KAGGLE_2020_ALASKA2"))
+    parser.add_argument("-cd", "--cache-dir", type=str, default=None, help="Default is <data-dir>/feature_cache")
+    parser.add_argument("--cache-size", type=float, default=None, help="Max size of feature cache (Gb)")
+    parser.add_argument(
+        "-f", "--features", type=str, nargs="+", default=list(CACHEABLE_FEATURES.keys()), choices=CACHEABLE_FEATURES
+    )
+    parser.add_argument(
+        "--folders", type=str, nargs="+", default=["Cover", "JMiPOD", "JUNIWARD", "UERD", "Test"], help="Image folders"
+    )
+    parser.add_argument("-w", "--workers", type=int, default=16)
+
+    args = parser.parse_args()
+    data_dir = args.data_dir
+    feature_cache = FeatureCache(
+        args.cache_dir or os.path.join(data_dir, "feature_cache"), max_size_gb=args.cache_size
+    )
+
+    images = []
+    for folder in args.folders:
+        images += fs.find_images_in_dir(os.path.join(data_dir, folder))
+
+    process_fn = partial(prefill_image, features=args.features, feature_cache=feature_cache)
+    with Pool(args.workers) as wp:
+        for _ in tqdm(wp.imap_unordered(process_fn, images, chunksize=16), total=len(images)):
+            pass
+
+    # Workers only check size of the cache periodically
+    feature_cache.evict()
+
+
+if __name__ == "__main__":
+    main()
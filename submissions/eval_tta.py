@@ -5,7 +5,7 @@ import pandas as pd
 from pytorch_toolbelt.utils import fs
 
 from alaska2 import alaska_weighted_auc
-from alaska2.submissions import as_hv_tta, as_d4_tta, parse_classifier_probas, sigmoid, infer_fold
+from alaska2.submissions import as_hv_tta, as_d4_tta, batch_parse_classifier_probas, batch_sigmoid, infer_fold
 
 
 def get_predictions_csv(experiment, metric: str, type: str, tta: str = None, need_embedding=False):
@@ -91,11 +91,11 @@ def main():
             try:
                 df = pd.read_csv(oof_p)
                 summary_df["bauc"].append(
-                    alaska_weighted_auc(df["true_modification_flag"], df["pred_modification_flag"].apply(sigmoid))
+                    alaska_weighted_auc(df["true_modification_flag"], batch_sigmoid(df["pred_modification_flag"]))
                 )
                 summary_df["cauc"].append(
                     alaska_weighted_auc(
-                        df["true_modification_flag"], df["pred_modification_type"].apply(parse_classifier_probas)
+                        df["true_modification_flag"], batch_parse_classifier_probas(df["pred_modification_type"])
                     )
                 )
 
@@ -107,11 +107,11 @@ def main():
             try:
                 df = pd.read_csv(oof_p_hv_tta)
                 summary_df["bauc (HV tta)"].append(
-                    alaska_weighted_auc(df["true_modification_flag"], df["pred_modification_flag"].apply(sigmoid))
+                    alaska_weighted_auc(df["true_modification_flag"], batch_sigmoid(df["pred_modification_flag"]))
                 )
                 summary_df["cauc (HV tta)"].append(
                     alaska_weighted_auc(
-                        df["true_modification_flag"], df["pred_modification_type"].apply(parse_classifier_probas)
+                        df["true_modification_flag"], batch_parse_classifier_probas(df["pred_modification_type"])
                     )
                 )
 
@@ -123,11 +123,11 @@ def main():
             try:
                 df = pd.read_csv(oof_p_d4_tta)
                 summary_df["bauc (D4 tta)"].append(
-                    alaska_weighted_auc(df["true_modification_flag"], df["pred_modification_flag"].apply(sigmoid))
+                    alaska_weighted_auc(df["true_modification_flag"], batch_sigmoid(df["pred_modification_flag"]))
                 )
                 summary_df["cauc (D4 tta)"].append(
                     alaska_weighted_auc(
-                        df["true_modification_flag"], df["pred_modification_type"].apply(parse_classifier_probas)
+                        df["true_modification_flag"], batch_parse_classifier_probas(df["pred_modification_type"])
                     )
                 )
 
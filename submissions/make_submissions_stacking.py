@@ -30,7 +30,7 @@ from sklearn.svm import SVC
 
 from alaska2 import get_holdout, INPUT_IMAGE_KEY, get_test_dataset
 from alaska2.metric import alaska_weighted_auc
-from alaska2.submissions import parse_classifier_probas, sigmoid, parse_array
+from alaska2.submissions import batch_parse_classifier_probas, batch_sigmoid, parse_array
 from submissions.eval_tta import get_predictions_csv
 from submissions.make_submissions_averaging import compute_checksum_v2
 
@@ -50,8 +50,8 @@ def get_x_y(predictions):
         pred_modification_type = np.array(p["pred_modification_type"].apply(parse_array).tolist())
         X.append(pred_modification_type)
 
-        X.append(np.expand_dims(p["pred_modification_flag"].apply(sigmoid).values, -1))
-        X.append(np.expand_dims(p["pred_modification_type"].apply(parse_classifier_probas).values, -1))
+        X.append(np.expand_dims(batch_sigmoid(p["pred_modification_flag"]), -1))
+        X.append(np.expand_dims(batch_parse_classifier_probas(p["pred_modification_type"]), -1))
 
         if "pred_modification_type_tta" in p:
             X.append(p["pred_modification_type_tta"].apply(parse_array).tolist())
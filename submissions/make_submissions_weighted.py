@@ -14,7 +14,7 @@ from scipy.optimize import Bounds
 from scipy.special import softmax
 
 from alaska2.metric import alaska_weighted_auc
-from alaska2.submissions import parse_classifier_probas, sigmoid
+from alaska2.submissions import batch_parse_classifier_probas, batch_sigmoid
 from submissions.eval_tta import get_predictions_csv
 from submissions.make_submissions_averaging import compute_checksum
 
@@ -30,8 +30,8 @@ def get_x_y(predictions):
         if "true_modification_flag" in p:
             y = p["true_modification_flag"].values.astype(np.float32)
 
-        X.append(np.expand_dims(p["pred_modification_flag"].apply(sigmoid).values, -1))
-        X.append(np.expand_dims(p["pred_modification_type"].apply(parse_classifier_probas).values, -1))
+        X.append(np.expand_dims(batch_sigmoid(p["pred_modification_flag"]), -1))
+        X.append(np.expand_dims(batch_parse_classifier_probas(p["pred_modification_type"]), -1))
 
     X = np.column_stack(X).astype(np.float32)
     return X, y
@@ -0,0 +1,32 @@
+import numpy as np
+import pytest
+
+from alaska2.augmentations import d4_transform_planes, dct_rot90_fast, dct_transpose_fast
+
+
+@pytest.mark.parametrize("factor", [0, 1, 2, 3])
+@pytest.mark.parametrize("transpose", [False, True])
+def test_d4_transform_planes_matches_per_key_transforms(factor, transpose):
+    planes = {
+        "image": np.random.randint(0, 256, size=(32, 48, 3)).astype(np.uint8),
+        "input_ela": np.random.randn(32, 48, 3).astype(np.float32),
+        "input_blur": np.random.randn(32, 48).astype(np.float32),
+        "input_dct": np.random.randn(32, 48, 3).astype(np.float32),
+        "input_dct_y": np.random.randn(32, 48, 1).astype(np.float32),
+    }
+    dct_keys = ["input_dct", "input_dct_y"]
+
+    result = d4_transform_planes(planes, dct_keys, factor, transpose)
+
+    for key, value in planes.items():
+        if key in dct_keys:
+            expected = dct_rot90_fast(value, factor)
+            if transpose:
+                expected = dct_transpose_fast(expected)
+        else:
+            expected = np.rot90(value, factor)
+            if transpose:
+                expected = np.swapaxes(expected, 0, 1)
+
+        assert result[key].dtype == value.dtype
+        np.testing.assert_array_equal(result[key], expected)
@@ -0,0 +1,107 @@
+import collections
+
+import torch
+from torch import nn
+from torch.utils.data import DataLoader
+
+from alaska2.batch_augmentations import BatchAugmentation, BatchAugmentationCallback, get_batch_augmentations
+from alaska2.dataset import (
+    INPUT_FEATURES_DCT_KEY,
+    INPUT_IMAGE_KEY,
+    INPUT_TRUE_MODIFICATION_FLAG,
+    INPUT_TRUE_MODIFICATION_MASK,
+    OUTPUT_PRED_MODIFICATION_FLAG,
+)
+from alaska2.predict import D4TTA
+
+
+def test_apply_d4_matches_tta_views():
+    x = torch.randn((8, 3, 16, 16))
+    views = torch.arange(8)
+
+    for dct, view_fns in [(False, D4TTA.views), (True, D4TTA.dct_views)]:
+        augmented = BatchAugmentation.apply_d4(x, views, dct=dct)
+        for i in range(8):
+            torch.testing.assert_allclose(augmented[i : i + 1], view_fns[i](x[i : i + 1]))
+
+
+def test_apply_d4_without_channels():
+    mask = torch.randn((4, 16, 16))
+    views = torch.tensor([0, 1, 5, 7])
+    augmented = BatchAugmentation.apply_d4(mask, views, dct=False)
+    expected = BatchAugmentation.apply_d4(mask.unsqueeze(1), views, dct=False).squeeze(1)
+    torch.testing.assert_allclose(augmented, expected)
+
+
+def test_dropout_skips_dct_and_mask():
+    batch = {
+        INPUT_IMAGE_KEY: torch.ones((16, 3, 64, 64)),
+        INPUT_FEATURES_DCT_KEY: torch.ones((16, 3, 64, 64)),
+        INPUT_TRUE_MODIFICATION_MASK: torch.ones((16, 1, 64, 64)),
+    }
+    augmentation = BatchAugmentation(list(batch.keys()), d4=False, dropout_p=1.0, dropout_max_size=32)
+    augmented = augmentation(batch)
+
+    assert (augmented[INPUT_IMAGE_KEY] == 0).view(16, -1).any(dim=1).all()
+    assert (augmented[INPUT_FEATURES_DCT_KEY] == 1).all()
+    assert (augmented[INPUT_TRUE_MODIFICATION_MASK] == 1).all()
+    assert (batch[INPUT_IMAGE_KEY] == 1).all()
+
+
+def test_get_batch_augmentations():
+    assert get_batch_augmentations("none", [INPUT_IMAGE_KEY]) is None
+    assert get_batch_augmentations("light", [INPUT_IMAGE_KEY]).dropout_p == 0
+    assert get_batch_augmentations("medium", [INPUT_IMAGE_KEY]).dropout_p > 0
+
+
+class _RecordInputs(nn.Module):
+    def __init__(self):
+        super().__init__()
+        self.conv = nn.Conv2d(3, 1, kernel_size=1)
+        self.inputs = []
+
+    def forward(self, **kwargs):
+        image = kwargs[INPUT_IMAGE_KEY]
+        self.inputs.append((image.clone(), kwargs[INPUT_TRUE_MODIFICATION_MASK].clone()))
+        return {OUTPUT_PRED_MODIFICATION_FLAG: self.conv(image).mean(dim=(2, 3))}
+
+
+def test_callback_augments_model_input(tmp_path):
+    from catalyst.dl import CriterionCallback, SupervisedRunner
+
+    image = torch.arange(8 * 3 * 16 * 16, dtype=torch.float32).view(8, 3, 16, 16)
+    samples = [
+        {
+            INPUT_IMAGE_KEY: x,
+            INPUT_TRUE_MODIFICATION_MASK: x[0:1].clone(),
+            INPUT_TRUE_MODIFICATION_FLAG: torch.zeros(1),
+        }
+        for x in image
+    ]
+    loaders = collections.OrderedDict(train=DataLoader(samples, batch_size=8), valid=DataLoader(samples, batch_size=8))
+
+    model = _RecordInputs()
+    runner = SupervisedRunner(input_key=[INPUT_IMAGE_KEY, INPUT_TRUE_MODIFICATION_MASK], output_key=None)
+    runner.train(
+        model=model,
+        criterion=nn.MSELoss(),
+        optimizer=torch.optim.SGD(model.parameters(), lr=0),
+        loaders=loaders,
+        callbacks=[
+            CriterionCallback(input_key=INPUT_TRUE_MODIFICATION_FLAG, output_key=OUTPUT_PRED_MODIFICATION_FLAG),
+            BatchAugmentationCallback(BatchAugmentation([INPUT_IMAGE_KEY], d4=True)),
+        ],
+        logdir=str(tmp_path),
+        num_epochs=1,
+        main_metric="loss",
+        verbose=False,
+    )
+
+    (train_image, train_mask), (valid_image, valid_mask) = model.inputs
+    assert not torch.equal(train_image, image)
+    torch.testing.assert_allclose(train_mask, train_image[:, 0:1])
+    for i in range(8):
+        assert any(torch.equal(train_image[i : i + 1], view(image[i : i + 1])) for view in D4TTA.views)
+
+    assert torch.equal(valid_image, image)
+    assert torch.equal(valid_mask, image[:, 0:1])
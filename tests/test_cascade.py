@@ -0,0 +1,57 @@
+import numpy as np
+import torch
+from torch import nn
+
+from alaska2.cascade import OUTPUT_CASCADE_DEPTH, CascadeEnsembler, calibrate_cascade_bands, simulate_cascade
+from alaska2.dataset import OUTPUT_PRED_MODIFICATION_FLAG
+
+
+class LookupModel(nn.Module):
+    def __init__(self, probas):
+        super().__init__()
+        self.register_buffer("probas", torch.tensor(probas, dtype=torch.float32))
+        self.calls = 0
+
+    def forward(self, index, **kwargs):
+        self.calls += len(index)
+        return {OUTPUT_PRED_MODIFICATION_FLAG: self.probas[index].view(-1, 1)}
+
+
+def _make_predictions(num_models=3, n=400, seed=0):
+    rs = np.random.RandomState(seed)
+    y_true = rs.randint(0, 2, n)
+    probas = [np.clip(y_true * 0.3 + 0.35 + rs.randn(n) * 0.2, 0, 1) for _ in range(num_models)]
+    return probas, y_true
+
+
+def test_cascade_ensembler_matches_simulation():
+    probas, _ = _make_predictions()
+    bands = [(0.3, 0.7), (0.4, 0.6)]
+    models = [LookupModel(p) for p in probas]
+    cascade = CascadeEnsembler(models, bands, inputs=["index"], outputs=[OUTPUT_PRED_MODIFICATION_FLAG])
+
+    output = cascade(index=torch.arange(len(probas[0])))
+    expected, depth = simulate_cascade(probas, bands)
+
+    np.testing.assert_allclose(output[OUTPUT_PRED_MODIFICATION_FLAG].numpy().flatten(), expected, atol=1e-6)
+    np.testing.assert_array_equal(output[OUTPUT_CASCADE_DEPTH].numpy(), depth)
+    assert [m.calls for m in models] == [np.sum(depth > i) for i in range(3)]
+    assert models[-1].calls < len(probas[0])
+
+
+def test_cascade_without_bands_is_full_ensemble():
+    probas, _ = _make_predictions()
+    predictions, depth = simulate_cascade(probas, [None, None])
+    np.testing.assert_allclose(predictions, np.mean(probas, axis=0))
+    assert np.all(depth == 3)
+
+
+def test_calibration_respects_wauc_drop():
+    from alaska2.metric import alaska_weighted_auc
+
+    probas, y_true = _make_predictions(n=2000)
+    bands = calibrate_cascade_bands(probas, y_true, max_wauc_drop=0.005)
+    predictions, depth = simulate_cascade(probas, bands)
+
+    assert alaska_weighted_auc(y_true, predictions) >= alaska_weighted_auc(y_true, np.mean(probas, axis=0)) - 0.005
+    assert depth.mean() < 3
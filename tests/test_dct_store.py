@@ -0,0 +1,86 @@
+import os
+
+import numpy as np
+
+from alaska2.dct_store import (
+    DctStore,
+    DctStoreWriter,
+    dct_store_key,
+    estimate_quality_factor,
+    get_dct_store,
+    sparse_delta,
+)
+
+
+def test_estimate_quality_factor():
+    qm75 = np.array(
+        [
+            [8, 6, 5, 8, 12, 20, 26, 31],
+            [6, 6, 7, 10, 13, 29, 30, 28],
+            [7, 7, 8, 12, 20, 29, 35, 28],
+            [7, 9, 11, 15, 26, 44, 40, 31],
+            [9, 11, 19, 28, 34, 55, 52, 39],
+            [12, 18, 28, 32, 41, 52, 57, 46],
+            [25, 32, 39, 44, 52, 61, 60, 51],
+            [36, 46, 48, 49, 56, 50, 52, 50],
+        ]
+    )
+    assert estimate_quality_factor(qm75) == 75
+    assert estimate_quality_factor(np.ones((8, 8))) == 100
+    assert estimate_quality_factor(np.full((8, 8), 7)) == -1
+
+
+def test_dct_store_roundtrip(tmp_path):
+    data_dir = str(tmp_path)
+    fnames = [os.path.join(data_dir, method, "00001.jpg") for method in ["Cover", "UERD"]]
+    records = [np.random.randint(-1024, 1024, size=(3, 64, 64)).astype(np.int16) for _ in fnames]
+    qtables = np.ones((2, 8, 8), dtype=np.int16)
+
+    keys = [dct_store_key(x) for x in fnames]
+    writer = DctStoreWriter(os.path.join(data_dir, "dct_store"), keys, record_shape=(3, 64, 64), records_per_shard=1)
+    for i, dct in enumerate(records):
+        writer.write(i, dct, qtables)
+    writer.close()
+
+    store = get_dct_store(data_dir)
+    assert isinstance(store, DctStore)
+    assert len(store) == 2
+    assert dct_store_key(fnames[1]) == "UERD/00001"
+    for fname, dct in zip(fnames, records):
+        np.testing.assert_array_equal(store[dct_store_key(fname)], dct)
+        assert store.quality_of(dct_store_key(fname)) == 100
+
+
+def test_dct_store_sparse_stego_records(tmp_path):
+    data_dir = str(tmp_path)
+    cover = np.random.randint(-1024, 1024, size=(3, 64, 64)).astype(np.int16)
+    stego = cover.copy()
+    stego.reshape(-1)[np.random.choice(cover.size, 100, replace=False)] += np.int16(8)
+    unchanged = cover.copy()
+
+    keys = ["Cover/00001", "JMiPOD/00001", "UERD/00001", "Cover/00002"]
+    records = [cover, stego, unchanged, stego]
+    bases = {"JMiPOD/00001": "Cover/00001", "UERD/00001": "Cover/00001"}
+    qtables = np.ones((2, 8, 8), dtype=np.int16)
+
+    writer = DctStoreWriter(
+        os.path.join(data_dir, "dct_store"), keys, record_shape=(3, 64, 64), records_per_shard=1, bases=bases
+    )
+    for i, (key, dct) in enumerate(zip(keys, records)):
+        if key in bases:
+            writer.write_delta(i, *sparse_delta(cover, dct), qtables)
+        else:
+            writer.write(i, dct, qtables)
+    writer.close()
+
+    assert writer.num_shards == 2
+    assert writer.num_deltas == 100
+
+    store = DctStore(os.path.join(data_dir, "dct_store"))
+    for key, dct in zip(keys, records):
+        np.testing.assert_array_equal(store[key], dct)
+        assert store.quality_of(key) == 100
+
+    base, indexes, values = store.get_delta(store.index_of("JMiPOD/00001"))
+    assert store.keys[base] == "Cover/00001"
+    assert len(indexes) == len(values) == 100
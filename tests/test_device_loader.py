@@ -0,0 +1,50 @@
+import torch
+from torch.utils.data import Dataset
+
+from alaska2.dataset import INPUT_FEATURES_DCT_KEY, INPUT_IMAGE_KEY, INPUT_TRUE_MODIFICATION_TYPE
+from alaska2.device_loader import compact_collate, get_data_loader
+
+
+class RandomFeatures(Dataset):
+    def __init__(self, fractional_dct=False):
+        self.fractional_dct = fractional_dct
+
+    def __len__(self):
+        return 10
+
+    def __getitem__(self, index):
+        generator = torch.Generator().manual_seed(index)
+        dct = torch.randint(-1024, 1024, (3, 16, 16), generator=generator).float()
+        if self.fractional_dct:
+            dct = dct + 0.5
+        return {
+            INPUT_IMAGE_KEY: torch.randint(0, 256, (3, 16, 16), generator=generator).float(),
+            INPUT_FEATURES_DCT_KEY: dct,
+            INPUT_TRUE_MODIFICATION_TYPE: index % 4,
+        }
+
+
+def test_compact_collate_is_lossless():
+    ds = RandomFeatures()
+    batch = compact_collate([ds[0], ds[1]])
+    assert batch[INPUT_IMAGE_KEY].dtype == torch.uint8
+    assert batch[INPUT_FEATURES_DCT_KEY].dtype == torch.int16
+    torch.testing.assert_allclose(batch[INPUT_FEATURES_DCT_KEY].float()[1], ds[1][INPUT_FEATURES_DCT_KEY])
+
+    ds = RandomFeatures(fractional_dct=True)
+    batch = compact_collate([ds[0], ds[1]])
+    assert batch[INPUT_FEATURES_DCT_KEY].dtype == torch.float32
+
+
+def test_device_loader_matches_data_loader():
+    ds = RandomFeatures()
+    expected = list(get_data_loader(ds, batch_size=4))
+    actual = list(get_data_loader(ds, compact=True, device="cpu", batch_size=4))
+
+    assert len(actual) == len(expected) == 3
+    for a, e in zip(actual, expected):
+        for key in [INPUT_IMAGE_KEY, INPUT_FEATURES_DCT_KEY]:
+            assert a[key].dtype == torch.float32
+            torch.testing.assert_allclose(a[key], e[key])
+        assert a[INPUT_TRUE_MODIFICATION_TYPE].dtype == torch.long
+        torch.testing.assert_allclose(a[INPUT_TRUE_MODIFICATION_TYPE], e[INPUT_TRUE_MODIFICATION_TYPE])
@@ -0,0 +1,75 @@
+import os
+
+import numpy as np
+
+from alaska2.dataset import read_modification_mask
+from alaska2.embedding_masks import (
+    EmbeddingMasksWriter,
+    analyze_cover,
+    changed_blocks,
+    count_changed_bits,
+    get_embedding_masks,
+)
+from alaska2.jpeg_decoder import decode_non_rounded
+
+
+def _random_stego(cover, num_changes):
+    stego = cover.copy()
+    stego.reshape(-1)[np.random.choice(cover.size, num_changes, replace=False)] += 1
+    return stego
+
+
+def test_changed_blocks_match_decoded_difference():
+    cover = np.random.randint(-64, 64, size=(3, 64, 64)).astype(np.int16)
+    stego = _random_stego(cover, 20)
+
+    decoded = decode_non_rounded(np.stack([cover, stego]), dtype=np.float64)
+    pixel_mask = np.abs(decoded[0] - decoded[1]).max(axis=2) > 1e-6
+    # Several changes in one block may cancel at some pixels, but never in the whole block
+    decoded_mask = pixel_mask.reshape(8, 8, 8, 8).any(axis=(1, 3))
+    np.testing.assert_array_equal(changed_blocks(cover, stego), decoded_mask)
+
+
+def test_count_changed_bits():
+    cover = np.random.randint(-1024, 1024, size=(3, 16, 16)).astype(np.int32)
+    stego = _random_stego(cover, 10)
+
+    expected = [
+        np.count_nonzero(np.unpackbits(x.view(np.uint8)) != np.unpackbits(y.view(np.uint8)))
+        for x, y in zip(cover, stego)
+    ]
+    np.testing.assert_array_equal(count_changed_bits(cover, stego), expected)
+
+
+def test_analyze_cover():
+    cover = np.zeros((3, 16, 16), dtype=np.int16)
+    jmipod, juniward, uerd = cover.copy(), cover.copy(), cover.copy()
+    jmipod[0, 0, 0] = 1
+    juniward[1, 9, 9] = -1
+    juniward[2, 9, 10] = 3
+
+    masks, stats = analyze_cover(cover, [jmipod, juniward, uerd])
+    assert masks.shape == (4, 2, 2)
+    np.testing.assert_array_equal(masks[0], [[True, False], [False, True]])
+    assert stats["changed_blocks"] == [1, 1, 0]
+    assert stats["dct_total"] == [1, 2, 0]
+    assert stats["dct_cb"] == [0, 1, 0]
+
+
+def test_embedding_masks_roundtrip(tmp_path):
+    data_dir = str(tmp_path)
+    keys = ["JMiPOD/00001", "UERD/00001"]
+    block_masks = [np.random.rand(64, 64) > 0.5 for _ in keys]
+
+    writer = EmbeddingMasksWriter(os.path.join(data_dir, "embedding_masks"), keys, block_shape=(64, 64))
+    for i, mask in enumerate(block_masks):
+        writer.write(i, mask)
+    writer.close()
+
+    masks = get_embedding_masks(data_dir)
+    for key, mask in zip(keys, block_masks):
+        np.testing.assert_array_equal(masks.get_block_mask(key), mask)
+
+    mask = read_modification_mask(os.path.join(data_dir, "UERD", "00001.jpg"))
+    assert mask.shape == (512, 512, 1)
+    np.testing.assert_array_equal(mask[::8, ::8, 0] > 0, block_masks[1])
@@ -0,0 +1,66 @@
+import numpy as np
+import torch
+from torch import nn
+
+from alaska2.dataset import INPUT_IMAGE_KEY, OUTPUT_PRED_MODIFICATION_FLAG, OUTPUT_PRED_MODIFICATION_TYPE
+from alaska2.export import CpuRunner, export_model, fold_input_normalization
+
+
+class AffineNormalize(nn.Module):
+    def __init__(self, mean, std):
+        super().__init__()
+        self.register_buffer("mean", torch.tensor(mean).float().view(1, -1, 1, 1))
+        self.register_buffer("std", torch.tensor(std).float().view(1, -1, 1, 1))
+
+    def forward(self, x):
+        return (x.float() - self.mean) / self.std
+
+
+class TinyModel(nn.Module):
+    def __init__(self):
+        super().__init__()
+        self.rgb_bn = AffineNormalize([100, 110, 120], [40, 45, 50])
+        self.conv = nn.Conv2d(3, 8, kernel_size=3, padding=1)
+        self.flag_classifier = nn.Linear(8, 1)
+        self.type_classifier = nn.Linear(8, 4)
+
+    def forward(self, **kwargs):
+        x = self.conv(self.rgb_bn(kwargs[INPUT_IMAGE_KEY])).mean(dim=(2, 3))
+        return {
+            OUTPUT_PRED_MODIFICATION_FLAG: self.flag_classifier(x),
+            OUTPUT_PRED_MODIFICATION_TYPE: self.type_classifier(x),
+        }
+
+    @property
+    def required_features(self):
+        return [INPUT_IMAGE_KEY]
+
+
+@torch.no_grad()
+def test_fold_input_normalization():
+    model = TinyModel().eval()
+    image = torch.randint(0, 256, (2, 3, 16, 16)).float()
+    expected = model(image=image)[OUTPUT_PRED_MODIFICATION_FLAG]
+
+    assert fold_input_normalization(model, model.conv)
+    np.testing.assert_allclose(model(image=image)[OUTPUT_PRED_MODIFICATION_FLAG], expected, rtol=1e-4, atol=1e-4)
+
+
+def test_export_torchscript(tmp_path):
+    model = TinyModel().eval()
+    sample = {INPUT_IMAGE_KEY: torch.randint(0, 256, (3, 16, 16), dtype=torch.uint8)}
+    artifact_fname = str(tmp_path / "model_torchscript.pt")
+
+    meta = export_model(model, sample, artifact_fname, fold_normalization=False)
+    assert meta["max_abs_diff"] < 1e-4
+
+    runner = CpuRunner(artifact_fname, num_threads=1)
+    batch = {INPUT_IMAGE_KEY: torch.randint(0, 256, (5, 3, 16, 16), dtype=torch.uint8)}
+    outputs = runner.predict_batch(batch)
+    with torch.no_grad():
+        expected = model(**batch)
+
+    assert outputs[OUTPUT_PRED_MODIFICATION_TYPE].shape == (5, 4)
+    np.testing.assert_allclose(
+        outputs[OUTPUT_PRED_MODIFICATION_FLAG], expected[OUTPUT_PRED_MODIFICATION_FLAG], atol=1e-4
+    )
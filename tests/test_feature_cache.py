@@ -0,0 +1,50 @@
+import os
+
+import cv2
+import numpy as np
+
+from alaska2.dataset import INPUT_FEATURES_BLUR_KEY, INPUT_FEATURES_ELA_RICH_KEY, compute_features
+from alaska2.feature_cache import FeatureCache
+
+
+def test_feature_cache_roundtrip(tmp_path):
+    image_fname = str(tmp_path / "00001.jpg")
+    image = np.random.randint(0, 256, size=(64, 64, 3)).astype(np.uint8)
+    cv2.imwrite(image_fname, image)
+    image = cv2.imread(image_fname)
+
+    cache = FeatureCache(str(tmp_path / "cache"))
+    features = [INPUT_FEATURES_ELA_RICH_KEY, INPUT_FEATURES_BLUR_KEY]
+
+    expected = compute_features(image, image_fname, features)
+    computed = compute_features(image, image_fname, features, cache)
+    cached = compute_features(image, image_fname, features, cache)
+    assert cache.hits == 2 and cache.misses == 2
+
+    for key in features:
+        np.testing.assert_array_equal(computed[key], expected[key])
+        np.testing.assert_array_equal(cached[key], expected[key])
+        assert cached[key].dtype == np.float32
+
+    # Changing the image invalidates cached entries
+    os.utime(image_fname, ns=(0, 0))
+    assert cache.get(image_fname, INPUT_FEATURES_BLUR_KEY, "pyr=2,4,8") is None
+
+
+def test_feature_cache_evicts_least_recently_used(tmp_path):
+    image_fnames = []
+    for i in range(4):
+        image_fname = str(tmp_path / f"{i}.jpg")
+        open(image_fname, "w").close()
+        os.utime(image_fname, ns=(i, i))
+        image_fnames.append(image_fname)
+
+    value = np.zeros((256, 256), dtype=np.float32)
+    cache = FeatureCache(str(tmp_path / "cache"), max_size_gb=3.5 * value.astype(np.float16).nbytes / 1024**3)
+    for image_fname in image_fnames:
+        cache.put(image_fname, "feature", value)
+        os.utime(cache.entry_path(image_fname, "feature"), ns=(0, os.stat(image_fname).st_mtime_ns))
+    cache.evict()
+
+    assert cache.get(image_fnames[0], "feature") is None
+    assert cache.get(image_fnames[3], "feature") is not None
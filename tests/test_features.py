@@ -41,3 +41,85 @@ def test_decoding_residual():
     # stego = cv2.imread("d:/datasets/ALASKA2/UERD/20805.jpg")
     # r1 = compute_decoding_residual(cover, "d:/datasets/ALASKA2/Cover/20805.npz")
     # r2 = compute_decoding_residual(stego, "d:/datasets/ALASKA2/UERD/20805.npz")
+
+
+def test_block_idct_matches_per_block_loop():
+    from scipy import fftpack
+    from alaska2.block_dct import DCTMTX, block_idct2, block_idct2_ortho
+
+    dct = np.random.randint(-1024, 1024, size=(512, 512)).astype(np.int16)
+    qm = np.random.randint(1, 50, size=(8, 8)).astype(np.int16)
+
+    expected = np.zeros((512, 512), dtype=np.float32)
+    expected_qm = np.zeros((512, 512), dtype=np.float32)
+    for i in range(0, 512, 8):
+        for j in range(0, 512, 8):
+            block = dct[i : i + 8, j : j + 8]
+            expected[i : i + 8, j : j + 8] = fftpack.idct(
+                fftpack.idct(block, axis=0, norm="ortho"), axis=1, norm="ortho"
+            )
+            expected_qm[i : i + 8, j : j + 8] = DCTMTX.T @ (qm * block) @ DCTMTX
+
+    np.testing.assert_array_equal(block_idct2_ortho(dct), expected)
+    np.testing.assert_array_equal(block_idct2(dct, qm), expected_qm)
+
+
+def test_torch_block_idct():
+    import torch
+    from alaska2.block_dct import block_idct2, torch_block_idct2
+
+    dct = np.random.randint(-1024, 1024, size=(2, 3, 64, 64)).astype(np.int16)
+    qm = np.random.randint(1, 50, size=(3, 8, 8)).astype(np.float32)
+
+    actual = torch_block_idct2(torch.from_numpy(dct).double(), torch.from_numpy(qm)).numpy()
+    for b in range(2):
+        for c in range(3):
+            np.testing.assert_allclose(actual[b, c], block_idct2(dct[b, c], qm[c], dtype=np.float64), atol=1e-6)
+
+
+def test_non_rounded_decoder_matches_cv2():
+    from alaska2.block_dct import block_idct2_ortho
+    from alaska2.jpeg_decoder import decode_non_rounded
+
+    dct = np.random.randint(-256, 256, size=(3, 64, 64)).astype(np.int32)
+    dct[0, 0::8, 0::8] = np.random.randint(-1024, 1024, size=(8, 8))
+    qm = np.random.randint(1, 20, size=(3, 8, 8)).astype(np.uint16)
+
+    dequantized = dct * np.tile(qm, (1, 8, 8))
+    y, cb, cr = [block_idct2_ortho(plane) for plane in dequantized]
+    ycrcb = (np.dstack([y, cr, cb]) + 127.5) / 255.0
+    expected = cv2.cvtColor(ycrcb.astype(np.float32), cv2.COLOR_YCrCb2BGR)
+
+    np.testing.assert_allclose(decode_non_rounded(dct, qm, convention="bgr"), expected, rtol=1e-5, atol=1e-5)
+    np.testing.assert_allclose(decode_non_rounded(dequantized, None, convention="bgr"), expected, rtol=1e-5, atol=1e-5)
+
+
+def test_compute_features_loads_dct_once(monkeypatch):
+    from alaska2 import dataset as ds
+
+    calls = []
+    dct = np.random.randint(-256, 256, size=(3, 64, 64)).astype(np.int16)
+
+    def load_dct(image_fname):
+        calls.append(image_fname)
+        return dct
+
+    monkeypatch.setitem(ds.FEATURE_INTERMEDIATES, "dct", (["image_fname"], load_dct))
+
+    image = np.random.randint(0, 256, size=(64, 64, 3)).astype(np.uint8)
+    features = [
+        ds.INPUT_FEATURES_DCT_KEY,
+        ds.INPUT_FEATURES_DCT_Y_KEY,
+        ds.INPUT_FEATURES_CHANNEL_Y_KEY,
+        ds.INPUT_FEATURES_JPEG_FLOAT,
+        ds.INPUT_FEATURES_DECODING_RESIDUAL_KEY,
+    ]
+    sample = ds.compute_features(image, "Cover/00001.jpg", features)
+
+    assert len(calls) == 1
+    np.testing.assert_array_equal(sample[ds.INPUT_FEATURES_DCT_KEY], np.dstack(dct))
+    np.testing.assert_allclose(
+        sample[ds.INPUT_FEATURES_DECODING_RESIDUAL_KEY],
+        sample[ds.INPUT_FEATURES_JPEG_FLOAT] - image.astype(np.float32),
+        atol=1e-3,
+    )
@@ -0,0 +1,41 @@
+import os
+
+import cv2
+import numpy as np
+
+from alaska2.jpeg_header import get_qf_index, qf_dicts_from_index, read_jpeg_qtables
+
+
+def _write_jpeg(fname, quality):
+    image = np.random.randint(0, 256, (64, 64, 3), dtype=np.uint8)
+    cv2.imwrite(fname, image, [cv2.IMWRITE_JPEG_QUALITY, quality])
+
+
+def test_read_jpeg_qtables(tmp_path):
+    fname = str(tmp_path / "00001.jpg")
+    _write_jpeg(fname, 75)
+
+    qtables = read_jpeg_qtables(fname)
+    assert qtables.shape == (2, 8, 8)
+    assert qtables[0, 0].tolist() == [8, 6, 5, 8, 12, 20, 26, 31]
+    assert qtables[0, :, 0].tolist() == [8, 6, 7, 7, 9, 12, 25, 36]
+
+
+def test_qf_index_is_cached(tmp_path):
+    fnames = []
+    for i, quality in enumerate([75, 90, 95]):
+        fnames.append(str(tmp_path / f"{i:05d}.jpg"))
+        _write_jpeg(fnames[-1], quality)
+
+    index_fname = str(tmp_path / "qf_index.pkl")
+    index = get_qf_index(fnames[:2], index_fname, workers=2)
+    assert index["quality"].tolist() == [75, 90]
+
+    index = get_qf_index(fnames[::-1], index_fname, workers=2)
+    assert index["quality"].tolist() == [95, 90, 75]
+    assert len(index["qm0"][0]) == 64
+
+    names_qf, qf_names = qf_dicts_from_index(index)
+    assert names_qf["00002.jpg"] == 95
+    assert qf_names[75] == ["00000.jpg"]
+    assert os.path.isfile(index_fname)
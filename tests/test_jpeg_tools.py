@@ -0,0 +1,23 @@
+import subprocess
+import sys
+
+import numpy as np
+
+from alaska2.jpeg_decoder import NonRoundedDecoder, decode_non_rounded
+
+
+def test_jpeg_tools_does_not_import_alaska2():
+    # abba imports jpeg_tools without alaska2 and its training dependencies
+    code = "import sys, jpeg_tools; print(any(m.split('.')[0] in ('alaska2', 'torch') for m in sys.modules))"
+    assert subprocess.check_output([sys.executable, "-c", code]).decode().strip() == "False"
+
+
+def test_alaska2_reexports_jpeg_tools():
+    import jpeg_tools
+
+    assert NonRoundedDecoder is jpeg_tools.NonRoundedDecoder
+    dct = np.random.randint(-50, 50, size=(3, 16, 16))
+    qm = np.random.randint(1, 10, size=(3, 8, 8))
+    np.testing.assert_array_equal(
+        decode_non_rounded(dct, qm, convention="rgb"), jpeg_tools.decode_non_rounded(dct, qm, convention="rgb")
+    )
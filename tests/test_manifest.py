@@ -0,0 +1,62 @@
+import os
+
+import pandas as pd
+
+from alaska2.dataset import build_manifest
+
+
+def test_build_manifest(tmp_path):
+    folds_csv = str(tmp_path / "folds_v2.csv")
+    unchanged_csv = str(tmp_path / "df_unchanged.csv")
+    changed_bits_csv = str(tmp_path / "changed_bits.csv")
+
+    pd.DataFrame.from_dict(
+        {"image_id": ["00001.jpg", "00002.jpg", "00003.jpg"], "quality": [0, 1, 2], "fold": [0, 1, -1]}
+    ).to_csv(folds_csv, index=False)
+    pd.DataFrame.from_dict({"file": ["00002.jpg"], "method": ["UERD"], "quality": [75], "nbits": [0]}).to_csv(
+        unchanged_csv, index=False
+    )
+    pd.DataFrame.from_dict(
+        {
+            "file": ["00001.jpg", "00002.jpg", "00003.jpg"] * 3,
+            "method": ["JMiPOD"] * 3 + ["JUNIWARD"] * 3 + ["UERD"] * 3,
+            "nbits": list(range(9)),
+        }
+    ).to_csv(changed_bits_csv, index=False)
+
+    manifest = build_manifest(folds_csv, unchanged_csv, changed_bits_csv)
+
+    assert manifest["method"].tolist() == ["Cover"] * 3 + ["JMiPOD"] * 3 + ["JUNIWARD"] * 3 + ["UERD"] * 2
+    assert manifest["image_id"].tolist()[-2:] == ["00001.jpg", "00003.jpg"]
+    assert manifest["target"].tolist() == [0] * 3 + [1] * 3 + [2] * 3 + [3] * 2
+    assert manifest["bits"].tolist() == [0, 0, 0, 0, 1, 2, 3, 4, 5, 6, 8]
+    assert manifest["has_unchanged_stego"].tolist()[:3] == [False, True, False]
+
+
+def test_build_manifest_legacy_pd_column(tmp_path):
+    folds_csv = str(tmp_path / "folds_v2.csv")
+    unchanged_csv = str(tmp_path / "df_unchanged.csv")
+
+    pd.DataFrame.from_dict({"image_id": ["00001.jpg", "00002.jpg"], "quality": [0, 1], "fold": [0, 1]}).to_csv(
+        folds_csv, index=False
+    )
+    pd.DataFrame.from_dict({"file": [], "method": [], "quality": [], "nbits": []}).to_csv(unchanged_csv, index=False)
+
+    images = ["00001.jpg", "00002.jpg"] * 3
+    methods = ["JMiPOD"] * 2 + ["JUNIWARD"] * 2 + ["UERD"] * 2
+    changed_blocks = [0, 1, 2, 4, 8, 4096]
+
+    new_csv = str(tmp_path / "new" / "analyze_embeddings.csv")
+    legacy_csv = str(tmp_path / "legacy" / "analyze_embeddings.csv")
+    for fname in [new_csv, legacy_csv]:
+        os.makedirs(os.path.dirname(fname))
+    pd.DataFrame.from_dict({"image": images, "method": methods, "changed_blocks": changed_blocks}).to_csv(
+        new_csv, index=False
+    )
+    pd.DataFrame.from_dict({"image": images, "method": methods, "pd": [64 * x for x in changed_blocks]}).to_csv(
+        legacy_csv, index=False
+    )
+
+    expected = [0, 0] + [x / 4096 for x in changed_blocks]
+    assert build_manifest(folds_csv, unchanged_csv, new_csv)["bits"].tolist() == expected
+    assert build_manifest(folds_csv, unchanged_csv, legacy_csv)["bits"].tolist() == expected
@@ -0,0 +1,118 @@
+import numpy as np
+import pytest
+import torch
+from sklearn.metrics import roc_curve
+
+from alaska2.metric import (
+    MetricAccumulator,
+    StreamingWAUC,
+    alaska_weighted_auc,
+    batch_wauc,
+    bootstrap_wauc,
+    shaky_wauc,
+    wauc_breakdown,
+)
+
+# np.trapz is called np.trapezoid since NumPy 2.0
+trapz = getattr(np, "trapezoid", None) or np.trapz
+
+
+def reference_wauc(y_true, y_pred):
+    fpr, tpr, thresholds = roc_curve((np.array(y_true) > 0).astype(int), y_pred, drop_intermediate=False)
+    tpr_thresholds = [0.0, 0.4, 1.0]
+    weights = [2.0, 1.0]
+    auc_x = 0.0
+    for idx in range(len(tpr_thresholds) - 1):
+        mask = tpr >= tpr_thresholds[idx]
+        x = fpr[mask]
+        y = tpr[mask]
+        mask = y > tpr_thresholds[idx + 1]
+        y[mask] = tpr_thresholds[idx + 1]
+        y = y - tpr_thresholds[idx]
+        auc_x = auc_x + weights[idx] * trapz(y, x)
+    areas = np.array(tpr_thresholds[1:]) - np.array(tpr_thresholds[:-1])
+    normalization = np.dot(areas, np.array(weights))
+    return auc_x / normalization
+
+
+@pytest.mark.parametrize("num_levels", [None, 10, 2])
+def test_wauc_matches_reference(num_levels):
+    y_true = np.random.randint(0, 4, size=(8, 1000))
+    y_pred = np.random.rand(8, 1000) + (y_true > 0) * 0.3
+    if num_levels is not None:
+        # Lots of tied scores
+        y_pred = np.round(y_pred * num_levels) / num_levels
+
+    expected = [reference_wauc(t, p) for t, p in zip(y_true, y_pred)]
+    np.testing.assert_allclose(batch_wauc(y_true, y_pred), expected, rtol=1e-12, atol=1e-12)
+    np.testing.assert_allclose(alaska_weighted_auc(y_true[0], y_pred[0]), expected[0], rtol=1e-12, atol=1e-12)
+
+
+def test_bootstrap_wauc():
+    y_true = np.random.randint(0, 4, size=2000)
+    y_pred = np.random.rand(2000) + (y_true > 0) * 0.3
+
+    scores = bootstrap_wauc(y_true, y_pred, n=100, samples=[200, 50, 50, 50], chunk_size=16, seed=42)
+    assert scores.shape == (100,)
+    np.testing.assert_array_equal(
+        scores, bootstrap_wauc(y_true, y_pred, n=100, samples=[200, 50, 50, 50], chunk_size=16, seed=42)
+    )
+    assert abs(scores.mean() - alaska_weighted_auc(y_true, y_pred)) < 0.02
+
+    public = bootstrap_wauc(y_true, y_pred, n=10, samples=[200, 50, 50, 50], subset=100, workers=2, seed=42)
+    assert public.shape == (10,)
+    assert len(shaky_wauc(y_true, y_pred, n=10, k=400, return_scores=True)) == 10
+
+
+def test_metric_accumulator_breakdown():
+    accumulator = MetricAccumulator(capacity=16)
+    true_labels, pred_labels, quality_factors = [], [], []
+    for _ in range(10):
+        y_true = torch.randint(0, 4, size=(30,))
+        y_pred = torch.rand(30) + (y_true > 0).float() * 0.3
+        qf = torch.randint(0, 3, size=(30,))
+        accumulator.update(true_labels=y_true, pred_labels=y_pred, quality_factors=qf)
+        true_labels.append(y_true.numpy())
+        pred_labels.append(y_pred.numpy())
+        quality_factors.append(qf.numpy())
+
+    true_labels = np.concatenate(true_labels)
+    pred_labels = np.concatenate(pred_labels)
+    quality_factors = np.concatenate(quality_factors)
+    np.testing.assert_array_equal(accumulator.get("true_labels"), true_labels)
+    np.testing.assert_array_equal(accumulator.get("pred_labels"), pred_labels)
+    np.testing.assert_array_equal(accumulator.get("quality_factors"), quality_factors)
+
+    groups = [quality_factors == qf for qf in range(3)]
+    groups += [(quality_factors == 0) & ((true_labels == 0) | (true_labels == target)) for target in [1, 2, 3]]
+    expected = [alaska_weighted_auc(true_labels, pred_labels)]
+    expected += [alaska_weighted_auc(true_labels[mask], pred_labels[mask]) for mask in groups]
+    np.testing.assert_allclose(wauc_breakdown(true_labels, pred_labels, groups), expected)
+
+    accumulator.reset()
+    assert len(accumulator.get("pred_labels")) == 0
+
+
+@pytest.mark.parametrize("num_bins", [64, 1024, 65536])
+def test_streaming_wauc_error_bound(num_bins):
+    y_true = np.random.randint(0, 4, size=20000)
+    y_pred = np.clip(np.random.randn(20000) * 0.15 + 0.4 + (y_true > 0) * 0.2, 0, 1)
+    qf = np.random.randint(0, 3, size=20000)
+
+    full = StreamingWAUC(num_bins=num_bins, num_groups=3)
+    full.update(torch.from_numpy(y_true), torch.from_numpy(y_pred), torch.from_numpy(qf))
+
+    # Histograms of separate workers merge into the same state
+    merged = StreamingWAUC(num_bins=num_bins, num_groups=3)
+    for chunk in np.array_split(np.arange(len(y_true)), 4):
+        worker = StreamingWAUC(num_bins=num_bins, num_groups=3)
+        worker.update(y_true[chunk], y_pred[chunk], qf[chunk])
+        merged.merge(worker)
+    assert merged.compute() == full.compute()
+
+    score, error = full.compute()
+    assert abs(score - alaska_weighted_auc(y_true, y_pred)) <= error + 1e-9
+    for group in range(3):
+        mask = qf == group
+        score, error = full.compute(group)
+        assert abs(score - alaska_weighted_auc(y_true[mask], y_pred[mask])) <= error + 1e-9
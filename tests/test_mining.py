@@ -0,0 +1,45 @@
+import numpy as np
+
+from alaska2.mining import HardExampleSampler, SampleLossTracker
+
+
+def test_loss_tracker():
+    tracker = SampleLossTracker(10, momentum=0.5)
+    tracker.update([0, 1], [1.0, 3.0])
+    tracker.update([0], [3.0])
+
+    losses = tracker.get_losses()
+    assert tracker.losses.dtype == np.float16
+    np.testing.assert_allclose(losses[:2], [2.0, 3.0])
+    np.testing.assert_allclose(losses[2:], 2.5)
+
+    restored = SampleLossTracker(10)
+    restored.load_state_dict(tracker.state_dict())
+    np.testing.assert_array_equal(restored.get_losses(), losses)
+
+
+def test_sampler_oversamples_hard_examples():
+    tracker = SampleLossTracker(1000)
+    tracker.update(np.arange(1000), np.where(np.arange(1000) < 100, 5.0, 0.1))
+
+    sampler = HardExampleSampler(tracker, temperature=1.0, uniform_p=0.1)
+    indexes = np.array(list(sampler))
+    assert len(indexes) == len(sampler) == 1000
+    assert np.mean(indexes < 100) > 0.5
+
+
+def test_sampler_replicas_and_state():
+    tracker = SampleLossTracker(1000)
+    tracker.update(np.arange(1000), np.random.rand(1000))
+
+    replicas = [HardExampleSampler(tracker, num_replicas=2, rank=rank) for rank in range(2)]
+    epoch0 = [list(sampler) for sampler in replicas]
+    assert len(epoch0[0]) == len(epoch0[1]) == 500
+    assert epoch0[0] != epoch0[1]
+
+    state = replicas[0].state_dict()
+    epoch1 = list(replicas[0])
+
+    restored = HardExampleSampler(tracker, num_replicas=2, rank=0, refresh_every=2)
+    restored.load_state_dict(state)
+    assert list(restored) == epoch1
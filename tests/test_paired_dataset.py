@@ -0,0 +1,71 @@
+import os
+
+import albumentations as A
+import cv2
+import numpy as np
+import torch
+
+from alaska2.dataset import (
+    INPUT_IMAGE_ID_KEY,
+    INPUT_IMAGE_KEY,
+    INPUT_TRUE_MODIFICATION_FLAG,
+    INPUT_TRUE_MODIFICATION_TYPE,
+    MultiStegoPairedDataset,
+    PairedImageDataset,
+    paired_collate,
+)
+
+
+def _write_images(tmp_path, num_images=2):
+    images = []
+    for method in ["Cover", "JMiPOD", "JUNIWARD", "UERD"]:
+        os.makedirs(str(tmp_path / method))
+        for i in range(num_images):
+            image = np.random.randint(0, 256, (16, 16, 3), dtype=np.uint8)
+            cv2.imwrite(str(tmp_path / method / f"{i:05d}.png"), image)
+            if method == "Cover":
+                images.append(str(tmp_path / method / f"{i:05d}.png"))
+    return images
+
+
+def test_multi_stego_dataset_replays_transform(tmp_path):
+    images = _write_images(tmp_path)
+    transform = A.ReplayCompose([A.HorizontalFlip(p=0.5), A.VerticalFlip(p=0.5)])
+    ds = MultiStegoPairedDataset(images, [75, 90], transform=transform, features=[INPUT_IMAGE_KEY])
+
+    sample = ds[1]
+    assert sample[INPUT_IMAGE_KEY].size() == (4, 3, 16, 16)
+    assert sample[INPUT_TRUE_MODIFICATION_TYPE].tolist() == [0, 1, 2, 3]
+    assert sample[INPUT_TRUE_MODIFICATION_FLAG].tolist() == [0, 1, 1, 1]
+
+    # Undo the transform of the cover and check that every stego image was transformed in the same way
+    cover = sample[INPUT_IMAGE_KEY][0]
+    expected_cover = torch.from_numpy(cv2.imread(images[1])).permute(2, 0, 1)
+    flips = [dims for dims in [[], [1], [2], [1, 2]] if torch.equal(torch.flip(expected_cover, dims), cover)]
+    assert len(flips) > 0
+    for i, method in enumerate(["JMiPOD", "JUNIWARD", "UERD"]):
+        stego = torch.from_numpy(cv2.imread(images[1].replace("Cover", method))).permute(2, 0, 1)
+        assert torch.equal(sample[INPUT_IMAGE_KEY][i + 1], torch.flip(stego, flips[0]))
+
+
+def test_paired_collate_groups_by_method(tmp_path):
+    images = _write_images(tmp_path)
+    ds = MultiStegoPairedDataset(images, [75, 90], transform=A.ReplayCompose([]), features=[INPUT_IMAGE_KEY])
+    batch = paired_collate([ds[0], ds[1]])
+
+    assert batch[INPUT_IMAGE_KEY].size() == (8, 3, 16, 16)
+    assert batch[INPUT_TRUE_MODIFICATION_TYPE].tolist() == [0, 0, 1, 1, 2, 2, 3, 3]
+    assert batch[INPUT_TRUE_MODIFICATION_FLAG].size() == (8, 1)
+    assert batch[INPUT_IMAGE_ID_KEY][:2] == ["00000", "00001"]
+    assert torch.equal(batch[INPUT_IMAGE_KEY][3], ds[1][INPUT_IMAGE_KEY][1])
+
+
+def test_paired_dataset(tmp_path):
+    images = _write_images(tmp_path)
+    for target in [1, 2, 3]:
+        ds = PairedImageDataset(
+            images, [75, 90], target=target, transform=A.ReplayCompose([]), features=[INPUT_IMAGE_KEY]
+        )
+        sample = ds[0]
+        assert sample[INPUT_IMAGE_KEY].size() == (2, 3, 16, 16)
+        assert sample[INPUT_TRUE_MODIFICATION_TYPE].tolist() == [0, target]
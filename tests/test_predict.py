@@ -0,0 +1,63 @@
+import pytest
+import torch
+from torch import nn
+
+from alaska2.block_dct import torch_block_idct2
+from alaska2.dataset import (
+    INPUT_FEATURES_DCT_KEY,
+    INPUT_IMAGE_KEY,
+    OUTPUT_PRED_MODIFICATION_FLAG,
+    OUTPUT_PRED_MODIFICATION_TYPE,
+)
+from alaska2.predict import D4TTA, HVFlipTTA
+
+
+class TinyModel(nn.Module):
+    def __init__(self):
+        super().__init__()
+        self.conv = nn.Conv2d(3, 8, kernel_size=3, padding=1)
+        self.modification_flag = nn.Linear(8 * 4 * 4, 1)
+        self.modification_type = nn.Linear(8 * 4 * 4, 4)
+
+    def forward(self, **kwargs):
+        x = torch.nn.functional.adaptive_avg_pool2d(self.conv(kwargs[INPUT_IMAGE_KEY]), 4).flatten(1)
+        return {
+            OUTPUT_PRED_MODIFICATION_FLAG: self.modification_flag(x),
+            OUTPUT_PRED_MODIFICATION_TYPE: self.modification_type(x),
+        }
+
+
+@pytest.mark.parametrize("tta_class", [HVFlipTTA, D4TTA])
+@torch.no_grad()
+def test_batched_tta_matches_sequential(tta_class):
+    model = TinyModel().eval()
+    inputs = {INPUT_IMAGE_KEY: torch.randn((3, 3, 16, 16))}
+    outputs = [OUTPUT_PRED_MODIFICATION_FLAG, OUTPUT_PRED_MODIFICATION_TYPE]
+
+    expected = tta_class(model, inputs=[INPUT_IMAGE_KEY], outputs=outputs, batched=False)(**inputs)
+    batched = tta_class(model, inputs=[INPUT_IMAGE_KEY], outputs=outputs, batched=True)(**inputs)
+    micro_batched = tta_class(model, inputs=[INPUT_IMAGE_KEY], outputs=outputs, batched=True, max_batch_size=5)(
+        **inputs
+    )
+
+    for key in outputs + [x + "_tta" for x in outputs]:
+        assert batched[key].size() == expected[key].size()
+        torch.testing.assert_allclose(batched[key], expected[key])
+        torch.testing.assert_allclose(micro_batched[key], expected[key])
+
+
+@pytest.mark.parametrize("tta_class", [HVFlipTTA, D4TTA])
+def test_dct_views_match_pixel_views(tta_class):
+    dct = torch.randn((2, 3, 32, 48), dtype=torch.float64)
+    for view, dct_view in zip(tta_class.views, tta_class.dct_views):
+        torch.testing.assert_allclose(torch_block_idct2(dct_view(dct)), view(torch_block_idct2(dct)))
+
+
+def test_dct_inputs_are_augmented_in_dct_domain():
+    tta = D4TTA(TinyModel(), inputs=[INPUT_IMAGE_KEY, INPUT_FEATURES_DCT_KEY], outputs=[])
+    assert tta.dct_inputs == [INPUT_FEATURES_DCT_KEY]
+
+    dct = torch.randn((1, 3, 16, 16))
+    augmented = tta.augment_inputs(1, {INPUT_IMAGE_KEY: dct, INPUT_FEATURES_DCT_KEY: dct})
+    torch.testing.assert_allclose(augmented[INPUT_IMAGE_KEY], D4TTA.views[1](dct))
+    torch.testing.assert_allclose(augmented[INPUT_FEATURES_DCT_KEY], D4TTA.dct_views[1](dct))
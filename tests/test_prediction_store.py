@@ -0,0 +1,54 @@
+import numpy as np
+import pandas as pd
+
+from alaska2.prediction_store import PredictionWriter, predictions_store_path, read_prediction_arrays, read_predictions
+from alaska2.submissions import get_x_y_for_stacking
+
+
+def write_random_predictions(writer: PredictionWriter, num_batches=5, batch_size=3):
+    for batch in range(num_batches):
+        writer.write(
+            {
+                "image_id": [f"{batch * batch_size + i:05d}.jpg" for i in range(batch_size)],
+                "true_modification_type": np.random.randint(0, 4, size=batch_size),
+                "true_modification_flag": np.random.randint(0, 2, size=batch_size),
+                "pred_modification_flag": np.random.randn(batch_size),
+                "pred_modification_type": np.random.randn(batch_size, 4),
+                "pred_modification_type_tta": np.random.randn(batch_size, 4 * 8),
+                "pred_modification_flag_tta": np.random.randn(batch_size, 8),
+            }
+        )
+    writer.close()
+
+
+def test_prediction_store_roundtrip(tmp_path):
+    writer = PredictionWriter(str(tmp_path / "test_predictions.preds"), rows_per_shard=4)
+    write_random_predictions(writer)
+    assert writer.num_shards == 3
+
+    arrays = read_prediction_arrays(writer.root)
+    assert arrays["image_id"].tolist() == [f"{i:05d}.jpg" for i in range(15)]
+    assert arrays["pred_modification_flag"].shape == (15,)
+    assert arrays["pred_modification_type_tta"].shape == (15, 32)
+    assert arrays["pred_modification_type"].dtype == np.float32
+
+
+def test_stacking_features_match_legacy_csv(tmp_path):
+    predictions_csv = str(tmp_path / "holdout_predictions.csv")
+    writer = PredictionWriter(predictions_store_path(predictions_csv))
+    write_random_predictions(writer)
+
+    # Legacy format stores arrays as strings
+    df = read_predictions(writer.root)
+    for key in ["pred_modification_type", "pred_modification_type_tta", "pred_modification_flag_tta"]:
+        df[key] = df[key].apply(lambda x: x.tolist())
+    legacy_csv = str(tmp_path / "legacy_predictions.csv")
+    df.to_csv(legacy_csv, index=False)
+
+    for kwargs in [{}, dict(with_logits=True, tta_logits=True, tta_probas=True)]:
+        x_legacy, y_legacy = get_x_y_for_stacking([legacy_csv], **kwargs)
+        x, y = get_x_y_for_stacking([predictions_csv], **kwargs)
+        np.testing.assert_array_equal(y, y_legacy)
+        np.testing.assert_allclose(x, x_legacy, rtol=1e-5, atol=1e-6)
+
+    assert isinstance(read_predictions(legacy_csv), pd.DataFrame)
@@ -0,0 +1,116 @@
+import collections
+import os
+import random
+
+import numpy as np
+import torch
+from torch import nn
+from torch.utils.data import DataLoader
+
+from alaska2.resume import ResumableSampler, ResumeCallback, get_rng_state, set_rng_state
+from alaska2.sampler import BalancedQFSampler
+
+
+def test_resumable_sampler_continues_epoch():
+    sampler = ResumableSampler(None, 100)
+    epoch0 = list(sampler)
+    assert sorted(epoch0) == list(range(100))
+
+    partial = iter(sampler)
+    consumed = [next(partial) for _ in range(30)]
+    state = sampler.state_dict(position=30)
+    remaining = list(partial)
+    epoch2 = list(sampler)
+
+    restored = ResumableSampler(None, 100)
+    restored.load_state_dict(state)
+    assert list(restored) == remaining
+    assert list(restored) == epoch2
+    assert consumed + remaining != epoch0
+
+
+def test_resumable_sampler_wraps_sampler():
+    targets = np.tile(np.arange(4), 100)
+    quality = np.repeat([75, 90], 200)
+    sampler = ResumableSampler(BalancedQFSampler(targets, quality, batch_size=8), len(targets))
+
+    list(sampler)
+    epoch1 = list(sampler)
+    state = sampler.state_dict(position=16)
+
+    restored = ResumableSampler(BalancedQFSampler(targets, quality, batch_size=8), len(targets))
+    restored.load_state_dict(state)
+    assert list(restored) == epoch1[16:]
+
+    restored.load_state_dict(sampler.state_dict())
+    assert list(restored) == list(sampler)
+
+
+def test_rng_state():
+    rng_state = get_rng_state()
+    expected = random.random(), np.random.rand(), torch.rand(1).item()
+    set_rng_state(rng_state)
+    assert (random.random(), np.random.rand(), torch.rand(1).item()) == expected
+
+
+def _train(logdir, num_epochs, resume, stop_after=None):
+    from catalyst.dl import Callback, CallbackOrder, SupervisedRunner
+
+    class RecordEpochs(Callback):
+        def __init__(self):
+            super().__init__(CallbackOrder.Other)
+            self.epochs = []
+
+        def on_epoch_end(self, state):
+            self.epochs.append(state.epoch)
+            if stop_after is not None and len(self.epochs) == stop_after:
+                state.early_stop = True
+
+    generator = torch.Generator().manual_seed(0)
+    x = torch.randn((32, 4), generator=generator)
+    samples = [{"features": x[i], "targets": x[i].sum(dim=0, keepdim=True)} for i in range(len(x))]
+    sampler = ResumableSampler(None, len(samples), seed=0)
+    loaders = collections.OrderedDict(
+        train=DataLoader(samples, batch_size=8, sampler=sampler), valid=DataLoader(samples, batch_size=8)
+    )
+
+    torch.manual_seed(0)
+    model = nn.Linear(4, 1)
+    optimizer = torch.optim.SGD(model.parameters(), lr=0.1)
+    scheduler = torch.optim.lr_scheduler.StepLR(optimizer, step_size=1, gamma=0.5)
+    record = RecordEpochs()
+
+    SupervisedRunner().train(
+        model=model,
+        criterion=nn.MSELoss(),
+        optimizer=optimizer,
+        scheduler=scheduler,
+        loaders=loaders,
+        callbacks=[ResumeCallback(os.path.join(logdir, "resume.pth"), sampler, resume=resume, save_every=0), record],
+        logdir=logdir,
+        num_epochs=num_epochs,
+        verbose=False,
+    )
+    return model, scheduler, record.epochs
+
+
+def test_resume_finished_stage_runs_no_epochs(tmp_path):
+    _, _, epochs = _train(str(tmp_path), num_epochs=3, resume=False)
+    assert epochs == [0, 1, 2]
+
+    _, scheduler, epochs = _train(str(tmp_path), num_epochs=3, resume=True)
+    assert epochs == []
+    assert scheduler.last_epoch == 3
+
+
+def test_resume_preempted_stage_runs_remaining_epochs(tmp_path):
+    expected_model, expected_scheduler, _ = _train(str(tmp_path / "reference"), num_epochs=3, resume=False)
+
+    _, _, epochs = _train(str(tmp_path / "resumed"), num_epochs=3, resume=False, stop_after=2)
+    assert epochs == [0, 1]
+
+    model, scheduler, epochs = _train(str(tmp_path / "resumed"), num_epochs=3, resume=True)
+    assert epochs == [2]
+    assert scheduler.last_epoch == expected_scheduler.last_epoch
+    for actual, expected in zip(model.parameters(), expected_model.parameters()):
+        torch.testing.assert_allclose(actual, expected)
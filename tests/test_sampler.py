@@ -0,0 +1,42 @@
+import numpy as np
+
+from alaska2.sampler import BalancedQFSampler
+
+
+def _make_labels():
+    targets = np.tile(np.arange(4), 300)
+    quality = np.repeat([75, 90, 95], 400)
+    return targets, quality
+
+
+def test_batches_are_homogeneous_and_balanced():
+    targets, quality = _make_labels()
+    sampler = BalancedQFSampler(targets, quality, batch_size=16)
+    indexes = np.array(list(sampler))
+
+    assert len(indexes) == len(sampler) == 1200 - 1200 % 16
+    for batch in indexes.reshape(-1, 16):
+        assert len(np.unique(quality[batch])) == 1
+        np.testing.assert_array_equal(np.bincount(targets[batch], minlength=4), [4, 4, 4, 4])
+
+
+def test_replicas_are_disjoint_and_deterministic():
+    targets, quality = _make_labels()
+    replicas = [BalancedQFSampler(targets, quality, batch_size=8, num_replicas=2, rank=rank) for rank in range(2)]
+
+    epoch0 = [list(sampler) for sampler in replicas]
+    assert len(epoch0[0]) == len(epoch0[1])
+    assert len(set(epoch0[0]) & set(epoch0[1])) == 0
+
+    epoch1 = list(replicas[0])
+    assert epoch1 != epoch0[0]
+
+    replicas[0].set_epoch(0)
+    assert list(replicas[0]) == epoch0[0]
+
+
+def test_odd_batch_size():
+    targets, quality = _make_labels()
+    sampler = BalancedQFSampler(targets, quality, batch_size=6)
+    for batch in np.array(list(sampler)).reshape(-1, 6):
+        assert np.bincount(targets[batch], minlength=4).max() <= 2
@@ -0,0 +1,41 @@
+import numpy as np
+import pandas as pd
+
+from alaska2.submissions import (
+    batch_classifier_probas,
+    batch_parse_classifier_probas,
+    batch_sigmoid,
+    batch_temperature_scaling,
+    classifier_probas,
+    parse_classifier_probas,
+    sigmoid,
+    temperature_scaling,
+)
+
+
+def test_batch_transforms_match_per_row():
+    flag = pd.Series(np.random.randn(100) * 5)
+    flag[3] = np.nan
+    np.testing.assert_allclose(batch_sigmoid(flag), flag.apply(sigmoid).values, rtol=1e-6)
+    assert batch_sigmoid(flag)[3] == 1.0
+
+    logits = np.random.randn(100, 4).astype(np.float32)
+    legacy_column = pd.Series([str(x.tolist()) for x in logits])
+    np.testing.assert_allclose(
+        batch_parse_classifier_probas(legacy_column), legacy_column.apply(parse_classifier_probas).values, rtol=1e-5
+    )
+    np.testing.assert_allclose(
+        batch_parse_classifier_probas(pd.Series(list(logits))),
+        legacy_column.apply(parse_classifier_probas).values,
+        rtol=1e-5,
+    )
+
+    logits[5, 2] = np.nan
+    expected = np.array([classifier_probas(x) for x in logits])
+    np.testing.assert_allclose(batch_classifier_probas(logits), expected, rtol=1e-5)
+    assert batch_classifier_probas(logits)[5] == 1.0
+
+    probas = np.random.rand(100)
+    np.testing.assert_allclose(
+        batch_temperature_scaling(probas, 0.5), [temperature_scaling(x, 0.5) for x in probas], rtol=1e-6
+    )
@@ -3,12 +3,10 @@ from __future__ import absolute_import
 import argparse
 import collections
 import gc
-import itertools
 import json
 import os
 from datetime import datetime
 
-import numpy as np
 from catalyst.dl import SupervisedRunner, OptimizerCallback, SchedulerCallback
 from catalyst.utils import load_checkpoint, unpack_checkpoint
 from pytorch_toolbelt.optimization.functional import get_optimizable_parameters
@@ -23,37 +21,10 @@ from pytorch_toolbelt.utils.random import set_manual_seed
 from pytorch_toolbelt.utils.torch_utils import count_parameters, transfer_weights
 from torch import nn
 from torch.utils.data import DataLoader
-from torch.utils.data.dataloader import default_collate
 
 from alaska2 import *
 
 
-def paired_collate(input):
-    input = default_collate(input)
-
-    input[INPUT_IMAGE_ID_KEY] = list(itertools.chain(*zip(*input[INPUT_IMAGE_ID_KEY])))
-    input[INPUT_IMAGE_ID_KEY] = np.array(input[INPUT_IMAGE_ID_KEY])
-    input[INPUT_IMAGE_ID_KEY] = np.concatenate(
-        [input[INPUT_IMAGE_ID_KEY][0::2], input[INPUT_IMAGE_ID_KEY][1::2]]
-    ).tolist()
-
-    for feature_key in [
-        INPUT_TRUE_MODIFICATION_FLAG,
-        INPUT_TRUE_MODIFICATION_TYPE,
-        INPUT_IMAGE_KEY,
-        INPUT_IMAGE_QF_KEY,
-        INPUT_FEATURES_DCT_KEY,
-        INPUT_FEATURES_ELA_KEY,
-        INPUT_FEATURES_ELA_RICH_KEY,
-        INPUT_FEATURES_JPEG_FLOAT,
-    ]:
-        if feature_key in input:
-            input[feature_key] = torch.cat([input[feature_key][:, 0, ...], input[feature_key][:, 1, ...]], dim=0)
-
-    input[INPUT_TRUE_MODIFICATION_FLAG] = input[INPUT_TRUE_MODIFICATION_FLAG].unsqueeze(-1)
-    return input
-
-
 def main():
     parser = argparse.ArgumentParser()
     parser.add_argument("-acc", "--accumulation-steps", type=int, default=1, help="Number of batches to process")
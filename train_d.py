@@ -20,7 +20,7 @@ from pytorch_toolbelt.utils.catalyst import (
 from pytorch_toolbelt.utils.random import set_manual_seed
 from pytorch_toolbelt.utils.torch_utils import count_parameters, transfer_weights
 from torch import nn
-from torch.utils.data import DataLoader, DistributedSampler
+from torch.utils.data import DistributedSampler
 
 from alaska2 import *
 
@@ -39,7 +39,18 @@ def main():
     parser.add_argument("-nid", "--negative-image-dir", type=str, default=None, help="Change of obliteration")
     parser.add_argument("-v", "--verbose", action="store_true")
     parser.add_argument("--fast", action="store_true")
-    parser.add_argument("--cache", action="store_true")
+    parser.add_argument("--cache", action="store_true", help="Use persistent cache of ELA/blur/residual features")
+    parser.add_argument("--cache-size", type=float, default=None, help="Max size of feature cache (Gb)")
+    parser.add_argument(
+        "--gpu-augmentations",
+        action="store_true",
+        help="Apply D4 / dropout augmentations to the batch on GPU instead of data loader workers",
+    )
+    parser.add_argument(
+        "--compact-loader",
+        action="store_true",
+        help="Transfer integer features as uint8/int16 and prefetch batches to GPU on a side stream",
+    )
     parser.add_argument("-dd", "--data-dir", type=str, default=os.environ.get("KAGGLE_2020_ALASKA2"))
     parser.add_argument("-m", "--model", type=str, default="resnet34", help="")
     parser.add_argument("-b", "--batch-size", type=int, default=16, help="Batch Size during training, e.g. -b 64")
@@ -87,7 +98,17 @@ def main():
     parser.add_argument("-wd", "--weight-decay", default=0, type=float, help="L2 weight decay")
     parser.add_argument("--show", action="store_true")
     parser.add_argument("--balance", action="store_true")
+    parser.add_argument("--hard-mining", action="store_true", help="Oversample training samples with high loss")
+    parser.add_argument(
+        "--mining-temperature", default=1.0, type=float, help="Temperature of hard example sampler (Lower is harder)"
+    )
     parser.add_argument("--freeze-bn", action="store_true")
+    parser.add_argument(
+        "--resume", action="store_true", help="Continue interrupted training in runs/<experiment> (Requires -x)"
+    )
+    parser.add_argument(
+        "--resume-every", default=500, type=int, help="Save resume checkpoint every N batches (0 - every epoch)"
+    )
 
     args = parser.parse_args()
     args.is_master = args.local_rank == 0
@@ -118,6 +139,9 @@ def main():
 
     data_dir = args.data_dir
     cache = args.cache
+    feature_cache = (
+        FeatureCache(os.path.join(data_dir, "feature_cache"), max_size_gb=args.cache_size) if cache else None
+    )
     num_workers = args.workers
     num_epochs = args.epochs
     learning_rate = args.learning_rate
@@ -126,6 +150,8 @@ def main():
     image_size = (512, 512)
     fast = args.fast
     augmentations = args.augmentations
+    gpu_augmentations = args.gpu_augmentations
+    compact_loader = args.compact_loader
     fp16 = args.fp16
     scheduler_name = args.scheduler
     experiment = args.experiment
@@ -137,7 +163,11 @@ def main():
     weight_decay = args.weight_decay
     fold = args.fold
     balance = args.balance
+    hard_mining = args.hard_mining
+    mining_temperature = args.mining_temperature
     freeze_bn = args.freeze_bn
+    resume = args.resume
+    resume_every = args.resume_every
     train_batch_size = args.batch_size
     mixup = args.mixup
     cutmix = args.cutmix
@@ -208,8 +238,11 @@ def main():
     if experiment is not None:
         checkpoint_prefix = experiment
 
+    if resume and experiment is None:
+        raise ValueError("Resuming training requires experiment name (-x)")
+
     log_dir = os.path.join("runs", checkpoint_prefix)
-    os.makedirs(log_dir, exist_ok=False)
+    os.makedirs(log_dir, exist_ok=resume)
 
     config_fname = os.path.join(log_dir, f"{checkpoint_prefix}.json")
     with open(config_fname, "w") as f:
@@ -224,12 +257,16 @@ def main():
     if run_train:
         train_ds, valid_ds, train_sampler = get_datasets(
             data_dir=data_dir,
-            augmentation=augmentations,
+            augmentation="none" if gpu_augmentations else augmentations,
             balance=balance,
+            batch_size=train_batch_size,
+            world_size=args.world_size,
+            local_rank=args.local_rank,
             fast=fast,
             fold=fold,
             features=required_features,
             obliterate_p=obliterate_p,
+            feature_cache=feature_cache,
         )
 
         if negative_image_dir:
@@ -240,6 +277,18 @@ def main():
             train_sampler = None  # TODO: Add proper support of sampler
             print("Adding", len(negatives_ds), "negative samples to training set")
 
+        mining_callbacks = []
+        mining_stateful = {}
+        if hard_mining:
+            if balance or negative_image_dir:
+                raise ValueError("Hard example mining cannot be used together with --balance or negative images")
+            loss_tracker = SampleLossTracker(len(train_ds))
+            train_sampler = HardExampleSampler(
+                loss_tracker, temperature=mining_temperature, num_replicas=args.world_size, rank=args.local_rank
+            )
+            mining_callbacks = [HardExampleMiningCallback(loss_tracker, train_sampler)]
+            mining_stateful = {"loss_tracker": loss_tracker, "hard_example_sampler": train_sampler}
+
         criterions_dict, loss_callbacks = get_criterions(
             modification_flag=modification_flag_loss,
             modification_type=modification_type_loss,
@@ -255,7 +304,9 @@ def main():
 
         callbacks = (
             default_callbacks
+            + (get_batch_augmentation_callbacks(augmentations, required_features) if gpu_augmentations else [])
             + loss_callbacks
+            + mining_callbacks
             + [
                 OptimizerCallback(accumulation_steps=accumulation_steps, decouple_weight_decay=False),
                 HyperParametersCallback(
@@ -271,19 +322,36 @@ def main():
             ]
         )
 
+        if train_sampler is None:
+            train_sampler = DistributedSampler(train_ds, args.world_size, args.local_rank)
+        train_sampler = ResumableSampler(train_sampler, len(train_ds), seed=args.seed)
+        callbacks += [
+            # Each replica has its own order of samples & RNG state
+            ResumeCallback(
+                os.path.join(log_dir, "main", "checkpoints", f"resume_rank{args.local_rank}.pth"),
+                sampler=train_sampler,
+                resume=resume,
+                save_every=resume_every,
+                fp16=fp16,
+                stateful=mining_stateful,
+            )
+        ]
+
         loaders = collections.OrderedDict()
-        loaders["train"] = DataLoader(
+        loaders["train"] = get_data_loader(
             train_ds,
+            compact=compact_loader,
             batch_size=train_batch_size,
             num_workers=num_workers,
             pin_memory=True,
             drop_last=True,
             shuffle=False,
-            sampler=DistributedSampler(train_ds, args.world_size, args.local_rank),
+            sampler=train_sampler,
         )
 
-        loaders["valid"] = DataLoader(
+        loaders["valid"] = get_data_loader(
             valid_ds,
+            compact=compact_loader,
             batch_size=valid_batch_size,
             num_workers=num_workers,
             pin_memory=True,
@@ -301,13 +369,14 @@ def main():
         print("  Log dir        :", log_dir)
         print("  Cache          :", cache)
         print("Data              ")
-        print("  Augmentations  :", augmentations)
+        print("  Augmentations  :", augmentations, "(GPU)" if gpu_augmentations else "")
         print("  Obliterate (%) :", obliterate_p)
         print("  Negative images:", negative_image_dir)
         print("  Train size     :", len(loaders["train"]), "batches", len(train_ds), "samples")
         print("  Valid size     :", len(loaders["valid"]), "batches", len(valid_ds), "samples")
         print("  Image size     :", image_size)
         print("  Balance        :", balance)
+        print("  Hard mining    :", hard_mining, f"(T={mining_temperature})" if hard_mining else "")
         print("  Mixup          :", mixup)
         print("  CutMix         :", cutmix)
         print("  TSA            :", tsa)
@@ -23,7 +23,6 @@ from torch import nn
 from torch.utils.data import DataLoader, DistributedSampler
 
 from alaska2 import *
-from train2 import paired_collate
 
 
 def main():
@@ -42,6 +41,9 @@ def main():
     parser.add_argument("--fast", action="store_true")
     parser.add_argument("--cache", action="store_true")
     parser.add_argument("--bitmix", action="store_true")
+    parser.add_argument(
+        "--multi-stego", action="store_true", help="Load each cover once together with all it's stego images"
+    )
     parser.add_argument("-dd", "--data-dir", type=str, default=os.environ.get("KAGGLE_2020_ALASKA2"))
     parser.add_argument("-m", "--model", type=str, default="resnet34", help="")
     parser.add_argument("-b", "--batch-size", type=int, default=16, help="Batch Size during training, e.g. -b 64")
@@ -226,6 +228,7 @@ def main():
             fast=fast,
             fold=fold,
             features=required_features,
+            multi_stego=args.multi_stego,
         )
 
         criterions_dict, loss_callbacks = get_criterions(
@@ -262,7 +265,7 @@ def main():
         loaders = collections.OrderedDict()
         loaders["train"] = DataLoader(
             train_ds,
-            batch_size=train_batch_size // 2,
+            batch_size=train_batch_size // (4 if args.multi_stego else 2),
             num_workers=num_workers,
             pin_memory=True,
             drop_last=True,